@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class AnalyzerConfig(AppConfig):
     name = 'analyzer'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from analyzer.indexing import mark_dirty_on_commit
+        from analyzer.models import Article
+
+        # search documents are indexed in bulk, see analyzer.tasks.flush_search_index
+        post_save.connect(mark_dirty_on_commit, sender=Article)
+        post_delete.connect(mark_dirty_on_commit, sender=Article)
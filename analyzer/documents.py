@@ -18,11 +18,22 @@ class ArticleDocument(Document):
         settings = {"number_of_shards": 1, "number_of_replicas": 0}
 
     id = fields.KeywordField()
+    # near-duplicate cluster, search results can be collapsed on it
+    cluster_id = fields.KeywordField()
     url = fields.TextField()
     title = fields.TextField(analyzer=strp_html, fields={"raw": fields.KeywordField()})
     author = fields.TextField(analyzer=strp_html, fields={"raw": fields.KeywordField()})
     publication_date = fields.DateField()
-    overall_sentiment = fields.ObjectField()
+    overall_sentiment = fields.ObjectField(
+        properties={
+            "label": fields.KeywordField(),
+            "avg": fields.FloatField(),
+            "std": fields.FloatField(),
+            "sentences": fields.IntegerField(),
+            "positive": fields.IntegerField(),
+            "negative": fields.IntegerField(),
+        }
+    )
     sentiment = fields.ObjectField(properties={
         "sentence": fields.TextField(),
         "sentiment": fields.ObjectField()
@@ -30,9 +41,15 @@ class ArticleDocument(Document):
     keywords = fields.NestedField(properties={"key": fields.KeywordField()})
     body = fields.TextField(analyzer=strp_html, fields={"raw": fields.TextField()})
 
+    def get_queryset(self):
+        return super().get_queryset().select_related("rss_entry")
+
     def prepare_url(self, instance):
         return instance.url
 
+    def prepare_cluster_id(self, instance):
+        return str(instance.cluster_id or instance.id)
+
     def prepare_keywords(self, instance):
         return [{"key": kw} for kw in instance.keywords]
 
@@ -44,9 +61,7 @@ class ArticleDocument(Document):
 
     def prepare_sentiment(self, instance):
         # convert it to a list of [{sentence, sentiment}] dictionaries
-        return [
-            {"sentence": k, "sentiment": v} for (k, v) in instance.sentiment.items()
-        ]
+        return [{"sentence": k, "sentiment": v} for (k, v) in instance.sentences]
 
     class Django:
         model = Article
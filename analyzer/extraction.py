@@ -0,0 +1,161 @@
+import re
+from collections import Counter
+
+import lxml.html
+from lxml import etree
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# elements whose contents are not human readable article text
+NON_TEXT_TAGS = ("script", "style", "template")
+
+
+def find_title(soup):
+    """Use BeautifulSoup to find the article title"""
+    possible_titles = []
+
+    # check <head><title>
+    head_titles = soup.head.find_all("title")
+    for head_title in head_titles:
+        if head_title.string:
+            possible_titles.append(head_title.string)
+
+    # check <meta content="Title" name=".*title" />
+    meta_names = soup.find_all("meta", attrs={"name": re.compile(r".*title")})
+    for meta_name in meta_names:
+        if meta_name.get("content"):
+            possible_titles.append(meta_name["content"])
+
+    # check <meta content="Title" property=".*title" />
+    meta_names = soup.find_all("meta", attrs={"property": re.compile(r".*title")})
+    for meta_name in meta_names:
+        if meta_name.get("content"):
+            possible_titles.append(meta_name["content"])
+
+    title = None
+    if len(possible_titles):
+        # trim all leading and trailing whitespace from candidates
+        possible_titles = [pt.strip() for pt in possible_titles]
+        title, _ = Counter(possible_titles).most_common(n=1)[0]
+    return title
+
+
+def find_keywords(soup):
+    """Use BeautifulSoup to find the article search keywords"""
+    keywords = []
+
+    # check <meta name=".*keywords">
+    tag = soup.find("meta", attrs={"name": re.compile(r".*keywords")})
+    if tag and tag.get("content"):
+        keywords.extend(tag["content"].split(","))
+
+    keywords = [kw.strip() for kw in keywords]
+    return keywords
+
+
+def find_author(soup):
+    """Use BeautifulSoup to find who wrote the article"""
+
+    # check <meta content="Name" name=".*author" />
+    tag = soup.find("meta", attrs={"name": re.compile(r".*author")})
+    if tag and tag.get("content"):
+        return tag["content"].strip()
+
+    return None
+
+
+def find_article_body(soup):
+    """Return the relevant part of the article as human readable text."""
+    article_tags = soup.find_all("article")
+    body = []
+    for article_tag in article_tags:
+        body.extend(
+            string
+            for string in article_tag.strings
+            if string.parent.name not in NON_TEXT_TAGS
+        )
+
+    if body:
+        body = [line.strip() for line in body]
+        body = [line for line in body if line]
+        return " ".join(body)
+    return None
+
+
+def extract_soup(raw_html):
+    """Extract the Article fields using BeautifulSoup's html.parser tree"""
+    soup = BeautifulSoup(raw_html, "html.parser")
+    return {
+        "title": find_title(soup),
+        "keywords": find_keywords(soup),
+        "author": find_author(soup),
+        "body": find_article_body(soup),
+    }
+
+
+def extract_lxml(raw_html):
+    """Extract the Article fields in a single pass over an lxml (libxml2) tree"""
+    try:
+        root = lxml.html.document_fromstring(raw_html)
+    except ValueError:
+        # unicode strings with an XML encoding declaration must be bytes
+        root = lxml.html.document_fromstring(raw_html.encode("utf-8"))
+    etree.strip_elements(root, etree.Comment, *NON_TEXT_TAGS, with_tail=False)
+
+    head_titles = []
+    meta_name_titles = []
+    meta_property_titles = []
+    keywords = None
+    author = None
+    body = []
+    for el in root.iter("title", "meta", "article"):
+        if el.tag == "title":
+            # only <head><title>, not ie. <svg><title>
+            if el.text and next(el.iterancestors("head"), None) is not None:
+                if len(el) == 0:
+                    head_titles.append(el.text)
+        elif el.tag == "meta":
+            name = el.get("name")
+            content = el.get("content")
+            if name is not None:
+                if content and "title" in name:
+                    meta_name_titles.append(content)
+                if keywords is None and "keywords" in name:
+                    keywords = content or ""
+                if author is None and "author" in name:
+                    author = content or ""
+            prop = el.get("property")
+            if prop is not None and content and "title" in prop:
+                meta_property_titles.append(content)
+        else:
+            body.extend(el.itertext())
+
+    title = None
+    possible_titles = head_titles + meta_name_titles + meta_property_titles
+    if possible_titles:
+        possible_titles = [pt.strip() for pt in possible_titles]
+        title, _ = Counter(possible_titles).most_common(n=1)[0]
+
+    body = [line.strip() for line in body]
+    body = [line for line in body if line]
+
+    return {
+        "title": title,
+        "keywords": [kw.strip() for kw in keywords.split(",")] if keywords else [],
+        "author": author.strip() if author else None,
+        "body": " ".join(body) if body else None,
+    }
+
+
+EXTRACTION_BACKENDS = {"bs4": extract_soup, "lxml": extract_lxml}
+
+
+def extract_article(raw_html, backend=None):
+    """Extract the Article fields from raw HTML with the configured backend"""
+    backend = backend or settings.HTML_EXTRACTION_BACKEND
+    try:
+        extract = EXTRACTION_BACKENDS[backend]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown HTML_EXTRACTION_BACKEND `{backend}`")
+    return extract(raw_html)
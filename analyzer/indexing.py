@@ -0,0 +1,71 @@
+from time import monotonic
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db import transaction
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl.connections import connections
+from semscrape import metrics
+from semscrape.redis_client import get_redis
+
+from analyzer.documents import ArticleDocument
+
+logger = get_task_logger(__name__)
+
+# redis set of Article ids whose search document is out of date
+DIRTY_ARTICLES_KEY = "analyzer:index:dirty"
+
+
+def mark_dirty(article_ids):
+    """Queue the Articles for (re)indexing on the next flush."""
+    article_ids = [str(article_id) for article_id in article_ids]
+    if article_ids:
+        get_redis().sadd(DIRTY_ARTICLES_KEY, *article_ids)
+
+
+def mark_dirty_on_commit(sender, instance, **kwargs):
+    """Article post_save/post_delete receiver, queued once the write is visible."""
+    article_id = instance.pk  # deletion clears the pk before the commit
+    transaction.on_commit(lambda: mark_dirty([article_id]))
+
+
+def index_articles(article_ids):
+    """Bulk index the Articles, deleting the documents of Articles that are gone."""
+    articles = list(ArticleDocument().get_queryset().filter(pk__in=article_ids))
+    indexed, _ = ArticleDocument().update(articles, refresh=False)
+
+    missing_ids = set(article_ids) - {str(article.pk) for article in articles}
+    deleted = 0
+    if missing_ids:
+        actions = [
+            {"_op_type": "delete", "_index": ArticleDocument._index._name, "_id": pk}
+            for pk in missing_ids
+        ]
+        deleted, _ = bulk(connections.get_connection(), actions, raise_on_error=False)
+    return indexed, deleted
+
+
+def flush_dirty_articles(batch_size=None, time_limit=None):
+    """Index queued Articles in bulk batches until empty or out of time."""
+    batch_size = batch_size or settings.SEARCH_INDEX_BATCH_SIZE
+    time_limit = time_limit or settings.SEARCH_INDEX_FLUSH_SECONDS
+    deadline = monotonic() + time_limit
+
+    total = 0
+    while monotonic() < deadline:
+        article_ids = get_redis().spop(DIRTY_ARTICLES_KEY, batch_size)
+        if not article_ids:
+            break
+        article_ids = [article_id.decode() for article_id in article_ids]
+        try:
+            with metrics.timer("search_index_seconds"):
+                indexed, deleted = index_articles(article_ids)
+        except Exception as e:
+            # put the batch back so that the next flush retries it
+            logger.warn(f"Failed to index {len(article_ids)} articles: {e}")
+            mark_dirty(article_ids)
+            break
+        metrics.incr("search_indexed_articles_total", indexed)
+        metrics.incr("search_deleted_articles_total", deleted)
+        total += indexed + deleted
+    return total
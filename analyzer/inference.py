@@ -0,0 +1,144 @@
+import threading
+
+import nltk.data
+from celery.signals import worker_process_init
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from semscrape import metrics
+from transformers import AutoTokenizer
+
+from analyzer.preprocessing import bucket_batches
+from analyzer.sentence_cache import get_sentence_cache
+from analyzer.sentiment_backends import load_sentiment_backend
+
+logger = get_task_logger(__name__)
+
+# process level registry of loaded models, populated lazily or at worker init
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def configure_threads():
+    """Limit torch to SENTIMENT_THREADS, so worker processes don't oversubscribe."""
+    threads = settings.SENTIMENT_THREADS
+    if not threads:
+        return
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # can only be set once, before any inter-op parallel work
+        pass
+
+
+def _load(name):
+    """Deserialize the named model from disk, this is time-consuming."""
+    if name == "sentence_tokenizer":
+        return nltk.data.load(settings.SENTENCE_TOKENIZER)
+    if name == "sentiment_tokenizer":
+        return AutoTokenizer.from_pretrained(settings.SENTIMENT_MODEL)
+    if name == "sentiment_analyzer":
+        configure_threads()
+        return load_sentiment_backend()
+    raise KeyError(f"Unknown model `{name}`")
+
+
+def get_model(name):
+    """Return the named model, loading it once per process."""
+    model = _registry.get(name)
+    if model is None:
+        with _registry_lock:
+            model = _registry.get(name)
+            if model is None:
+                model = _registry[name] = _load(name)
+    return model
+
+
+def get_sentence_tokenizer():
+    """Return the process-wide punkt sentence tokenizer."""
+    return get_model("sentence_tokenizer")
+
+
+def get_sentiment_analyzer():
+    """Return the process-wide sentiment classifier of the SENTIMENT_BACKEND."""
+    return get_model("sentiment_analyzer")
+
+
+def reload_models(*names):
+    """Drop the named (default all) models and load them again."""
+    with _registry_lock:
+        names = names or tuple(_registry.keys())
+        for name in names:
+            _registry.pop(name, None)
+    for name in names:
+        get_model(name)
+
+
+def warm_models():
+    """Load all of the models used by the analyzer tasks into this process."""
+    get_sentence_tokenizer()
+    get_sentiment_analyzer()
+    if settings.SENTENCE_TOKEN_COUNTER == "model":
+        get_model("sentiment_tokenizer")
+
+
+@worker_process_init.connect
+def warm_models_on_worker_init(**kwargs):
+    """Load the models once when a celery (prefork) child process starts."""
+    if not settings.SENTIMENT_PRELOAD:
+        if settings.PIPELINE_FUSED:
+            # fused crawl workers score in their tasks, see docker-compose.fused.yml
+            logger.warn(
+                "PIPELINE_FUSED without SENTIMENT_PRELOAD, models load in tasks"
+            )
+        return
+    try:
+        warm_models()
+    except Exception as e:
+        # tasks will retry the load lazily, don't kill the worker process
+        logger.warn(f"Failed to warm sentiment models: {e}")
+
+
+def analyze_batches(sentences, batch_size=None):
+    """Run the sentiment pipeline over sentences in token length bucketed batches.
+
+    Bucketing keeps similarly sized sentences in the same padded batch, outputs
+    are returned in the same order as the input sentences.
+    """
+    sentiment_analyzer = get_sentiment_analyzer()
+
+    outputs = [None] * len(sentences)
+    for batch_idxs in bucket_batches(sentences, batch_size=batch_size):
+        with metrics.timer("analyzer_inference_seconds"):
+            batch_outputs = sentiment_analyzer([sentences[idx] for idx in batch_idxs])
+        metrics.observe(
+            "analyzer_inference_batch_size", len(batch_idxs), metrics.SIZE_BUCKETS
+        )
+        metrics.incr("analyzer_inferred_sentences_total", len(batch_idxs))
+        for idx, output in zip(batch_idxs, batch_outputs):
+            outputs[idx] = output
+    return outputs
+
+
+def analyze_sentences(sentences, batch_size=None, known=None):
+    """Return the sentiment output of each sentence, in order.
+
+    Repeated and previously cached sentences are only run through the model once.
+    `known` optionally maps sentences to outputs already computed elsewhere, ie.
+    from a near-duplicate article.
+    """
+    cache = None
+    cached = dict(known or {})
+    if settings.SENTIMENT_CACHE_ENABLED:
+        cache = get_sentence_cache()
+        cached.update(cache.get_many(set(sentences) - cached.keys()))
+
+    pending = list(dict.fromkeys(s for s in sentences if s not in cached))
+    metrics.incr("analyzer_reused_sentences_total", len(sentences) - len(pending))
+    inferred = dict(zip(pending, analyze_batches(pending, batch_size=batch_size)))
+    if cache is not None:
+        cache.set_many(inferred)
+
+    return [cached[s] if s in cached else inferred[s] for s in sentences]
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from analyzer.models import Article
+
+MINHASH_FIELDS = ["minhash", "lsh_bands", "cluster_id"]
+
+
+class Command(BaseCommand):
+    help = "Compute MinHash signatures and near-duplicate clusters of Articles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        # articles are clustered in order, a cluster is led by its earliest article
+        articles = (
+            Article.objects.filter(minhash__isnull=True)
+            .exclude(body__isnull=True)
+            .exclude(body__exact="")
+            .earliest_first()
+            .only("id", "rss_entry_id", "body")
+        )
+
+        updated = 0
+        clustered = 0
+        for article in articles.iterator(chunk_size=options["chunk_size"]):
+            article.set_minhash()
+            near_duplicate = article.find_near_duplicate()
+            if near_duplicate is not None:
+                article.cluster_id = near_duplicate.cluster_id or near_duplicate.pk
+                clustered += 1
+            # saving queues the article for reindexing
+            article.save(update_fields=MINHASH_FIELDS)
+            updated += 1
+        self.stdout.write(
+            f"Computed MinHash of {updated} articles, {clustered} near-duplicates"
+        )
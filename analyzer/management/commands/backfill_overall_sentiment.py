@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from analyzer.indexing import mark_dirty
+from analyzer.models import Article
+
+OVERALL_SENTIMENT_FIELDS = [
+    "sentiment_label",
+    "sentiment_avg",
+    "sentiment_std",
+    "sentence_count",
+    "positive_count",
+    "negative_count",
+]
+
+
+class Command(BaseCommand):
+    help = "Compute the overall sentiment columns from the Article sentence arrays."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every article, not only those missing the columns.",
+        )
+
+    def handle(self, *args, **options):
+        articles = Article.objects.exclude(sentence_scores=[])
+        if not options["all"]:
+            articles = articles.filter(sentence_count=0)
+        articles = articles.only("id", "sentence_positive", "sentence_scores")
+
+        updated = 0
+        chunk = []
+        for article in articles.iterator(chunk_size=options["chunk_size"]):
+            article.update_overall_sentiment()
+            chunk.append(article)
+            if len(chunk) >= options["chunk_size"]:
+                updated += self.save_chunk(chunk)
+                chunk = []
+        updated += self.save_chunk(chunk)
+        self.stdout.write(f"Updated overall sentiment of {updated} articles")
+
+    def save_chunk(self, articles):
+        Article.objects.bulk_update(articles, OVERALL_SENTIMENT_FIELDS)
+        mark_dirty([article.pk for article in articles])
+        return len(articles)
@@ -0,0 +1,30 @@
+from crawler.models import RSSEntry
+from semscrape.backfill import BackfillCommand
+
+from analyzer.tasks import parse_html_entry
+
+
+class Command(BackfillCommand):
+    help = "Parse fetched HTML into Articles in resumable chunks."
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Parse every HTML entry again, ie. after an extraction change.",
+        )
+
+    def get_queryset(self, options):
+        rss_entries = RSSEntry.objects.filter(
+            is_html=True, canonical_entry__isnull=True
+        ).exclude(stage=RSSEntry.Stage.NEW)
+        if not options["all"]:
+            rss_entries = rss_entries.filter(stage=RSSEntry.Stage.FETCHED)
+        return rss_entries
+
+    @classmethod
+    def process_chunk(cls, pks, options):
+        for rss_entry_id in pks:
+            parse_html_entry(rss_entry_id)
+        return len(pks)
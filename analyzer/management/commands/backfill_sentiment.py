@@ -0,0 +1,30 @@
+from semscrape.backfill import BackfillCommand
+
+from analyzer.models import Article
+from analyzer.tasks import compute_sentiments
+
+
+class Command(BackfillCommand):
+    help = "Score the sentiment of Articles in resumable chunks."
+    chunk_size = 100
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Score every article again, ie. after a model change.",
+        )
+
+    def get_queryset(self, options):
+        articles = Article.objects.exclude(body__isnull=True).exclude(body__exact="")
+        if not options["all"]:
+            articles = articles.filter(sentence_count=0)
+        return articles
+
+    @classmethod
+    def process_chunk(cls, pks, options):
+        if options["all"]:
+            Article.objects.filter(pk__in=pks).clear_sentiment()
+        compute_sentiments(pks)
+        return Article.objects.filter(pk__in=pks).exclude(sentence_count=0).count()
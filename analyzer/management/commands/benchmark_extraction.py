@@ -0,0 +1,34 @@
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from analyzer.extraction import EXTRACTION_BACKENDS
+
+
+class Command(BaseCommand):
+    help = "Report the per-document parse time of each HTML extraction backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "html_files",
+            nargs="*",
+            default=[os.path.join(settings.BASE_DIR, "test_data", "sample_money.html")],
+        )
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        documents = []
+        for html_file in options["html_files"]:
+            with open(html_file) as f:
+                documents.append(f.read())
+
+        for backend, extract in EXTRACTION_BACKENDS.items():
+            start = perf_counter()
+            for _ in range(options["repeat"]):
+                for document in documents:
+                    extract(document)
+            elapsed = perf_counter() - start
+            per_doc_ms = 1000 * elapsed / (options["repeat"] * len(documents))
+            self.stdout.write(f"{backend}: {per_doc_ms:.2f} ms/document")
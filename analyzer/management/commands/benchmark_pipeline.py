@@ -0,0 +1,205 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+from time import perf_counter
+from unittest.mock import patch
+
+import numpy as np
+import redis
+from crawler.models import RSSEntry, RSSFeed
+from crawler.stub_server import StubServer
+from crawler.synthetic import synthetic_feed, synthetic_pages
+from crawler.tasks import fetch_entries, retrieve_feed_entries
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from semscrape import redis_client
+
+from analyzer.documents import ArticleDocument
+from analyzer.models import Article
+from analyzer.tasks import compute_sentiment, parse_html_entry
+
+STAGES = ["crawl", "parse", "sentiment", "index"]
+
+
+def stage_stats(latencies, elapsed, items):
+    """Return the throughput and latency percentiles of a stage's calls."""
+    latencies_ms = 1000 * np.array(latencies or [0.0])
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "seconds": elapsed,
+        "items_per_second": items / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def run_stage(calls):
+    """Time each call, calls return the count of items they processed."""
+    latencies = []
+    items = 0
+    started = perf_counter()
+    for call in calls:
+        call_started = perf_counter()
+        items += call()
+        latencies.append(perf_counter() - call_started)
+    return stage_stats(latencies, perf_counter() - started, items)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the pipeline stages over synthetic feeds served by a local stub "
+        "server, report throughput and p50/p99 latency per stage. Database writes "
+        "are rolled back and the stub host is not rate limited."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--feeds", type=int, default=4)
+        parser.add_argument("--entries", type=int, default=25, help="Per feed.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Seconds the stub server waits before each article response.",
+        )
+        parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+        parser.add_argument(
+            "--fused",
+            action="store_true",
+            help="Parse and score within the crawl stage, see PIPELINE_FUSED.",
+        )
+        parser.add_argument("--output", help="Save the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        feed_count, entry_count = options["feeds"], options["entries"]
+        pages = synthetic_pages(feed_count * entry_count, seed=options["seed"])
+        routes = {}
+        for idx, page in enumerate(pages):
+            routes[f"/article/{idx}.html"] = {
+                "body": page,
+                "delay": options["latency"],
+            }
+
+        results = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                k: options[k] for k in ["feeds", "entries", "seed", "latency", "fused"]
+            },
+            "sentiment_backend": settings.SENTIMENT_BACKEND,
+            "stages": {},
+        }
+        unthrottled = override_settings(
+            CRAWLER_HOST_RATE=1e6,
+            CRAWLER_HOST_BURST=1e6,
+            CRAWLER_CONCURRENCY_PER_HOST=settings.CRAWLER_CONCURRENCY,
+            SENTIMENT_CACHE_ENABLED=False,
+            METRICS_ENABLED=False,
+            PIPELINE_FUSED=options["fused"],
+        )
+        # the run's host state, in-flight slots and search index queue are kept out
+        # of the live pipeline's redis, in a scratch database dropped afterwards
+        scratch_redis = redis.Redis.from_url(
+            settings.REDIS_URL, db=settings.BENCHMARK_REDIS_DB
+        )
+        try:
+            # each stage is timed on its own, the next stage is not enqueued, fetches
+            # fanned out by the feeds run within the crawl stage
+            with StubServer(routes) as server, unthrottled, patch.object(
+                redis_client, "_client", scratch_redis
+            ), patch.object(
+                fetch_entries, "delay", side_effect=fetch_entries
+            ), patch.object(
+                parse_html_entry, "delay"
+            ), patch.object(
+                compute_sentiment, "delay"
+            ), transaction.atomic():
+                feeds = []
+                for feed_idx in range(feed_count):
+                    links = [
+                        server.url(f"/article/{feed_idx * entry_count + idx}.html")
+                        for idx in range(entry_count)
+                    ]
+                    server.routes[f"/feed/{feed_idx}.xml"] = {
+                        "body": synthetic_feed(f"Feed {feed_idx}", links, feed_idx),
+                        "headers": {"Content-Type": "application/rss+xml"},
+                    }
+                    feeds.append(
+                        RSSFeed.objects.create(
+                            organization="Benchmark",
+                            title=f"Feed {feed_idx}",
+                            url=server.url(f"/feed/{feed_idx}.xml"),
+                        )
+                    )
+                results["stages"] = self.run_stages(feeds, options["stages"])
+                transaction.set_rollback(True)
+        finally:
+            try:
+                scratch_redis.flushdb()
+            except redis.RedisError as e:
+                self.stderr.write(f"Scratch redis not dropped: {e}")
+
+        for stage, stats in results["stages"].items():
+            self.stdout.write(
+                f"{stage}: {stats['items']} items in {stats['seconds']:.2f}s, "
+                f"{stats['items_per_second']:.1f} items/s, "
+                f"p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms"
+            )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Saved results to {options['output']}")
+
+    def run_stages(self, feeds, stages):
+        """Run the stages in pipeline order, each over the previous one's output."""
+        entries = RSSEntry.objects.filter(feed__in=feeds)
+        articles = Article.objects.filter(rss_entry__feed__in=feeds)
+        results = {}
+
+        if "crawl" in stages:
+            # items are the entries fetched by each feed's task
+            def crawl(feed):
+                retrieve_feed_entries(feed.pk)
+                return entries.filter(feed=feed, status_code=200).count()
+
+            results["crawl"] = run_stage(lambda f=f: crawl(f) for f in feeds)
+
+        if "parse" in stages:
+            pks = list(entries.filter(stage=RSSEntry.Stage.FETCHED).values_list("pk"))
+            results["parse"] = run_stage(
+                lambda pk=pk: parse_html_entry(pk) or 1 for (pk,) in pks
+            )
+
+        if "sentiment" in stages:
+            # items are the sentences scored
+            def score(article_id):
+                compute_sentiment(article_id)
+                return Article.objects.get(pk=article_id).sentence_count
+
+            pks = list(articles.exclude(body__isnull=True).values_list("pk"))
+            results["sentiment"] = run_stage(lambda pk=pk: score(pk) for (pk,) in pks)
+
+        if "index" in stages:
+            document = ArticleDocument()
+            queryset = document.get_queryset().filter(pk__in=articles)
+            results["index"] = run_stage(
+                lambda a=a: document.prepare(a) and 1 for a in queryset
+            )
+        return results
@@ -0,0 +1,132 @@
+import multiprocessing
+import os
+import resource
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.sentiment_backends import SENTIMENT_BACKENDS
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, sentences, batch_size, repeat):
+    """Load and time one backend, run in a fresh process so RSS is its own."""
+    import django
+
+    django.setup()
+    from analyzer.sentiment_backends import load_sentiment_backend
+
+    baseline_rss = peak_rss_mb()
+    start = perf_counter()
+    classifier = load_sentiment_backend(backend)
+    load_seconds = perf_counter() - start
+
+    outputs = []
+    start = perf_counter()
+    for _ in range(repeat):
+        outputs = []
+        for idx in range(0, len(sentences), batch_size):
+            outputs.extend(classifier(sentences[idx : idx + batch_size]))
+    elapsed = perf_counter() - start
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "sentences_per_second": repeat * len(sentences) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "model_rss_mb": peak_rss_mb() - baseline_rss,
+        "outputs": outputs,
+    }
+
+
+def parity(reference, outputs):
+    """Return the label agreement and max positive score difference to reference."""
+    agree = 0
+    max_diff = 0.0
+    for expected, output in zip(reference, outputs):
+        agree += expected["label"] == output["label"]
+        expected_pos = positive_score(expected)
+        max_diff = max(max_diff, abs(expected_pos - positive_score(output)))
+    return (agree / len(reference) if reference else 1.0), max_diff
+
+
+def positive_score(output):
+    if output["label"] == "NEGATIVE":
+        return 1 - output["score"]
+    return output["score"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sentiment backends to the fp32 torch labels, report "
+        "sentences/sec and the RSS memory of a worker using each backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sentence_files",
+            nargs="*",
+            help="Files of one sentence per line, default the test_data articles.",
+        )
+        parser.add_argument(
+            "--backends", nargs="+", default=list(SENTIMENT_BACKENDS.keys())
+        )
+        parser.add_argument("--batch-size", type=int, default=32)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def load_sentences(self, sentence_files):
+        if sentence_files:
+            sentences = []
+            for sentence_file in sentence_files:
+                with open(sentence_file) as f:
+                    sentences.extend(line.strip() for line in f if line.strip())
+            return sentences
+
+        from analyzer.extraction import extract_article
+        from analyzer.inference import get_sentence_tokenizer
+
+        test_data_dir = os.path.join(settings.BASE_DIR, "test_data")
+        sentences = []
+        for name in sorted(os.listdir(test_data_dir)):
+            if name.endswith(".html"):
+                with open(os.path.join(test_data_dir, name)) as f:
+                    body = extract_article(f.read())["body"] or ""
+                sentences.extend(get_sentence_tokenizer().tokenize(body))
+        return sentences
+
+    def handle(self, *args, **options):
+        sentences = self.load_sentences(options["sentence_files"])
+        if not sentences:
+            raise CommandError("No sentences to benchmark")
+        self.stdout.write(
+            f"{len(sentences)} sentences, model {settings.SENTIMENT_MODEL}"
+        )
+
+        # torch fp32 is the reference for the parity check
+        backends = ["torch"] + [b for b in options["backends"] if b != "torch"]
+        context = multiprocessing.get_context("spawn")
+        results = []
+        for backend in backends:
+            with context.Pool(1) as pool:
+                results.append(
+                    pool.apply(
+                        run_backend,
+                        (backend, sentences, options["batch_size"], options["repeat"]),
+                    )
+                )
+
+        reference = results[0]["outputs"]
+        for result in results:
+            agreement, max_diff = parity(reference, result["outputs"])
+            self.stdout.write(
+                f"{result['backend']}: "
+                f"{result['sentences_per_second']:.1f} sentences/s, "
+                f"load {result['load_seconds']:.1f}s, "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB "
+                f"(model {result['model_rss_mb']:.0f} MB), "
+                f"label parity {agreement:.1%}, max score diff {max_diff:.3f}"
+            )
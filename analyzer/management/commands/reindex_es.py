@@ -0,0 +1,16 @@
+from semscrape.backfill import BackfillCommand
+
+from analyzer.indexing import index_articles
+from analyzer.models import Article
+
+
+class Command(BackfillCommand):
+    help = "Bulk index every Article search document in resumable chunks."
+
+    def get_queryset(self, options):
+        return Article.objects.all()
+
+    @classmethod
+    def process_chunk(cls, pks, options):
+        indexed, _ = index_articles([str(pk) for pk in pks])
+        return indexed
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analyzer", "0002_sentiment_field"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="negative_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="positive_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentence_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentiment_avg",
+            field=models.FloatField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentiment_label",
+            field=models.CharField(db_index=True, default="UNKNOWN", max_length=8),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentiment_std",
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:05
+
+import hashlib
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+
+
+# frozen copy of crawler.dedup at the time of this migration
+def body_hash(body):
+    normalized = " ".join(body.split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def backfill_body_hash(apps, schema_editor):
+    Article = apps.get_model("analyzer", "Article")
+
+    articles = Article.objects.filter(body__isnull=False).only("body")
+    chunk = []
+    for article in articles.iterator(chunk_size=CHUNK_SIZE):
+        article.body_hash = body_hash(article.body)
+        chunk.append(article)
+        if len(chunk) >= CHUNK_SIZE:
+            Article.objects.bulk_update(chunk, ["body_hash"])
+            chunk = []
+    Article.objects.bulk_update(chunk, ["body_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analyzer", "0003_overall_sentiment_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="body_hash",
+            field=models.CharField(
+                db_index=True, default=None, max_length=64, null=True
+            ),
+        ),
+        migrations.RunPython(backfill_body_hash, migrations.RunPython.noop),
+    ]
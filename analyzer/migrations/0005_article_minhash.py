@@ -0,0 +1,40 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:07
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analyzer", "0004_article_body_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="cluster_id",
+            field=models.UUIDField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="lsh_bands",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.CharField(max_length=16), default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="minhash",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(), default=None, null=True, size=None
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="article",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["lsh_bands"], name="analyzer_ar_lsh_ban_779aa9_gin"
+            ),
+        ),
+    ]
@@ -0,0 +1,164 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:15
+
+import re
+from math import sqrt
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+SENTENCE_FIELDS = [
+    "sentence_starts",
+    "sentence_ends",
+    "sentence_positive",
+    "sentence_scores",
+]
+OVERALL_SENTIMENT_FIELDS = [
+    "sentiment_avg",
+    "sentiment_std",
+    "sentiment_label",
+    "sentence_count",
+    "positive_count",
+    "negative_count",
+]
+
+
+def locate_sentences(text, sentences):
+    offsets = []
+    cursor = 0
+    for sentence in sentences:
+        start = text.find(sentence, cursor)
+        if start == -1:
+            start = text.find(sentence)
+        if start != -1 and sentence:
+            span = (start, start + len(sentence))
+        else:
+            pattern = re.compile(r"\s+".join(map(re.escape, sentence.split())))
+            match = sentence.strip() and (
+                pattern.search(text, cursor) or pattern.search(text)
+            )
+            span = match.span() if match else None
+        offsets.append(span)
+        if span:
+            cursor = span[1]
+    return offsets
+
+
+def update_overall_sentiment(article):
+    pos_scores = [
+        score if positive else 1 - score
+        for (positive, score) in zip(article.sentence_positive, article.sentence_scores)
+    ]
+    count = len(pos_scores)
+    average = sum(pos_scores) / count if count else None
+    article.sentiment_avg = average
+    article.sentiment_std = 0.0
+    if count > 1:
+        variance = sum((s - average) ** 2 for s in pos_scores) / (count - 1)
+        article.sentiment_std = sqrt(variance)
+    article.sentiment_label = "UNKNOWN"
+    if count:
+        article.sentiment_label = "POSITIVE" if average >= 0.5 else "NEGATIVE"
+    article.sentence_count = count
+    article.positive_count = sum(article.sentence_positive)
+    article.negative_count = count - article.positive_count
+
+
+def sentiment_to_arrays(apps, schema_editor):
+    Article = apps.get_model("analyzer", "Article")
+
+    articles = Article.objects.exclude(sentiment__exact={}).only("body", "sentiment")
+    chunk = []
+    for article in articles.iterator(chunk_size=CHUNK_SIZE):
+        sentences = list(article.sentiment.items())
+        offsets = locate_sentences(article.body or "", [s for (s, _) in sentences])
+        # jsonb does not keep the key order, sort the sentences in body order
+        located = sorted(
+            [(span, o) for (span, (_, o)) in zip(offsets, sentences) if span],
+            key=lambda item: item[0],
+        )
+        article.sentence_starts = [start for ((start, _), _) in located]
+        article.sentence_ends = [end for ((_, end), _) in located]
+        article.sentence_positive = [o["label"] != "NEGATIVE" for (_, o) in located]
+        article.sentence_scores = [float(o["score"]) for (_, o) in located]
+        # sentences missing from the body are dropped from the overall sentiment
+        update_overall_sentiment(article)
+        chunk.append(article)
+        if len(chunk) >= CHUNK_SIZE:
+            Article.objects.bulk_update(
+                chunk, SENTENCE_FIELDS + OVERALL_SENTIMENT_FIELDS
+            )
+            chunk = []
+    Article.objects.bulk_update(chunk, SENTENCE_FIELDS + OVERALL_SENTIMENT_FIELDS)
+
+
+def arrays_to_sentiment(apps, schema_editor):
+    Article = apps.get_model("analyzer", "Article")
+
+    articles = Article.objects.exclude(sentence_scores=[]).only(
+        "body", *SENTENCE_FIELDS
+    )
+    chunk = []
+    for article in articles.iterator(chunk_size=CHUNK_SIZE):
+        article.sentiment = {
+            article.body[start:end]: {
+                "label": "POSITIVE" if positive else "NEGATIVE",
+                "score": score,
+            }
+            for (start, end, positive, score) in zip(
+                article.sentence_starts,
+                article.sentence_ends,
+                article.sentence_positive,
+                article.sentence_scores,
+            )
+        }
+        chunk.append(article)
+        if len(chunk) >= CHUNK_SIZE:
+            Article.objects.bulk_update(chunk, ["sentiment"])
+            chunk = []
+    Article.objects.bulk_update(chunk, ["sentiment"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analyzer", "0005_article_minhash"),
+        # the stage backfill reads the sentiment field
+        ("crawler", "0007_rssentry_pipeline_stage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="article",
+            name="sentence_starts",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.IntegerField(), default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentence_ends",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.IntegerField(), default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentence_positive",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BooleanField(), default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="article",
+            name="sentence_scores",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.FloatField(), default=list, size=None
+            ),
+        ),
+        migrations.RunPython(sentiment_to_arrays, arrays_to_sentiment),
+        migrations.RemoveField(
+            model_name="article",
+            name="sentiment",
+        ),
+    ]
@@ -0,0 +1,60 @@
+import hashlib
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text, size=None):
+    """Return the set of `size` word shingles of the text."""
+    size = size or settings.MINHASH_SHINGLE_SIZE
+    words = WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[idx : idx + size]) for idx in range(len(words) - size + 1)}
+
+
+@lru_cache(maxsize=None)
+def permutations(num_perm, seed=1):
+    """Return the (a, b) coefficients of `num_perm` multiply-shift hash functions."""
+    rng = np.random.RandomState(seed)
+    high, low = rng.randint(0, 2**32, size=(2, 2, num_perm), dtype=np.uint64)
+    coefficients = (high << np.uint64(32)) | low
+    return coefficients[0] | np.uint64(1), coefficients[1]
+
+
+def signature(text, num_perm=None):
+    """Return the MinHash signature of the text's shingles, None when empty."""
+    num_perm = num_perm or settings.MINHASH_PERMUTATIONS
+    hashes = np.array(
+        [zlib.crc32(s.encode("utf-8")) for s in shingles(text)], dtype=np.uint64
+    )
+    if not len(hashes):
+        return None
+    a, b = permutations(num_perm)
+    # uint64 arithmetic wraps, the high 32 bits are the permuted hash
+    permuted = (hashes[:, np.newaxis] * a + b) >> np.uint64(32)
+    return [int(value) for value in permuted.min(axis=0)]
+
+
+def band_keys(sig, bands=None):
+    """Return the LSH bucket key of each band of rows of the signature."""
+    bands = bands or settings.MINHASH_BANDS
+    rows = len(sig) // bands
+    keys = []
+    for band in range(bands):
+        values = np.array(sig[band * rows : (band + 1) * rows], dtype=np.uint32)
+        digest = hashlib.blake2b(values.tobytes(), digest_size=6).hexdigest()
+        keys.append(f"{band:02x}{digest}")
+    return keys
+
+
+def similarity(sig, other):
+    """Return the estimated Jaccard similarity of two signatures."""
+    if not sig or not other or len(sig) != len(other):
+        return 0.0
+    return float(np.mean(np.array(sig) == np.array(other)))
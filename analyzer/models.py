@@ -1,14 +1,50 @@
 import uuid
-from statistics import mean, stdev
 
+import numpy as np
 from crawler.models import RSSEntry
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
+from analyzer import minhash
+from analyzer.preprocessing import locate_sentences
+
+
+def unscored_fields():
+    """Return the sentiment field values of an Article that is not scored."""
+    return {
+        "sentence_starts": [],
+        "sentence_ends": [],
+        "sentence_positive": [],
+        "sentence_scores": [],
+        "sentiment_label": "UNKNOWN",
+        "sentiment_avg": None,
+        "sentiment_std": 0.0,
+        "sentence_count": 0,
+        "positive_count": 0,
+        "negative_count": 0,
+    }
+
+
+class ArticleQuerySet(models.QuerySet):
+    def clear_sentiment(self):
+        """Reset the sentiment of the Articles, so that they are scored again."""
+        return self.update(**unscored_fields())
+
+    def earliest_first(self):
+        """Articles in publication order, the order near-duplicates are clustered in."""
+        return self.order_by("rss_entry__pub_date", "pk")
+
 
 class Article(models.Model):
     """Human-readable text extracted from RSSEntry, search document"""
 
+    class Meta:
+        indexes = [GinIndex(fields=["lsh_bands"])]
+
+    objects = ArticleQuerySet.as_manager()
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
     # cannot use as PK due to elasticsearch serialization gotcha
@@ -18,10 +54,29 @@ class Article(models.Model):
     keywords = ArrayField(models.CharField(max_length=1024, null=False), default=list)
     author = models.CharField(max_length=2048, null=True, default=None)
     body = models.TextField(null=True, default=None)
+    # content hash of the body, see crawler.dedup.body_hash
+    body_hash = models.CharField(max_length=64, null=True, default=None, db_index=True)
+
+    # MinHash signature of the body and its LSH band keys, see set_minhash
+    minhash = ArrayField(models.BigIntegerField(), null=True, default=None)
+    lsh_bands = ArrayField(models.CharField(max_length=16), default=list)
+    # first Article of the near-duplicates of this one, null if this is the first
+    cluster_id = models.UUIDField(null=True, default=None, db_index=True)
 
-    # store all of the sentiment per sentence within body
-    sentiment = models.JSONField(default=dict)
-    # sentence is key, value is sentiment output
+    # per sentence sentiment as parallel arrays, sentence i is
+    # body[sentence_starts[i]:sentence_ends[i]], see set_sentiment
+    sentence_starts = ArrayField(models.IntegerField(), default=list)
+    sentence_ends = ArrayField(models.IntegerField(), default=list)
+    sentence_positive = ArrayField(models.BooleanField(), default=list)
+    sentence_scores = ArrayField(models.FloatField(), default=list)
+
+    # overall sentiment aggregated from the sentences, written by set_sentiment
+    sentiment_label = models.CharField(max_length=8, default="UNKNOWN", db_index=True)
+    sentiment_avg = models.FloatField(null=True, default=None, db_index=True)
+    sentiment_std = models.FloatField(default=0.0)
+    sentence_count = models.IntegerField(default=0)
+    positive_count = models.IntegerField(default=0)
+    negative_count = models.IntegerField(default=0)
 
     def __str__(self):
         return f"`{self.title}` by `{self.author}`"
@@ -39,23 +94,103 @@ class Article(models.Model):
     @property
     def overall_sentiment(self):
         """Return the overall sentiment of the article if defined."""
-        # sentiment values have a label (POS/NEG) and score [0, 1] indicating confidence
-        # overall sentiment is an aggregation of all sentence sentiments.
-        pos_scores = []
-        for output in self.sentiment.values():
-            score = output["score"]
-            if output["label"] == "NEGATIVE":
-                score = 1 - score
-            pos_scores.append(score)
-
-        # return summary stats of positive score
-        average = None
-        deviation = 0.0
-        label = "UNKNOWN"
-        if len(pos_scores):
-            average = mean(pos_scores)  # needs 1 data point
-            label = "POSITIVE" if average >= 0.5 else "NEGATIVE"
-        if len(pos_scores) > 1:
-            deviation = stdev(pos_scores)  # needs 2 data points
-
-        return {"label": label, "avg": average, "std": deviation}
+        return {
+            "label": self.sentiment_label,
+            "avg": self.sentiment_avg,
+            "std": self.sentiment_std,
+            "sentences": self.sentence_count,
+            "positive": self.positive_count,
+            "negative": self.negative_count,
+        }
+
+    def set_minhash(self):
+        """Compute the MinHash signature and LSH band keys of the body."""
+        self.minhash = minhash.signature(self.body) if self.body else None
+        self.lsh_bands = minhash.band_keys(self.minhash) if self.minhash else []
+
+    def find_near_duplicate(self):
+        """Return the most similar other Article above the threshold, or None.
+
+        Candidates share an LSH band with this Article, a GIN index lookup, the
+        earliest published ones are compared first and preferred on ties.
+        """
+        if not self.lsh_bands:
+            return None
+        candidates = (
+            Article.objects.filter(lsh_bands__overlap=self.lsh_bands)
+            .exclude(pk=self.pk)
+            .exclude(rss_entry=self.rss_entry_id)
+            .only("id", "minhash", "cluster_id")
+            .earliest_first()
+        )
+        best, best_similarity = None, settings.NEAR_DUPLICATE_THRESHOLD
+        for candidate in candidates[: settings.NEAR_DUPLICATE_CANDIDATES]:
+            candidate_similarity = minhash.similarity(self.minhash, candidate.minhash)
+            # on ties the earliest candidate is kept
+            if candidate_similarity > best_similarity or (
+                best is None and candidate_similarity == best_similarity
+            ):
+                best, best_similarity = candidate, candidate_similarity
+        return best
+
+    @property
+    def sentences(self):
+        """Return the (sentence, output) pairs of the body, repeats included."""
+        return [
+            (
+                self.body[start:end],
+                {"label": "POSITIVE" if positive else "NEGATIVE", "score": score},
+            )
+            for (start, end, positive, score) in zip(
+                self.sentence_starts,
+                self.sentence_ends,
+                self.sentence_positive,
+                self.sentence_scores,
+            )
+        ]
+
+    @property
+    def sentiment(self):
+        """Return the per sentence sentiment as a {sentence: output} dict."""
+        return dict(self.sentences)
+
+    def set_sentiment(self, sentiment):
+        """Set the per sentence sentiment and update the overall sentiment columns.
+
+        `sentiment` is a {sentence: output} dict or (sentence, output) pairs, the
+        sentences are stored as offsets into the body, those not in it are dropped.
+        """
+        if isinstance(sentiment, dict):
+            sentiment = sentiment.items()
+        sentiment = list(sentiment)
+        offsets = locate_sentences(self.body or "", [s for (s, _) in sentiment])
+        located = [
+            (span, output)
+            for (span, (_, output)) in zip(offsets, sentiment)
+            if span is not None
+        ]
+        self.sentence_starts = [start for ((start, _), _) in located]
+        self.sentence_ends = [end for ((_, end), _) in located]
+        # sentiment outputs have a label (POS/NEG) and score [0, 1] of confidence
+        self.sentence_positive = [o["label"] != "NEGATIVE" for (_, o) in located]
+        self.sentence_scores = [float(o["score"]) for (_, o) in located]
+        self.update_overall_sentiment()
+
+    def update_overall_sentiment(self):
+        """Aggregate the sentence sentiment arrays into the overall columns."""
+        positive = np.array(self.sentence_positive, dtype=bool)
+        scores = np.array(self.sentence_scores, dtype=float)
+        pos_scores = np.where(positive, scores, 1 - scores)
+
+        # summary stats of positive score
+        count = len(pos_scores)
+        self.sentiment_avg = float(pos_scores.mean()) if count else None
+        self.sentiment_std = float(pos_scores.std(ddof=1)) if count > 1 else 0.0
+        self.sentiment_label = "UNKNOWN"
+        if count:
+            self.sentiment_label = (
+                "POSITIVE" if self.sentiment_avg >= 0.5 else "NEGATIVE"
+            )
+        self.sentence_count = count
+        self.positive_count = int(positive.sum())
+        self.negative_count = count - self.positive_count
@@ -0,0 +1,160 @@
+import re
+
+from django.conf import settings
+
+# approximates WordPiece tokens, words and punctuation, long words are split
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+WORDPIECE_CHARS = 8
+URL_RE = re.compile(r"^\S+://\S+$")
+CLAUSE_END_RE = re.compile(r"[,;:–—]$")
+WORD_SPAN_RE = re.compile(r"\S+")
+# the longest sentence of a batch is at most this many times the shortest, or
+# this many tokens longer for short sentences
+BUCKET_LENGTH_RATIO = 2
+BUCKET_LENGTH_SLACK = 8
+
+
+def approximate_tokens(text):
+    """Return an estimate of the model tokens of the text, without a tokenizer."""
+    return sum(
+        max(1, -(-len(token) // WORDPIECE_CHARS)) for token in TOKEN_RE.findall(text)
+    )
+
+
+def get_token_counter():
+    """Return the token counting function configured by SENTENCE_TOKEN_COUNTER."""
+    if settings.SENTENCE_TOKEN_COUNTER == "model":
+        from analyzer.inference import get_model
+
+        tokenizer = get_model("sentiment_tokenizer")
+        return lambda text: len(tokenizer.tokenize(text))
+    return approximate_tokens
+
+
+def is_junk(sentence):
+    """Return True for sentences without linguistic content, ie. tables or URLs."""
+    characters = [c for c in sentence if not c.isspace()]
+    if not characters or URL_RE.match(sentence):
+        return True
+    letters = sum(c.isalpha() for c in characters)
+    if letters / len(characters) < settings.SENTENCE_MIN_ALPHA_RATIO:
+        return True
+    words = [word for word in sentence.split() if any(c.isalpha() for c in word)]
+    return len(words) < settings.SENTENCE_MIN_WORDS
+
+
+def split_sentence(sentence, max_tokens=None, count_tokens=None):
+    """Split a sentence into chunks of at most `max_tokens`, at clauses if possible.
+
+    Chunks are slices of the sentence, a single word longer than `max_tokens` is
+    truncated into a chunk of its own.
+    """
+    max_tokens = max_tokens or settings.SENTENCE_MAX_TOKENS
+    count_tokens = count_tokens or get_token_counter()
+    if count_tokens(sentence) <= max_tokens:
+        return [sentence]
+
+    chunks = []
+    words = []  # (start, end) of the chunk's words in the sentence
+    tokens = 0
+    last_clause = 0  # words in the chunk up to the last clause boundary
+    for match in WORD_SPAN_RE.finditer(sentence):
+        word = match.group()
+        word_tokens = count_tokens(word)
+        if word_tokens > max_tokens:
+            while word_tokens > max_tokens:
+                word = word[: len(word) // 2]
+                word_tokens = count_tokens(word)
+            if words:
+                chunks.append(sentence[words[0][0] : words[-1][1]])
+            chunks.append(word)
+            words, tokens, last_clause = [], 0, 0
+            continue
+        if words and tokens + word_tokens > max_tokens:
+            # break at the last clause, unless it would leave a tiny chunk
+            cut = last_clause if last_clause > len(words) // 2 else len(words)
+            chunks.append(sentence[words[0][0] : words[cut - 1][1]])
+            words = words[cut:]
+            tokens = sum(count_tokens(sentence[s:e]) for (s, e) in words)
+            last_clause = 0
+        words.append(match.span())
+        tokens += word_tokens
+        if CLAUSE_END_RE.search(word):
+            last_clause = len(words)
+    if words:
+        chunks.append(sentence[words[0][0] : words[-1][1]])
+    return chunks
+
+
+def prepare_sentences(sentences, max_tokens=None):
+    """Drop junk sentences and split over-length ones, ready for inference."""
+    count_tokens = get_token_counter()
+    prepared = []
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if is_junk(sentence):
+            continue
+        prepared.extend(split_sentence(sentence, max_tokens, count_tokens))
+    return prepared
+
+
+def locate_sentences(text, sentences):
+    """Return the (start, end) offsets of the sentences in the text, in order.
+
+    Each sentence is searched after the previous one, so repeated sentences keep
+    their own offsets, tolerating whitespace differences. None if not found.
+    """
+    offsets = []
+    cursor = 0
+    for sentence in sentences:
+        start = text.find(sentence, cursor)
+        if start == -1:
+            start = text.find(sentence)
+        if start != -1 and sentence:
+            span = (start, start + len(sentence))
+        else:
+            pattern = re.compile(r"\s+".join(map(re.escape, sentence.split())))
+            match = sentence.strip() and (
+                pattern.search(text, cursor) or pattern.search(text)
+            )
+            span = match.span() if match else None
+        offsets.append(span)
+        if span:
+            cursor = span[1]
+    return offsets
+
+
+def bucket_batches(sentences, batch_size=None, max_batch_tokens=None):
+    """Group sentence indexes into batches of similar token length.
+
+    Batches hold at most `batch_size` sentences and at most `max_batch_tokens`
+    padded tokens, so long sentences are batched in fewer numbers, and sentences
+    of similar length (BUCKET_LENGTH_RATIO), so padding is bounded.
+    """
+    batch_size = batch_size or settings.SENTIMENT_BATCH_SIZE
+    max_batch_tokens = max_batch_tokens or settings.SENTIMENT_BATCH_TOKENS
+    count_tokens = get_token_counter()
+    lengths = [count_tokens(sentence) for sentence in sentences]
+
+    def fits(batch, length):
+        # sorted ascending, so the newest sentence is the batch's longest
+        shortest = lengths[batch[0]]
+        return (
+            len(batch) < batch_size
+            and (len(batch) + 1) * length <= max_batch_tokens
+            and length
+            <= max(BUCKET_LENGTH_RATIO * shortest, shortest + BUCKET_LENGTH_SLACK)
+        )
+
+    batches = []
+    batch = []
+    for idx in sorted(
+        range(len(sentences)), key=lambda idx: (lengths[idx], len(sentences[idx]))
+    ):
+        if batch and not fits(batch, lengths[idx]):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
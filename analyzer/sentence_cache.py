@@ -0,0 +1,103 @@
+import hashlib
+import json
+from collections import Counter, OrderedDict
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from semscrape.redis_client import get_redis
+
+logger = get_task_logger(__name__)
+
+
+def sentence_key(sentence):
+    """Return the content hash of a sentence."""
+    return hashlib.sha1(sentence.encode("utf-8")).hexdigest()
+
+
+class SentenceCache:
+    """Two tier sentence -> sentiment output cache, namespaced by model.
+
+    Lookups check a bounded in-process LRU first, then redis. Outputs written to
+    the cache are stored in both tiers.
+    """
+
+    def __init__(self, namespace, max_local=None, ttl=None):
+        self.namespace = namespace
+        self.max_local = max_local or settings.SENTIMENT_CACHE_LOCAL_SIZE
+        self.ttl = ttl or settings.SENTIMENT_CACHE_TTL
+        self.local = OrderedDict()
+        self.stats = Counter()
+
+    def redis_key(self, key):
+        return f"sentiment:{self.namespace}:{key}"
+
+    def _set_local(self, key, output):
+        self.local[key] = output
+        self.local.move_to_end(key)
+        while len(self.local) > self.max_local:
+            self.local.popitem(last=False)
+
+    def get_many(self, sentences):
+        """Return a {sentence: output} dictionary of the cached sentences."""
+        found = {}
+        remote = {}
+        for sentence in sentences:
+            key = sentence_key(sentence)
+            if key in self.local:
+                self.local.move_to_end(key)
+                found[sentence] = self.local[key]
+            else:
+                remote[key] = sentence
+        self.stats["local_hits"] += len(found)
+
+        if remote:
+            try:
+                values = get_redis().mget([self.redis_key(k) for k in remote.keys()])
+            except Exception as e:
+                logger.warn(f"Sentence cache unavailable: {e}")
+                values = [None] * len(remote)
+            for (key, sentence), value in zip(remote.items(), values):
+                if value is None:
+                    self.stats["misses"] += 1
+                    continue
+                output = json.loads(value)
+                self._set_local(key, output)
+                found[sentence] = output
+                self.stats["remote_hits"] += 1
+        return found
+
+    def set_many(self, outputs):
+        """Cache a {sentence: output} dictionary in both tiers."""
+        if not outputs:
+            return
+        pipe = get_redis().pipeline(transaction=False)
+        for sentence, output in outputs.items():
+            key = sentence_key(sentence)
+            self._set_local(key, output)
+            pipe.setex(self.redis_key(key), self.ttl, json.dumps(output))
+        try:
+            pipe.execute()
+        except Exception as e:
+            logger.warn(f"Sentence cache unavailable: {e}")
+
+    def hit_rate(self):
+        hits = self.stats["local_hits"] + self.stats["remote_hits"]
+        lookups = hits + self.stats["misses"]
+        return hits / lookups if lookups else 0.0
+
+
+_cache = None
+
+
+def get_sentence_cache():
+    """Return the process-wide sentence cache for the configured model."""
+    global _cache
+    backend = settings.SENTIMENT_BACKEND
+    if backend == "onnx" and settings.SENTIMENT_ONNX_QUANTIZE:
+        backend = "onnx-int8"
+    namespace = ":".join(
+        [settings.SENTIMENT_MODEL, backend, f"v{settings.SENTIMENT_CACHE_VERSION}"]
+    )
+    if _cache is None or _cache.namespace != namespace:
+        _cache = SentenceCache(namespace)
+    return _cache
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from transformers import AutoConfig, AutoTokenizer, pipeline
+
+try:
+    import onnxruntime
+except ImportError:  # optional, only required for the onnx backend
+    onnxruntime = None
+
+
+def load_torch(model_name):
+    """The fp32 transformers sentiment-analysis pipeline."""
+    return pipeline("sentiment-analysis", model=model_name)
+
+
+def load_quantized(model_name):
+    """The sentiment-analysis pipeline with dynamic int8 quantized Linear layers."""
+    import torch
+
+    sentiment_pipeline = pipeline("sentiment-analysis", model=model_name)
+    sentiment_pipeline.model = torch.quantization.quantize_dynamic(
+        sentiment_pipeline.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return sentiment_pipeline
+
+
+class OnnxSentimentPipeline:
+    """ONNX Runtime sentiment classifier, called like the transformers pipeline."""
+
+    def __init__(self, session, tokenizer, id2label, max_length=512):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.id2label = id2label
+        self.max_length = max_length
+        self.input_names = [model_input.name for model_input in session.get_inputs()]
+
+    def __call__(self, sentences):
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        encoded = self.tokenizer(
+            list(sentences),
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        logits = self.session.run(None, inputs)[0]
+
+        # softmax, shifted by the max logit for numerical stability
+        exp_logits = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        scores = exp_logits / exp_logits.sum(axis=-1, keepdims=True)
+        return [
+            {"label": self.id2label[int(row.argmax())], "score": float(row.max())}
+            for row in scores
+        ]
+
+
+def onnx_graph_path(onnx_path, model_name, quantize=False):
+    """The path of the model's graph next to `onnx_path`, int8 weights apart."""
+    onnx_path = Path(onnx_path)
+    model_hash = hashlib.sha1(model_name.encode()).hexdigest()[:12]
+    int8 = "-int8" if quantize else ""
+    return onnx_path.with_name(f"{onnx_path.stem}-{model_hash}{int8}{onnx_path.suffix}")
+
+
+def export_onnx(model_name, onnx_path, quantize=False):
+    """Export the model to an ONNX graph, optionally with int8 weights.
+
+    The graph is exported to a temporary directory and then moved into place, so
+    processes loading the backend concurrently never load a partial graph.
+    """
+    from transformers.convert_graph_to_onnx import convert
+
+    onnx_path = Path(onnx_path)
+    onnx_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=onnx_path.parent) as export_dir:
+        # the converter requires a new or empty output directory
+        export_path = Path(export_dir, "fp32", onnx_path.name)
+        convert(
+            framework="pt",
+            model=model_name,
+            output=export_path,
+            opset=11,
+            pipeline_name="sentiment-analysis",
+        )
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantized_path = Path(export_dir, onnx_path.name)
+            quantize_dynamic(
+                str(export_path), str(quantized_path), weight_type=QuantType.QInt8
+            )
+            export_path = quantized_path
+        os.replace(export_path, onnx_path)
+
+
+def load_onnx(model_name):
+    """The model exported to ONNX (once, on first load) run with ONNX Runtime."""
+    if onnxruntime is None:
+        raise ImproperlyConfigured("SENTIMENT_BACKEND onnx requires onnxruntime")
+    onnx_path = onnx_graph_path(
+        settings.SENTIMENT_ONNX_PATH, model_name, settings.SENTIMENT_ONNX_QUANTIZE
+    )
+    if not onnx_path.exists():
+        # processes exporting concurrently each replace the graph atomically
+        export_onnx(model_name, onnx_path, settings.SENTIMENT_ONNX_QUANTIZE)
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if settings.SENTIMENT_THREADS:
+        options.intra_op_num_threads = settings.SENTIMENT_THREADS
+        options.inter_op_num_threads = 1
+    session = onnxruntime.InferenceSession(str(onnx_path), options)
+    config = AutoConfig.from_pretrained(model_name)
+    return OnnxSentimentPipeline(
+        session, AutoTokenizer.from_pretrained(model_name), config.id2label
+    )
+
+
+SENTIMENT_BACKENDS = {
+    "torch": load_torch,
+    "quantized": load_quantized,
+    "onnx": load_onnx,
+}
+
+
+def load_sentiment_backend(backend=None, model_name=None):
+    """Load the sentiment classifier of the backend set by SENTIMENT_BACKEND."""
+    backend = backend or settings.SENTIMENT_BACKEND
+    if backend not in SENTIMENT_BACKENDS:
+        raise ImproperlyConfigured(f"Unknown SENTIMENT_BACKEND `{backend}`")
+    return SENTIMENT_BACKENDS[backend](model_name or settings.SENTIMENT_MODEL)
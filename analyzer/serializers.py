@@ -11,6 +11,7 @@ class ArticleDocumentSerializer(DocumentSerializer):
 
         fields = (
             "id",
+            "cluster_id",
             "url",
             "title",
             "author",
@@ -1,161 +1,279 @@
-import re
-from collections import Counter
-
-import nltk.data
-from bs4 import BeautifulSoup
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from crawler.dedup import body_hash
+from crawler.fanout import dispatch_in_flight, release_slot
 from crawler.models import RSSEntry
-from django.db.models import Q
-from transformers import pipeline
+from django.conf import settings
+from semscrape import metrics
 
-from analyzer.models import Article
+from analyzer.extraction import extract_article
+from analyzer.indexing import flush_dirty_articles
+from analyzer.inference import analyze_sentences, get_sentence_tokenizer
+from analyzer.models import Article, unscored_fields
+from analyzer.preprocessing import prepare_sentences
+from analyzer.sentence_cache import get_sentence_cache
 
 logger = get_task_logger(__name__)
 
+# the Article fields needed to read back its per sentence sentiment
+SENTENCE_FIELDS = [
+    "body",
+    "sentence_starts",
+    "sentence_ends",
+    "sentence_positive",
+    "sentence_scores",
+]
+
+
+def finish_scoring(article_ids):
+    """Advance the pipeline stage of the Articles' RSSEntries once scored"""
+    rss_entries = RSSEntry.objects.filter(article__pk__in=article_ids)
+    rss_entries.exclude(article__sentence_count=0).advance(RSSEntry.Stage.SCORED)
+    rss_entries.filter(article__sentence_count=0).advance(RSSEntry.Stage.SKIPPED)
+
+
+def near_duplicate_sentiment(articles):
+    """Return the {sentence: output} sentiment of the Articles' near-duplicates"""
+    cluster_ids = {article.cluster_id for article in articles if article.cluster_id}
+    known = {}
+    if not cluster_ids:
+        return known
+    scored = (
+        Article.objects.filter(pk__in=cluster_ids)
+        .exclude(sentence_count=0)
+        .only(*SENTENCE_FIELDS)
+    )
+    for article in scored:
+        known.update(article.sentences)
+    return known
+
+
+def score_articles(articles):
+    """Score the sentences of the Articles' bodies and save their sentiment.
+
+    Sentences are batched across the articles. Only the sentiment fields are
+    written, the bodies are already stored.
+    """
+    # loading the tokenizer is time-consuming, it is loaded once per process
+    sentence_tokenizer = get_sentence_tokenizer()
+
+    # tokenize every article into one sentence stream, remember which article
+    sentences = []
+    owners = []
+    with metrics.timer("analyzer_tokenize_seconds"):
+        for article in articles:
+            article_sentences = prepare_sentences(
+                sentence_tokenizer.tokenize(article.body.strip())
+            )
+            sentences.extend(article_sentences)
+            owners.extend([article] * len(article_sentences))
 
-def find_title(soup):
-    """Use BeautifulSoup to find the article title"""
-    possible_titles = []
-
-    # check <head><title>
-    head_titles = soup.head.find_all("title")
-    for head_title in head_titles:
-        if head_title.string:
-            possible_titles.append(head_title.string)
-
-    # check <meta content="Title" name=".*title" />
-    meta_names = soup.find_all("meta", attrs={"name": re.compile(r".*title")})
-    for meta_name in meta_names:
-        if meta_name["content"]:
-            possible_titles.append(meta_name["content"])
-
-    # check <meta content="Title" property=".*title" />
-    meta_names = soup.find_all("meta", attrs={"property": re.compile(r".*title")})
-    for meta_name in meta_names:
-        if meta_name["content"]:
-            possible_titles.append(meta_name["content"])
-
-    title = None
-    if len(possible_titles):
-        # trim all leading and trailing whitespace from candidates
-        possible_titles = [pt.strip() for pt in possible_titles]
-        title, _ = Counter(possible_titles).most_common(n=1)[0]
-    return title
-
-
-def find_keywords(soup):
-    """Use BeautifulSoup to find the article search keywords"""
-    keywords = []
-
-    # check <meta name=".*keywords">
-    tag = soup.find("meta", attrs={"name": re.compile(r".*keywords")})
-    if tag and tag["content"]:
-        keywords.extend(tag["content"].split(","))
-
-    keywords = [kw.strip() for kw in keywords]
-    return keywords
-
-
-def find_author(soup):
-    """Use BeautifulSoup to find who wrote the article"""
-
-    # check <meta content="Name" name=".*author" />
-    tag = soup.find("meta", attrs={"name": re.compile(r".*author")})
-    if tag and tag["content"]:
-        return tag["content"].strip()
-
-    return None
-
-
-def find_article_body(soup):
-    """Return the relevant part of the article as human readable text."""
-    article_tags = soup.find_all("article")
-    body = []
-    for article_tag in article_tags:
-        body.extend(article_tag.strings)
+    # run through the sentiment analyzer to get pos/neg label and score
+    sentiments = analyze_sentences(sentences, known=near_duplicate_sentiment(articles))
 
-    if body:
-        body = [line.strip() for line in body]
-        body = [line for line in body if line]
-        return " ".join(body)
-    return None
+    # scatter the outputs back to their articles, repeated sentences included
+    article_sentiments = {article.pk: [] for article in articles}
+    for article, sentence, sentiment in zip(owners, sentences, sentiments):
+        article_sentiments[article.pk].append((sentence, sentiment))
+    with metrics.timer("pipeline_db_write_seconds", stage="score"):
+        for article in articles:
+            article.set_sentiment(article_sentiments[article.pk])
+            article.save(update_fields=list(unscored_fields()))
 
 
-@shared_task
-def compute_sentiment(article_id):
+def score_article(article_id):
     try:
         article = Article.objects.get(pk=article_id)
         assert article.body, f"Article body is falsy! `{article.body}`"
     except Exception as e:
         logger.warn(f"Article invalid `pk={article_id}`, {e}")
+        finish_scoring([article_id])
         return
 
-    if hasattr(article, "sentiment") and article.sentiment:
-        if article.sentiment.keys():
-            # we've already computed sentiment for this article
-            return
+    if article.sentence_count:
+        # we've already computed sentiment for this article
+        finish_scoring([article_id])
+        return
 
-    # loading these models is time-consuming, and you can't use the kwarg trick :(
-    sentence_tokenizer = nltk.data.load("tokenizers/punkt/english.pickle")
-    sentiment_analyzer = pipeline(
-        "sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english"
-    )
+    score_articles([article])
+    finish_scoring([article_id])
 
-    # run all the sentences through the the sentence tokenizer to get sentences
-    sentences = sentence_tokenizer.tokenize(article.body.strip())
 
-    # run through the sentiment analyzer to get pos/neg label and score
-    sentiments = sentiment_analyzer(sentences)
+@shared_task
+def compute_sentiment(article_id, slot=None):
+    try:
+        score_article(article_id)
+    finally:
+        release_slot("sentiment", slot)
 
-    # join the sentiment output and sentences together into a dictionary
-    article.sentiment = dict(zip(sentences, sentiments))
-    article.save()
+
+@shared_task
+def compute_sentiments(article_ids, slot=None):
+    """Compute sentiment for many articles, batching sentences across articles"""
+    try:
+        articles = (
+            Article.objects.filter(pk__in=article_ids, sentence_count=0)
+            .exclude(body__isnull=True)
+            .exclude(body__exact="")
+        )
+        articles = list(articles)
+        if articles:
+            score_articles(articles)
+        finish_scoring(article_ids)
+    finally:
+        release_slot("sentiment", slot)
+
+    if articles and settings.SENTIMENT_CACHE_ENABLED:
+        cache = get_sentence_cache()
+        logger.info(f"Sentence cache {dict(cache.stats)}, {cache.hit_rate():.1%} hits")
 
 
 @shared_task
 def dispatch_compute_sentiments():
-    """Find entries that have not been sentiment analyzed and dispatch analysis"""
-    missed_articles = Article.objects.filter(sentiment__exact={}).exclude(
-        body__isnull=True
-    )
-    for article in missed_articles.iterator():
-        compute_sentiment.delay(article.pk)
+    """Claim entries that have not been sentiment analyzed and dispatch analysis"""
+    articles_per_task = settings.SENTIMENT_ARTICLES_PER_TASK
+    for claimed in RSSEntry.objects.claim_batches(
+        RSSEntry.Stage.PARSED, max(articles_per_task, 1)
+    ):
+        article_ids = list(
+            Article.objects.filter(rss_entry__in=claimed).values_list("pk", flat=True)
+        )
+        if articles_per_task <= 1:
+            calls = [(article_id,) for article_id in article_ids]
+            left = dispatch_in_flight("sentiment", compute_sentiment, calls)
+            left_ids = [article_id for (article_id,) in left]
+        else:
+            calls = [(article_ids,)] if article_ids else []
+            left = dispatch_in_flight("sentiment", compute_sentiments, calls)
+            left_ids = article_ids if left else []
+        if left_ids:
+            # the stage is full, the rest is claimed again by the next dispatch
+            RSSEntry.objects.filter(article__pk__in=left_ids).release()
+            break
+
+
+def parse_entry(rss_entry):
+    """Extract the RSSEntry's HTML into its Article, return it if it needs scoring.
+
+    The raw HTML is read from the RSSEntry instance, an entry fetched in the same
+    process is parsed from memory. Entries with nothing to score are skipped.
+    """
+    try:
+        content_type = rss_entry.content_type
+        assert rss_entry.is_html, f"Content-Type == {content_type}, expected html"
+        with metrics.timer("analyzer_parse_seconds"):
+            extracted = extract_article(rss_entry.raw_html)
+    except Exception as e:
+        logger.warn(f"RSSEntry invalid `pk={rss_entry.pk}`, {e}")
+        return None
+
+    rss_entries = RSSEntry.objects.filter(pk=rss_entry.pk)
+    if extracted.get("body"):
+        extracted["body_hash"] = body_hash(extracted["body"])
+        canonical = (
+            Article.objects.filter(body_hash=extracted["body_hash"])
+            .exclude(rss_entry=rss_entry)
+            .values_list("rss_entry", flat=True)
+            .first()
+        )
+        if canonical is not None:
+            # same story under another link, share the existing Article
+            rss_entries.update(canonical_entry=canonical)
+            rss_entries.advance(RSSEntry.Stage.SKIPPED)
+            metrics.incr("pipeline_duplicate_entries_total", duplicate_of="body")
+            return None
+
+        # lightly edited copies join the near-duplicate's cluster
+        probe = Article(rss_entry=rss_entry, body=extracted["body"])
+        probe.set_minhash()
+        near_duplicate = probe.find_near_duplicate()
+        extracted["minhash"] = probe.minhash
+        extracted["lsh_bands"] = probe.lsh_bands
+        if near_duplicate is not None:
+            extracted["cluster_id"] = near_duplicate.cluster_id or near_duplicate.pk
+
+    # a changed body invalidates the sentence offsets, it is scored again
+    previous = Article.objects.filter(rss_entry=rss_entry)
+    if previous.exclude(body_hash=extracted.get("body_hash")).exists():
+        extracted.update(unscored_fields())
+
+    with metrics.timer("pipeline_db_write_seconds", stage="parse"):
+        article, _ = Article.objects.update_or_create(
+            rss_entry=rss_entry, defaults=extracted
+        )
+
+    if not article.body:
+        rss_entries.advance(RSSEntry.Stage.SKIPPED)
+        return None
+    return article
 
 
 @shared_task
-def parse_html_entry(rss_entry_id):
+def parse_html_entry(rss_entry_id, slot=None):
     try:
         rss_entry = RSSEntry.objects.get(pk=rss_entry_id)
-        content_type = rss_entry.headers.get("Content-Type")
-        assert "html" in content_type, f"Content-Type == {content_type}, expected html"
-        soup = BeautifulSoup(rss_entry.raw_html, "html.parser")
-    except Exception as e:
+    except RSSEntry.DoesNotExist as e:
         logger.warn(f"RSSEntry invalid `pk={rss_entry_id}`, {e}")
+        release_slot("parse", slot)
         return
 
-    article, _ = Article.objects.update_or_create(
-        rss_entry=rss_entry,
-        defaults={
-            "title": find_title(soup),
-            "keywords": find_keywords(soup),
-            "author": find_author(soup),
-            "body": find_article_body(soup),
-        },
-    )
+    try:
+        article = parse_entry(rss_entry)
+    finally:
+        release_slot("parse", slot)
+    if article is None:
+        return
 
-    compute_sentiment.delay(article.pk)
+    rss_entries = RSSEntry.objects.filter(pk=rss_entry_id)
+    if settings.SENTIMENT_ARTICLES_PER_TASK <= 1:
+        rss_entries.advance(RSSEntry.Stage.PARSED, claim=True)
+        if dispatch_in_flight("sentiment", compute_sentiment, [(article.pk,)]):
+            # the stage is full, left to dispatch_compute_sentiments
+            rss_entries.release()
+    else:
+        # scored in batches by dispatch_compute_sentiments
+        rss_entries.advance(RSSEntry.Stage.PARSED)
+
+
+def process_fetched_entries(rss_entries):
+    """Parse and score claimed, fetched RSSEntries in this process.
+
+    The fused alternative to parse_html_entry and compute_sentiment tasks: the
+    raw HTML and the Article bodies are passed between the stages in memory
+    rather than read back from the database, only the results are written.
+    Returns the scored Articles.
+    """
+    articles = [parse_entry(rss_entry) for rss_entry in rss_entries]
+    articles = [article for article in articles if article is not None]
+    if not articles:
+        return []
+
+    # a failure while scoring leaves the entries to dispatch_compute_sentiments
+    parsed = RSSEntry.objects.filter(pk__in=[a.rss_entry_id for a in articles])
+    parsed.advance(RSSEntry.Stage.PARSED, claim=True)
+    unscored = [article for article in articles if not article.sentence_count]
+    if unscored:
+        score_articles(unscored)
+    finish_scoring([article.pk for article in articles])
+    return articles
 
 
 @shared_task
 def dispatch_parse_html_entries():
-    """Find entries that have not been parse_html'd dispatch parse_html task"""
-    missed_entries = RSSEntry.objects.exclude(
-        Q(raw_html__isnull=True)  # Exclude where raw_html is null OR
-        | Q(article__isnull=False)  # article has already been parsed
-    ).filter(
-        # Handle where Content-Type header is textual
-        **{"headers__Content-Type__icontains": "text/html"}
-    )
-    for entry in missed_entries.iterator():
-        parse_html_entry.delay(entry.pk)
+    """Claim entries that have not been parse_html'd dispatch parse_html task"""
+    html_entries = RSSEntry.objects.filter(is_html=True)
+    for claimed in html_entries.claim_batches(RSSEntry.Stage.FETCHED, 500):
+        calls = [(rss_entry_id,) for rss_entry_id in claimed]
+        left = dispatch_in_flight("parse", parse_html_entry, calls)
+        if left:
+            # the stage is full, the rest is claimed again by the next dispatch
+            RSSEntry.objects.filter(pk__in=[pk for (pk,) in left]).release()
+            break
+
+
+@shared_task
+def flush_search_index():
+    """Bulk index the Articles that have changed since the last flush"""
+    indexed = flush_dirty_articles()
+    if indexed:
+        logger.info(f"Indexed {indexed} article search documents")
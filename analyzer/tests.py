@@ -1,7 +1,926 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
 
+import crawler.tasks as crawler_tasks
+import numpy as np
+from crawler.fake_redis import FakeRedis
+from crawler.models import RSSEntry, RSSFeed
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from semscrape import metrics
 
+import analyzer.extraction as extraction
+import analyzer.indexing as indexing
+import analyzer.inference as inference
+import analyzer.minhash as minhash
+import analyzer.preprocessing as preprocessing
+import analyzer.sentence_cache as sentence_cache
+import analyzer.sentiment_backends as sentiment_backends
+import analyzer.tasks as tasks
+from analyzer.models import Article
+from analyzer.viewsets import CollapseFilterBackend
+
+
+def fake_sentiment_analyzer(sentences):
+    """Label sentences containing `good` as positive, everything else negative"""
+    return [
+        {"label": "POSITIVE" if "good" in s else "NEGATIVE", "score": 0.9}
+        for s in sentences
+    ]
+
+
+@override_settings(SENTIMENT_CACHE_ENABLED=False)
 class AnalyzerTasksTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
-        pass
+        feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        cls.articles = []
+        for idx, body in enumerate(
+            ["A good day. A bad day.", "Nothing good.", "It rained all week."]
+        ):
+            rss_entry = RSSEntry.objects.create(
+                feed=feed,
+                link=f"http://example.com/{idx}",
+                title=f"Entry {idx}",
+                stage=RSSEntry.Stage.PARSED,
+            )
+            cls.articles.append(Article.objects.create(rss_entry=rss_entry, body=body))
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    @patch("analyzer.tasks.get_sentence_tokenizer")
+    def test_compute_sentiments(self, patched_tokenizer, patched_analyzer):
+        """Sentences from many articles are scored together and scattered back"""
+        patched_tokenizer.return_value.tokenize = lambda body: [
+            s.strip() + "." for s in body.split(".") if s.strip()
+        ]
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+
+        tasks.compute_sentiments([article.pk for article in self.articles])
+
+        sentiments = [
+            Article.objects.get(pk=article.pk).sentiment for article in self.articles
+        ]
+        self.assertEqual(
+            sentiments,
+            [
+                {
+                    "A good day.": {"label": "POSITIVE", "score": 0.9},
+                    "A bad day.": {"label": "NEGATIVE", "score": 0.9},
+                },
+                {"Nothing good.": {"label": "POSITIVE", "score": 0.9}},
+                {"It rained all week.": {"label": "NEGATIVE", "score": 0.9}},
+            ],
+        )
+        self.assertEqual(
+            RSSEntry.objects.filter(stage=RSSEntry.Stage.SCORED).count(), 3
+        )
+
+    def test_set_sentiment_overall_columns(self):
+        """Sentence sentiment is aggregated into the overall sentiment columns"""
+        article = Article.objects.get(pk=self.articles[0].pk)
+        self.assertEqual(article.overall_sentiment["label"], "UNKNOWN")
+
+        article.body = "A good day. A bad day. Fine."
+        article.set_sentiment(
+            {
+                "A good day.": {"label": "POSITIVE", "score": 0.9},
+                "A bad day.": {"label": "NEGATIVE", "score": 0.7},
+                "Fine.": {"label": "POSITIVE", "score": 0.6},
+            }
+        )
+        article.save()
+
+        article = Article.objects.get(pk=self.articles[0].pk)
+        overall = article.overall_sentiment
+        self.assertEqual(overall["label"], "POSITIVE")
+        self.assertAlmostEqual(overall["avg"], (0.9 + 0.3 + 0.6) / 3)
+        self.assertAlmostEqual(overall["std"], 0.3)
+        self.assertEqual(
+            (overall["sentences"], overall["positive"], overall["negative"]), (3, 2, 1)
+        )
+        self.assertEqual(
+            Article.objects.filter(sentiment_label="POSITIVE").get().pk, article.pk
+        )
+
+    def test_sentence_arrays(self):
+        """Sentences are stored as body offsets, keeping repeated sentences"""
+        article = Article.objects.get(pk=self.articles[0].pk)
+        article.body = "Good call. Bad call.\nGood call."
+        article.set_sentiment(
+            [
+                ("Good call.", {"label": "POSITIVE", "score": 0.9}),
+                ("Bad call.", {"label": "NEGATIVE", "score": 0.8}),
+                ("Good call.", {"label": "POSITIVE", "score": 0.7}),
+            ]
+        )
+        article.save()
+
+        article = Article.objects.get(pk=self.articles[0].pk)
+        self.assertEqual(article.sentence_starts, [0, 11, 21])
+        self.assertEqual(article.sentence_positive, [True, False, True])
+        self.assertEqual(
+            [sentence for (sentence, _) in article.sentences],
+            ["Good call.", "Bad call.", "Good call."],
+        )
+        self.assertEqual(article.sentiment["Bad call."]["label"], "NEGATIVE")
+        self.assertEqual(article.overall_sentiment["sentences"], 3)
+        self.assertAlmostEqual(article.sentiment_avg, (0.9 + 0.2 + 0.7) / 3)
+
+    @override_settings(SENTIMENT_ARTICLES_PER_TASK=2)
+    @patch("crawler.fanout.get_redis", return_value=FakeRedis())
+    def test_dispatch_compute_sentiments(self, _patched_redis):
+        """Pending articles are dispatched in chunks"""
+        with patch.object(tasks.compute_sentiments, "delay") as m:
+            tasks.dispatch_compute_sentiments()
+        self.assertEqual(m.call_count, 2)
+        dispatched = [pk for call in m.call_args_list for pk in call.args[0]]
+        self.assertCountEqual(dispatched, [article.pk for article in self.articles])
+
+        # claimed articles are not dispatched again while their lease is held
+        with patch.object(tasks.compute_sentiments, "delay") as m:
+            tasks.dispatch_compute_sentiments()
+        m.assert_not_called()
+
+    @override_settings(
+        SENTIMENT_ARTICLES_PER_TASK=1, PIPELINE_MAX_IN_FLIGHT={"sentiment": 1}
+    )
+    @patch("crawler.fanout.get_redis", return_value=FakeRedis())
+    def test_dispatch_in_flight_cap(self, _patched_redis):
+        """Tasks beyond the stage's in-flight cap wait for the next dispatch"""
+        with patch.object(tasks.compute_sentiment, "delay") as m:
+            tasks.dispatch_compute_sentiments()
+        self.assertEqual(m.call_count, 1)
+        pending = RSSEntry.objects.pending(RSSEntry.Stage.PARSED)
+        self.assertEqual(pending.count(), len(self.articles) - 1)
+        self.assertFalse(pending.filter(attempts__gt=0).exists())
+
+        # the finished task gives its slot back to the next dispatch
+        with patch("analyzer.tasks.score_article"):
+            tasks.compute_sentiment(*m.call_args.args, **m.call_args.kwargs)
+        with patch.object(tasks.compute_sentiment, "delay") as m:
+            tasks.dispatch_compute_sentiments()
+        self.assertEqual(m.call_count, 1)
+
+
+class SearchIndexingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        cls.articles = [
+            Article.objects.create(
+                rss_entry=RSSEntry.objects.create(
+                    feed=feed, link=f"http://example.com/{idx}", title=f"Entry {idx}"
+                ),
+                body=f"Body {idx}",
+            )
+            for idx in range(5)
+        ]
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("analyzer.indexing.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("analyzer.indexing.bulk", return_value=(1, []))
+    @patch("analyzer.documents.ArticleDocument.update", return_value=(4, []))
+    def test_flush_dirty_articles(self, patched_update, patched_bulk):
+        """Queued articles are indexed in bulk batches, deleted ones removed"""
+        deleted_id = "00000000-0000-0000-0000-000000000000"
+        indexing.mark_dirty([article.pk for article in self.articles[:4]])
+        indexing.mark_dirty([deleted_id])
+
+        indexing.flush_dirty_articles(batch_size=2)
+
+        self.assertEqual(self.redis.smembers(indexing.DIRTY_ARTICLES_KEY), set())
+        self.assertEqual(patched_update.call_count, 3)
+        indexed = [a.pk for call in patched_update.call_args_list for a in call.args[0]]
+        self.assertCountEqual(indexed, [article.pk for article in self.articles[:4]])
+        (actions,) = [call.args[1] for call in patched_bulk.call_args_list]
+        self.assertEqual([action["_id"] for action in actions], [deleted_id])
+
+    @patch("analyzer.documents.ArticleDocument.update", side_effect=Exception("down"))
+    def test_flush_dirty_articles_failure(self, patched_update):
+        """Articles are requeued when elasticsearch is unavailable"""
+        indexing.mark_dirty([article.pk for article in self.articles])
+        indexing.flush_dirty_articles(batch_size=2)
+        self.assertEqual(self.redis.scard(indexing.DIRTY_ARTICLES_KEY), 5)
+
+
+@override_settings(SENTIMENT_CACHE_ENABLED=False)
+class BackfillTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        cls.articles = sorted(
+            [
+                Article.objects.create(
+                    rss_entry=RSSEntry.objects.create(
+                        feed=feed,
+                        link=f"http://example.com/{idx}",
+                        title=f"Entry {idx}",
+                        stage=RSSEntry.Stage.PARSED,
+                    ),
+                    body=f"A good day {idx}.",
+                )
+                for idx in range(5)
+            ],
+            key=lambda article: article.pk,
+        )
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("semscrape.backfill.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def backfill(self, *args):
+        out = StringIO()
+        call_command(*args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        """A dry run counts the rows after the checkpoint, processing nothing"""
+        self.redis.set(
+            "backfill:backfill_sentiment:all=False:checkpoint", self.articles[1].pk
+        )
+        out = self.backfill("backfill_sentiment", "--dry-run")
+        self.assertIn("3 rows to process", out)
+        self.assertFalse(Article.objects.exclude(sentence_count=0).exists())
+        # a backfill with other options does not resume from that checkpoint
+        out = self.backfill("backfill_sentiment", "--all", "--dry-run")
+        self.assertIn("5 rows to process", out)
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    @patch("analyzer.tasks.get_sentence_tokenizer")
+    def test_backfill_sentiment_resumes(self, patched_tokenizer, patched_analyzer):
+        """Chunks resume after the checkpoint, which is cleared once done"""
+        patched_tokenizer.return_value.tokenize = lambda body: [body]
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+        self.redis.set(
+            "backfill:backfill_sentiment:all=False:checkpoint", self.articles[1].pk
+        )
+
+        out = self.backfill("backfill_sentiment", "--chunk-size", "2")
+        self.assertIn("Backfilled 3 rows, 3 processed", out)
+        self.assertEqual(
+            list(
+                Article.objects.exclude(sentence_count=0)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            ),
+            [article.pk for article in self.articles[2:]],
+        )
+        self.assertEqual(patched_analyzer.return_value.call_count, 2)
+        self.assertIsNone(
+            self.redis.get("backfill:backfill_sentiment:all=False:checkpoint")
+        )
+
+    @patch("analyzer.management.commands.reindex_es.index_articles")
+    def test_reindex_es_interrupted(self, patched_index):
+        """A failed chunk leaves the checkpoint at the last finished chunk"""
+        patched_index.side_effect = [(2, 0), Exception("cluster unavailable")]
+        with self.assertRaises(Exception):
+            self.backfill("reindex_es", "--chunk-size", "2")
+        self.assertEqual(
+            self.redis.get("backfill:reindex_es:checkpoint").decode(),
+            str(self.articles[1].pk),
+        )
+
+        patched_index.side_effect = None
+        patched_index.return_value = (2, 0)
+        self.backfill("reindex_es", "--chunk-size", "2")
+        self.assertEqual(
+            patched_index.call_args_list[-2].args[0],
+            [str(article.pk) for article in self.articles[2:4]],
+        )
+
+
+class BenchmarkPipelineTestCase(TestCase):
+    def test_benchmark_pipeline(self):
+        """Synthetic feeds run through the stages, and the writes are rolled back"""
+        live_redis, scratch_redis = FakeRedis(), FakeRedis()
+        scratch_redis.flushdb = MagicMock(side_effect=scratch_redis.flushdb)
+        with tempfile.TemporaryDirectory() as output_dir, patch(
+            "semscrape.redis_client._client", live_redis
+        ), patch("redis.Redis.from_url", return_value=scratch_redis):
+            output = os.path.join(output_dir, "benchmark.json")
+            call_command(
+                "benchmark_pipeline",
+                *("--feeds", "2", "--entries", "3", "--latency", "0"),
+                *("--stages", "crawl", "parse", "index", "--output", output),
+                stdout=StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        stages = results["stages"]
+        self.assertEqual(list(stages), ["crawl", "parse", "index"])
+        self.assertEqual(stages["crawl"]["calls"], 2)
+        self.assertEqual(stages["crawl"]["items"], 6)
+        self.assertEqual(stages["parse"]["items"], 6)
+        self.assertEqual(stages["index"]["items"], 6)
+        self.assertLessEqual(stages["parse"]["p50_ms"], stages["parse"]["p99_ms"])
+        self.assertFalse(RSSFeed.objects.filter(organization="Benchmark").exists())
+        # no redis state nor metrics of the run are left behind
+        self.assertEqual(live_redis.values, {})
+        scratch_redis.flushdb.assert_called_once_with()
+        self.assertEqual(scratch_redis.values, {})
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("semscrape.metrics.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # other tests record metrics that are never flushed
+        metrics._pending.clear()
+
+    def test_buffered_until_flush(self):
+        """Series are summed in process and added to redis in one flush"""
+        metrics.incr("crawler_fetch_responses_total", host="example.com", status=200)
+        metrics.incr("crawler_fetch_responses_total", host="example.com", status=200)
+        metrics.observe("analyzer_parse_seconds", 0.02)
+        self.assertEqual(self.redis.values, {})
+
+        metrics.flush()
+        self.assertEqual(list(self.redis.values), [metrics.METRICS_KEY])
+        self.assertEqual(
+            self.redis.values[metrics.METRICS_KEY],
+            {
+                'crawler_fetch_responses_total{host="example.com",status="200"}': 2,
+                'analyzer_parse_seconds_bucket{le="0.025"}': 1,
+                'analyzer_parse_seconds_bucket{le="0.05"}': 1,
+                **{
+                    f'analyzer_parse_seconds_bucket{{le="{le}"}}': 1
+                    for le in metrics.LATENCY_BUCKETS[3:] + ["+Inf"]
+                },
+                "analyzer_parse_seconds_sum": 0.02,
+                "analyzer_parse_seconds_count": 1,
+            },
+        )
+
+    def test_metrics_endpoint(self):
+        """Counters, histograms and queue depth gauges in the Prometheus format"""
+        feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        for idx in range(2):
+            RSSEntry.objects.create(feed=feed, link=f"http://example.com/{idx}")
+        metrics.incr("search_indexed_articles_total", 3)
+        with metrics.timer("search_index_seconds"):
+            pass
+        metrics.flush()
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        for line in [
+            "# TYPE search_indexed_articles_total counter",
+            "search_indexed_articles_total 3.0",
+            "# TYPE search_index_seconds histogram",
+            'search_index_seconds_bucket{le="+Inf"} 1.0',
+            "# TYPE pipeline_pending_entries gauge",
+            'pipeline_pending_entries{stage="new"} 2',
+            'pipeline_pending_entries{stage="parsed"} 0',
+            'celery_queue_length{queue="inference"} 0',
+        ]:
+            self.assertIn(line, lines)
+
+        # buckets in bound order, then the sum and count of the histogram
+        histogram = [
+            line.split(" ")[0]
+            for line in lines
+            if line.startswith("search_index_seconds")
+        ]
+        self.assertEqual(
+            histogram,
+            [
+                f'search_index_seconds_bucket{{le="{le}"}}'
+                for le in metrics.LATENCY_BUCKETS + ["+Inf"]
+            ]
+            + ["search_index_seconds_sum", "search_index_seconds_count"],
+        )
+
+    @patch("crawler.management.commands.fetchrssnow.dispatch_crawl_feeds")
+    def test_flushed_on_command_exit(self, patched_dispatch):
+        """Metrics recorded by a management command are flushed when it exits"""
+        patched_dispatch.side_effect = lambda: metrics.incr("crawler_cycles_total")
+        call_command("fetchrssnow")
+        self.assertEqual(
+            self.redis.values[metrics.METRICS_KEY], {"crawler_cycles_total": 1}
+        )
+
+
+@override_settings(SENTIMENT_CACHE_ENABLED=False)
+class InferenceRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        inference._registry.clear()
+        self.addCleanup(inference._registry.clear)
+
+    @patch("analyzer.inference._load", side_effect=lambda name: object())
+    def test_models_loaded_once(self, patched_load):
+        """Models are deserialized once and reused across calls"""
+        tokenizer = inference.get_sentence_tokenizer()
+        analyzer = inference.get_sentiment_analyzer()
+        self.assertIs(tokenizer, inference.get_sentence_tokenizer())
+        self.assertIs(analyzer, inference.get_sentiment_analyzer())
+        self.assertEqual(patched_load.call_count, 2)
+
+    @patch("analyzer.inference._load", side_effect=lambda name: object())
+    def test_reload_models(self, patched_load):
+        """The reload hook replaces the cached model instances"""
+        analyzer = inference.get_sentiment_analyzer()
+        inference.reload_models("sentiment_analyzer")
+        self.assertIsNot(analyzer, inference.get_sentiment_analyzer())
+        self.assertEqual(patched_load.call_count, 2)
+
+    @patch("analyzer.inference._load", side_effect=lambda name: object())
+    def test_worker_init_warms_models(self, patched_load):
+        """Celery child process initialization loads every model"""
+        inference.warm_models_on_worker_init()
+        self.assertEqual(
+            sorted(inference._registry.keys()),
+            ["sentence_tokenizer", "sentiment_analyzer"],
+        )
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    def test_analyze_sentences_batches(self, patched_analyzer):
+        """Sentences are length sorted into fixed size batches, order preserved"""
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+        sentences = ["good good good", "bad", "good", "very bad indeed", "ok"]
+
+        outputs = inference.analyze_sentences(sentences, batch_size=2)
+
+        self.assertEqual(outputs, fake_sentiment_analyzer(sentences))
+        batches = [
+            call.args[0] for call in patched_analyzer.return_value.call_args_list
+        ]
+        self.assertEqual(
+            batches, [["ok", "bad"], ["good", "good good good"], ["very bad indeed"]]
+        )
+
+
+class WorkerPoolsTestCase(SimpleTestCase):
+    def test_task_routes(self):
+        """Inference tasks go to the inference queue, crawling to the crawl queue"""
+        from semscrape.celery import app
+
+        routes = {
+            "analyzer.tasks.compute_sentiment": "inference",
+            "analyzer.tasks.compute_sentiments": "inference",
+            "analyzer.tasks.parse_html_entry": "crawl",
+            "crawler.tasks.retrieve_feed_entries": "crawl",
+            "analyzer.tasks.flush_search_index": "celery",
+        }
+        for task_name, queue in routes.items():
+            route = app.amqp.router.route({}, task_name)
+            self.assertEqual(route["queue"].name, queue, task_name)
+
+    @override_settings(SENTIMENT_THREADS=2)
+    def test_configure_threads(self):
+        """Each inference process is limited to SENTIMENT_THREADS torch threads"""
+        torch = MagicMock()
+        with patch.dict("sys.modules", {"torch": torch}):
+            inference.configure_threads()
+        torch.set_num_threads.assert_called_once_with(2)
+        torch.set_num_interop_threads.assert_called_once_with(1)
+
+
+class ExtractionTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        analyzer_dir = os.path.dirname(os.path.realpath(__file__))
+        sample_money_fp = os.path.join(
+            analyzer_dir, "..", "test_data", "sample_money.html"
+        )
+        with open(sample_money_fp) as f:
+            cls.sample_money = f.read()
+
+    def test_extract_sample_money(self):
+        """BeautifulSoup extraction of a known CNN Money article"""
+        extracted = extraction.extract_article(self.sample_money, backend="bs4")
+        self.assertEqual(
+            extracted["title"],
+            "Toyota joins SoftBank; Facebook investigation; CNN Business",
+        )
+        self.assertEqual(extracted["author"], "Ivana Kottasová")
+        self.assertIn("stock futures", extracted["keywords"])
+        self.assertTrue(
+            extracted["body"].startswith("Click chart for more in-depth data.")
+        )
+        self.assertNotIn("function()", extracted["body"])
+
+    def test_lxml_parity(self):
+        """The lxml single pass extracts the same fields as BeautifulSoup"""
+        self.assertEqual(
+            extraction.extract_article(self.sample_money, backend="lxml"),
+            extraction.extract_article(self.sample_money, backend="bs4"),
+        )
+
+    def test_lxml_parity_edge_cases(self):
+        """Parity for missing fields, duplicate titles and non-text elements"""
+        documents = [
+            "<html><head></head><body><p>No article</p></body></html>",
+            '<html><head><title> A </title><meta name="og:title" content="B">'
+            '<meta property="og:title" content="B"><meta name="keywords">'
+            '<meta name="author" content=" Jane "></head><body><article>'
+            "<h1>Hi</h1><script>var x;</script><!-- ad --><p>Text <b>bold</b>"
+            "</p></article></body></html>",
+        ]
+        for document in documents:
+            self.assertEqual(
+                extraction.extract_article(document, backend="lxml"),
+                extraction.extract_article(document, backend="bs4"),
+            )
+
+
+class SentenceCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("analyzer.sentence_cache.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    def test_cached_sentences_skip_inference(self, patched_analyzer):
+        """Repeated sentences are only run through the model once"""
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+        cache = sentence_cache.SentenceCache("test-model", max_local=10, ttl=60)
+
+        with patch("analyzer.inference.get_sentence_cache", return_value=cache):
+            first = inference.analyze_sentences(["Read more.", "good", "Read more."])
+            # a fresh worker process only has the redis tier
+            cache.local.clear()
+            second = inference.analyze_sentences(["Read more.", "good", "bad"])
+            third = inference.analyze_sentences(["good"])
+
+        self.assertEqual(first, fake_sentiment_analyzer(["Read more.", "good"] * 2)[:3])
+        self.assertEqual(second, fake_sentiment_analyzer(["Read more.", "good", "bad"]))
+        self.assertEqual(third, fake_sentiment_analyzer(["good"]))
+        batches = [
+            call.args[0] for call in patched_analyzer.return_value.call_args_list
+        ]
+        self.assertEqual(batches, [["good", "Read more."], ["bad"]])
+        self.assertEqual(cache.stats, {"local_hits": 1, "remote_hits": 2, "misses": 3})
+        self.assertAlmostEqual(cache.hit_rate(), 0.5)
+
+    def test_cache_namespace(self):
+        """Outputs cached for one model are not visible to another"""
+        output = {"label": "POSITIVE", "score": 0.9}
+        sentence_cache.SentenceCache("model-a").set_many({"Read more.": output})
+        self.assertEqual(
+            sentence_cache.SentenceCache("model-a").get_many(["Read more."]),
+            {"Read more.": output},
+        )
+        self.assertEqual(
+            sentence_cache.SentenceCache("model-b").get_many(["Read more."]), {}
+        )
+
+    def test_cache_namespace_quantized(self):
+        """int8 ONNX outputs are cached apart from the fp32 ones"""
+        with self.settings(SENTIMENT_BACKEND="onnx", SENTIMENT_ONNX_QUANTIZE=False):
+            fp32 = sentence_cache.get_sentence_cache().namespace
+        with self.settings(SENTIMENT_BACKEND="onnx", SENTIMENT_ONNX_QUANTIZE=True):
+            int8 = sentence_cache.get_sentence_cache().namespace
+        self.assertNotEqual(fp32, int8)
+
+    def test_local_tier_bounded(self):
+        """The in-process tier evicts the least recently used sentences"""
+        cache = sentence_cache.SentenceCache("model-a", max_local=2)
+        output = {"label": "POSITIVE", "score": 0.9}
+        cache.set_many({"a": output, "b": output})
+        cache.get_many(["a"])
+        cache.set_many({"c": output})
+        self.assertEqual(
+            list(cache.local.keys()),
+            [sentence_cache.sentence_key("a"), sentence_cache.sentence_key("c")],
+        )
+
+
+STORY = (
+    "Stocks rallied on Thursday after the central bank signaled it would hold "
+    "interest rates steady for the rest of the year, easing fears of a slowdown. "
+    "The Dow gained 300 points while the Nasdaq rose two percent by the close. "
+    "Analysts said investors were relieved by the decision and expect earnings "
+    "season to drive the market through the end of the quarter."
+)
+
+
+class MinHashTestCase(SimpleTestCase):
+    def test_similarity(self):
+        """Lightly edited copies are similar, unrelated bodies are not"""
+        edited = STORY.replace("two percent", "2%") + " Updated 5:00 PM ET."
+        unrelated = "It rained all week in Seattle and the ferries were late. " * 3
+        sig = minhash.signature(STORY)
+        self.assertEqual(len(sig), 128)
+        self.assertEqual(sig, minhash.signature(STORY))
+        self.assertGreater(minhash.similarity(sig, minhash.signature(edited)), 0.7)
+        self.assertLess(minhash.similarity(sig, minhash.signature(unrelated)), 0.1)
+        self.assertIsNone(minhash.signature("..."))
+
+    def test_band_keys(self):
+        """Each band of rows hashes to its own bucket key"""
+        keys = minhash.band_keys(minhash.signature(STORY))
+        self.assertEqual(len(keys), 32)
+        self.assertEqual(len(set(keys)), 32)
+        self.assertTrue(all(len(key) <= 16 for key in keys))
+
+
+@override_settings(SENTIMENT_CACHE_ENABLED=False)
+class NearDuplicateTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        bodies = [
+            STORY,
+            STORY.replace("Thursday", "Friday"),
+            "It rained all week in Seattle and the ferries were late again.",
+        ]
+        cls.articles = []
+        for idx, body in enumerate(bodies):
+            article = Article(
+                rss_entry=RSSEntry.objects.create(
+                    feed=feed, link=f"http://example.com/{idx}", title=f"Entry {idx}"
+                ),
+                body=body,
+            )
+            article.set_minhash()
+            article.save()
+            cls.articles.append(article)
+
+    def test_find_near_duplicate(self):
+        """Near-duplicates are found through the LSH bands"""
+        original, edited, unrelated = self.articles
+        self.assertEqual(edited.find_near_duplicate(), original)
+        self.assertEqual(original.find_near_duplicate(), edited)
+        self.assertIsNone(unrelated.find_near_duplicate())
+
+    def test_find_near_duplicate_earliest(self):
+        """The earliest published candidates are compared first, and win ties"""
+        original, edited, _ = self.articles
+        now = timezone.now()
+        RSSEntry.objects.filter(pk=original.rss_entry_id).update(pub_date=now)
+        earlier = Article(
+            rss_entry=RSSEntry.objects.create(
+                feed=original.rss_entry.feed,
+                link="http://example.com/earlier",
+                title="Earlier entry",
+                pub_date=now - timedelta(days=1),
+            ),
+            body=original.body,
+        )
+        earlier.set_minhash()
+        earlier.save()
+        self.assertEqual(edited.find_near_duplicate(), earlier)
+        with self.settings(NEAR_DUPLICATE_CANDIDATES=1):
+            self.assertEqual(edited.find_near_duplicate(), earlier)
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    @patch("analyzer.tasks.get_sentence_tokenizer")
+    def test_reuse_near_duplicate_sentiment(self, patched_tokenizer, patched_analyzer):
+        """Sentences shared with a scored near-duplicate are not inferred again"""
+        patched_tokenizer.return_value.tokenize = lambda body: [
+            s.strip() + "." for s in body.split(".") if s.strip()
+        ]
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+        original, edited, _ = self.articles
+        tasks.compute_sentiments([original.pk])
+        self.assertEqual(patched_analyzer.return_value.call_count, 1)
+
+        Article.objects.filter(pk=edited.pk).update(cluster_id=original.pk)
+        tasks.compute_sentiments([edited.pk])
+        inferred = patched_analyzer.return_value.call_args.args[0]
+        self.assertEqual(len(inferred), 1)
+        self.assertIn("Friday", inferred[0])
+        self.assertEqual(Article.objects.get(pk=edited.pk).sentence_count, 3)
+
+    def test_collapse_filter_backend(self):
+        """Collapsing is opt-in per request, on the view's cluster field"""
+        view = MagicMock(collapse_field="cluster_id")
+        search = MagicMock()
+        backend = CollapseFilterBackend()
+
+        request = Request(APIRequestFactory().get("/search/articles/"))
+        self.assertIs(backend.filter_queryset(request, search, view), search)
+
+        request = Request(APIRequestFactory().get("/search/articles/?collapse=true"))
+        backend.filter_queryset(request, search, view)
+        search.extra.assert_called_once_with(collapse={"field": "cluster_id"})
+
+
+@override_settings(SENTIMENT_CACHE_ENABLED=False, PIPELINE_FUSED=True)
+class FusedPipelineTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.feed = RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+
+    @patch("analyzer.inference.get_sentiment_analyzer")
+    @patch("analyzer.tasks.get_sentence_tokenizer")
+    def test_parse_fetched_entries(self, patched_tokenizer, patched_analyzer):
+        """Fetched entries are parsed and scored in process, from memory"""
+        patched_tokenizer.return_value.tokenize = lambda body: [
+            s.strip() + "." for s in body.split(".") if s.strip()
+        ]
+        patched_analyzer.return_value = MagicMock(side_effect=fake_sentiment_analyzer)
+        rss_entry = RSSEntry(
+            feed=self.feed,
+            link="http://example.com/fused",
+            title="Fused",
+            raw_html=(
+                "<html><head><title>Fused</title></head>"
+                f"<body><article><p>{STORY}</p></article></body></html>"
+            ),
+            content_type="text/html",
+            is_html=True,
+            stage=RSSEntry.Stage.FETCHED,
+        )
+        rss_entry.save()
+
+        with patch("crawler.models.get_content_store") as patched_store, patch.object(
+            tasks.parse_html_entry, "delay"
+        ) as parse_delay, patch.object(tasks.compute_sentiment, "delay") as delay:
+            crawler_tasks.parse_fetched_entries([rss_entry])
+        # the raw HTML and body are not read back, nor are tasks dispatched
+        patched_store.return_value.get.assert_not_called()
+        parse_delay.assert_not_called()
+        delay.assert_not_called()
+
+        rss_entry.refresh_from_db()
+        self.assertEqual(rss_entry.stage, RSSEntry.Stage.SCORED)
+        self.assertIsNone(rss_entry.claimed_until)
+        self.assertEqual(rss_entry.article.sentence_count, 3)
+
+
+class SentimentBackendsTestCase(SimpleTestCase):
+    def test_unknown_backend(self):
+        """Misconfigured backends fail loudly"""
+        with self.assertRaises(ImproperlyConfigured):
+            sentiment_backends.load_sentiment_backend("tensorrt")
+
+    @override_settings(SENTIMENT_BACKEND="quantized")
+    @patch.dict(sentiment_backends.SENTIMENT_BACKENDS, {"quantized": MagicMock()})
+    def test_configured_backend(self):
+        """The analyzer registry loads the configured backend"""
+        inference._registry.clear()
+        self.addCleanup(inference._registry.clear)
+        classifier = inference.get_sentiment_analyzer()
+        loader = sentiment_backends.SENTIMENT_BACKENDS["quantized"]
+        loader.assert_called_once_with(
+            "distilbert-base-uncased-finetuned-sst-2-english"
+        )
+        self.assertIs(classifier, loader.return_value)
+
+    def test_onnx_pipeline_outputs(self):
+        """ONNX logits are converted to the transformers pipeline output format"""
+        session = MagicMock()
+        session.get_inputs.return_value = [MagicMock(), MagicMock()]
+        session.get_inputs.return_value[0].name = "input_ids"
+        session.get_inputs.return_value[1].name = "attention_mask"
+        session.run.return_value = [np.array([[2.0, -1.0], [-0.5, 1.5]])]
+        tokenizer = MagicMock(
+            return_value={
+                "input_ids": np.ones((2, 4)),
+                "attention_mask": np.ones((2, 4)),
+                "token_type_ids": np.zeros((2, 4)),
+            }
+        )
+        classifier = sentiment_backends.OnnxSentimentPipeline(
+            session, tokenizer, {0: "NEGATIVE", 1: "POSITIVE"}
+        )
+
+        outputs = classifier(["A bad day.", "A good day."])
+        self.assertEqual(
+            [output["label"] for output in outputs], ["NEGATIVE", "POSITIVE"]
+        )
+        self.assertAlmostEqual(outputs[0]["score"], 1 / (1 + np.exp(-3.0)))
+        self.assertAlmostEqual(outputs[1]["score"], 1 / (1 + np.exp(-2.0)))
+        inputs = session.run.call_args.args[1]
+        self.assertEqual(sorted(inputs.keys()), ["attention_mask", "input_ids"])
+        self.assertEqual(inputs["input_ids"].dtype, np.int64)
+
+    def test_export_onnx(self):
+        """Graphs are exported aside and moved into place, named per model"""
+
+        def convert(output, **kwargs):
+            # into a new directory, next to the graph so that it is moved atomically
+            self.assertFalse(output.parent.exists())
+            self.assertEqual(str(output.parents[2]), os.path.dirname(onnx_path))
+            output.parent.mkdir()
+            output.write_text("graph")
+
+        converter = MagicMock(convert=MagicMock(side_effect=convert))
+        with tempfile.TemporaryDirectory() as models_dir, patch.dict(
+            "sys.modules", {"transformers.convert_graph_to_onnx": converter}
+        ):
+            onnx_path = os.path.join(models_dir, "models", "sentiment.onnx")
+            graph_names = {
+                sentiment_backends.onnx_graph_path(onnx_path, model, quantize).name
+                for model in ["model-a", "model-b"]
+                for quantize in [False, True]
+            }
+            self.assertEqual(len(graph_names), 4)
+            int8_path = sentiment_backends.onnx_graph_path(onnx_path, "model-a", True)
+            self.assertTrue(int8_path.name.endswith("-int8.onnx"))
+            sentiment_backends.export_onnx("model", onnx_path)
+            with open(onnx_path) as graph:
+                self.assertEqual(graph.read(), "graph")
+            # no partial export is left behind
+            self.assertEqual(os.listdir(os.path.dirname(onnx_path)), ["sentiment.onnx"])
+
+    def test_parity(self):
+        """Backends are compared to the fp32 labels and positive scores"""
+        from analyzer.management.commands.benchmark_sentiment import parity
+
+        reference = [
+            {"label": "POSITIVE", "score": 0.9},
+            {"label": "NEGATIVE", "score": 0.6},
+        ]
+        outputs = [
+            {"label": "POSITIVE", "score": 0.85},
+            {"label": "POSITIVE", "score": 0.55},
+        ]
+        agreement, max_diff = parity(reference, outputs)
+        self.assertEqual(agreement, 0.5)
+        self.assertAlmostEqual(max_diff, 0.15)
+        self.assertEqual(parity([], []), (1.0, 0.0))
+
+
+class PreprocessingTestCase(SimpleTestCase):
+    def test_approximate_tokens(self):
+        """Words and punctuation are tokens, long words count as several"""
+        self.assertEqual(preprocessing.approximate_tokens("A good day."), 4)
+        self.assertEqual(preprocessing.approximate_tokens("x" * 20), 3)
+
+    def test_junk_sentences_dropped(self):
+        """Tables, numbers and URLs are not scored"""
+        sentences = [
+            "A good day.",
+            "| 1.2 | 3.4 | 5.6 |",
+            "2020-10-04 12:00 ET",
+            "https://money.cnn.com/2018/10/04/investing/",
+            "   ",
+            "Stocks fell 2% on Thursday.",
+        ]
+        self.assertEqual(
+            preprocessing.prepare_sentences(sentences),
+            ["A good day.", "Stocks fell 2% on Thursday."],
+        )
+
+    def test_long_sentences_split(self):
+        """Over-length sentences are split at clauses into chunks that fit"""
+        clause = "the market rallied after the central bank held rates steady"
+        sentence = "; ".join([clause] * 6) + "."
+        chunks = preprocessing.split_sentence(sentence, max_tokens=30)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(preprocessing.approximate_tokens(chunk), 30)
+            self.assertTrue(chunk.startswith("the market"), chunk)
+        self.assertEqual(" ".join(chunks), sentence)
+
+        # chunks are slices of the sentence, whitespace included
+        sentence = sentence.replace("; ", ";\n")
+        for chunk in preprocessing.split_sentence(sentence, max_tokens=30):
+            self.assertIn(chunk, sentence)
+
+        # a single pathological word is truncated rather than failing the article
+        (chunk,) = preprocessing.split_sentence("x" * 5000, max_tokens=30)
+        self.assertLessEqual(preprocessing.approximate_tokens(chunk), 30)
+
+    def test_locate_sentences(self):
+        """Sentences are located in order, repeats and whitespace changes included"""
+        text = "Up again. Down.\nUp again. Flat  today."
+        self.assertEqual(
+            preprocessing.locate_sentences(
+                text, ["Up again.", "Down.", "Up again.", "Flat today.", "Missing."]
+            ),
+            [(0, 9), (10, 15), (16, 25), (26, 38), None],
+        )
+
+    def test_bucket_batches(self):
+        """Batches are bounded by sentence count and padded tokens"""
+        sentences = ["word " * 20] * 3 + ["ok"] * 5
+        batches = preprocessing.bucket_batches(
+            sentences, batch_size=4, max_batch_tokens=40
+        )
+        self.assertEqual(batches, [[3, 4, 5, 6], [7], [0, 1], [2]])
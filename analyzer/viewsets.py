@@ -18,12 +18,25 @@ from django_elasticsearch_dsl_drf.filter_backends import (
     DefaultOrderingFilterBackend,
 )
 from django_elasticsearch_dsl_drf.viewsets import BaseDocumentViewSet
+from rest_framework.filters import BaseFilterBackend
 from django_elasticsearch_dsl_drf.pagination import LimitOffsetPagination
 
 from analyzer.documents import ArticleDocument
 from analyzer.serializers import ArticleDocumentSerializer
 
 
+class CollapseFilterBackend(BaseFilterBackend):
+    """Collapse near-duplicate hits into one with `?collapse=true`"""
+
+    collapse_param = "collapse"
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.collapse_param, "")
+        if value.lower() not in ("1", "true", "yes"):
+            return queryset
+        return queryset.extra(collapse={"field": view.collapse_field})
+
+
 class ArticleDocumentView(BaseDocumentViewSet):
     """The ArticleDocument view for Django Rest Framework/ElasticSearch"""
 
@@ -36,8 +49,12 @@ class ArticleDocumentView(BaseDocumentViewSet):
         CompoundSearchFilterBackend,
         FilteringFilterBackend,
         OrderingFilterBackend,
+        CollapseFilterBackend,
     ]
 
+    # near-duplicate articles share a cluster_id, see CollapseFilterBackend
+    collapse_field = "cluster_id"
+
     # Define search fields
     search_fields = ("title", "author", "keywords", "body")
 
@@ -57,4 +74,8 @@ class ArticleDocumentView(BaseDocumentViewSet):
         },
     }
 
-    ordering_fields = {"publication_date": "publication_date", "title": "title"}
+    ordering_fields = {
+        "publication_date": "publication_date",
+        "title": "title",
+        "sentiment": "overall_sentiment.avg",
+    }
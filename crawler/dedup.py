@@ -0,0 +1,112 @@
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db.models import F, Q
+from semscrape import metrics
+
+from crawler.models import RSSEntry
+from crawler.storage import EMPTY_CONTENT_KEY
+
+# query parameters that only track the referrer, not part of the content address
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|cid|ncid|fbclid|gclid|xid)$", re.IGNORECASE)
+# stages of entries that may be the canonical entry of their duplicates
+CANONICAL_STAGES = [
+    RSSEntry.Stage.FETCHED,
+    RSSEntry.Stage.PARSED,
+    RSSEntry.Stage.SCORED,
+]
+
+
+def canonicalize_url(url):
+    """Return the URL without tracking query parameters, fragment or trailing slash."""
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    query = [
+        (k, v) for (k, v) in parse_qsl(parts.query) if not TRACKING_PARAMS.match(k)
+    ]
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/") or "/",
+            urlencode(sorted(query)),
+            "",
+        )
+    )[:2048]
+
+
+def body_hash(body):
+    """Return the content hash of an article body, insensitive to whitespace/case."""
+    normalized = " ".join(body.split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def mark_duplicates(rss_entries):
+    """Point fetched RSSEntries at an earlier entry with the same content, no save.
+
+    An entry is a duplicate when its canonical URL or raw HTML matches an entry
+    that is not itself a duplicate. Only successfully fetched HTML entries are
+    canonical, so error pages never stand in for a later good fetch. Duplicates
+    are skipped by the pipeline and share the canonical entry's Article, they are
+    counted in `pipeline_duplicate_entries_total`. Returns the duplicate RSSEntries.
+    """
+    candidates = [e for e in rss_entries if e.stage == RSSEntry.Stage.FETCHED]
+    urls = {e.canonical_url for e in candidates if e.canonical_url}
+    keys = {e.raw_html_key for e in candidates} - {None, EMPTY_CONTENT_KEY}
+    if not candidates:
+        return []
+
+    existing = (
+        RSSEntry.objects.filter(Q(canonical_url__in=urls) | Q(raw_html_key__in=keys))
+        .filter(canonical_entry__isnull=True, stage__in=CANONICAL_STAGES)
+        .filter(status_code__gte=200, status_code__lt=300)
+        .exclude(pk__in=[e.pk for e in candidates])
+        .only("link", "canonical_url", "raw_html_key")
+    )
+    by_url = {}
+    by_key = {}
+    for rss_entry in list(existing) + candidates:
+        canonical = by_url.get(rss_entry.canonical_url)
+        duplicate_of = "url"
+        if canonical is None:
+            canonical = by_key.get(rss_entry.raw_html_key)
+            duplicate_of = "html"
+        if canonical is not None:
+            rss_entry.canonical_entry = canonical
+            rss_entry.set_stage(RSSEntry.Stage.SKIPPED)
+            metrics.incr("pipeline_duplicate_entries_total", duplicate_of=duplicate_of)
+            continue
+        if not 200 <= (rss_entry.status_code or 0) < 300:
+            continue
+        if rss_entry.canonical_url:
+            by_url.setdefault(rss_entry.canonical_url, rss_entry)
+        if rss_entry.raw_html_key in keys:
+            by_key.setdefault(rss_entry.raw_html_key, rss_entry)
+    return [e for e in candidates if e.canonical_entry is not None]
+
+
+def dedup_stats():
+    """Return how many entries were deduplicated, and the work that saved."""
+    from analyzer.models import Article
+
+    duplicates = RSSEntry.objects.filter(canonical_entry__isnull=False)
+    by_url = duplicates.filter(canonical_url=F("canonical_entry__canonical_url"))
+    by_html = duplicates.filter(raw_html_key=F("canonical_entry__raw_html_key"))
+    fetched = RSSEntry.objects.exclude(stage=RSSEntry.Stage.NEW).count()
+    stats = {
+        "fetched_entries": fetched,
+        "duplicate_entries": duplicates.count(),
+        "duplicate_url": by_url.count(),
+        "duplicate_html": by_html.exclude(pk__in=by_url).count(),
+        "duplicate_body": duplicates.exclude(pk__in=by_url)
+        .exclude(pk__in=by_html)
+        .count(),
+        "articles": Article.objects.count(),
+    }
+    # parses skipped by fetch time dedup, sentiment runs skipped by all dedup
+    stats["parses_saved"] = stats["duplicate_url"] + stats["duplicate_html"]
+    stats["inferences_saved"] = stats["duplicate_entries"]
+    stats["duplicate_ratio"] = stats["duplicate_entries"] / fetched if fetched else 0.0
+    return stats
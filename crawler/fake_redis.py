@@ -0,0 +1,88 @@
+class FakeRedis:
+    """Just enough of an in-memory redis client for the tests, keyed like redis
+
+    `values` maps each key to bytes for strings, a set for sets, a dict of
+    {field: value} for hashes and a dict of {member: score} for sorted sets.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+    def multi(self):
+        pass
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        result = func(self)
+        return result if value_from_callable else []
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = str(value).encode()
+
+    def setex(self, key, ttl, value):
+        self.set(key, value)
+
+    def flushdb(self):
+        self.values.clear()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def incrby(self, key, amount):
+        self.set(key, int(self.values.get(key, 0)) + amount)
+        return int(self.values[key])
+
+    def decr(self, key):
+        return self.incrby(key, -1)
+
+    def llen(self, key):
+        return 0
+
+    def hincrbyfloat(self, key, field, value):
+        fields = self.values.setdefault(key, {})
+        fields[field] = fields.get(field, 0.0) + value
+
+    def hgetall(self, key):
+        fields = self.values.get(key, {})
+        return {field.encode(): str(v).encode() for (field, v) in fields.items()}
+
+    def sadd(self, key, *values):
+        self.values.setdefault(key, set()).update(v.encode() for v in values)
+
+    def smembers(self, key):
+        return set(self.values.get(key, set()))
+
+    def scard(self, key):
+        return len(self.values.get(key, set()))
+
+    def spop(self, key, count):
+        members = self.values.get(key, set())
+        popped = sorted(members)[:count]
+        members.difference_update(popped)
+        return popped
+
+    def zadd(self, key, mapping):
+        self.values.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, member):
+        self.values.get(key, {}).pop(member, None)
+
+    def zcard(self, key):
+        return len(self.values.get(key, {}))
+
+    def zremrangebyscore(self, key, low, high):
+        scores = self.values.get(key, {})
+        for member in [m for (m, score) in scores.items() if score <= high]:
+            del scores[member]
@@ -0,0 +1,172 @@
+import json
+import time
+import uuid
+from collections import defaultdict
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from semscrape import metrics
+from semscrape.redis_client import get_redis
+
+from crawler.politeness import host_of
+
+logger = get_task_logger(__name__)
+
+# the latest completed fetch cycle, {"cycle", "started_at", "seconds", "tasks"}
+LAST_CYCLE_KEY = "crawler:cycle:last"
+CYCLE_BUCKETS = [30, 60, 120, 300, 600, 900, 1800, 3600, 7200]
+
+
+def link_seconds(state):
+    """Return the expected seconds of fetching one more link of the HostState."""
+    latency = state.latency
+    if latency is None:
+        latency = settings.CRAWLER_DEFAULT_LATENCY
+    # requests to a host overlap up to the per host connections, within its rate
+    return max(latency / settings.CRAWLER_CONCURRENCY_PER_HOST, 1 / state.rate)
+
+
+def plan_chunks(links, scheduler, seconds=None, max_size=None):
+    """Split the links into fetch chunks of about `seconds` of work each.
+
+    Hosts are fetched concurrently, so a chunk is full once the expected work of
+    any one of its hosts reaches `seconds`: the links of slow hosts are spread
+    over many small chunks, those of fast hosts share large ones.
+    """
+    seconds = seconds or settings.CRAWLER_CHUNK_SECONDS
+    max_size = max_size or settings.CRAWLER_BATCH_SIZE
+    chunks = []
+    chunk = []
+    host_seconds = defaultdict(float)
+    for link in links:
+        host = host_of(link)
+        cost = link_seconds(scheduler.state(host))
+        if chunk and (len(chunk) >= max_size or host_seconds[host] + cost > seconds):
+            chunks.append(chunk)
+            chunk = []
+            host_seconds.clear()
+        chunk.append(link)
+        host_seconds[host] += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def slots_key(stage):
+    return f"pipeline:in_flight:{stage}"
+
+
+def acquire_slot(stage):
+    """Take one of the stage's PIPELINE_MAX_IN_FLIGHT task slots, return its token.
+
+    Slots are members of a redis sorted set scored by their lease expiry, so the
+    slots of lost tasks are reclaimed. Returns None when the stage is full.
+    """
+    key = slots_key(stage)
+    now = time.time()
+    token = uuid.uuid4().hex
+    try:
+        redis = get_redis()
+        redis.zremrangebyscore(key, "-inf", now)
+        redis.zadd(key, {token: now + settings.CELERY_TASK_TIME_LIMIT})
+        if redis.zcard(key) > settings.PIPELINE_MAX_IN_FLIGHT[stage]:
+            # concurrent acquirers may both back off, the cap is never exceeded
+            redis.zrem(key, token)
+            return None
+    except Exception as e:
+        logger.warn(f"In-flight slots of `{stage}` unavailable: {e}")
+        return None
+    return token
+
+
+def release_slot(stage, token):
+    """Give back a slot taken by `acquire_slot`."""
+    if token is None:
+        return
+    try:
+        get_redis().zrem(slots_key(stage), token)
+    except Exception as e:
+        logger.warn(f"In-flight slots of `{stage}` unavailable: {e}")
+
+
+def dispatch_in_flight(stage, task, calls):
+    """Dispatch `task(*args, slot=...)` for each args of `calls` while the stage
+    has free slots, see `acquire_slot`. Returns the args left undispatched.
+    """
+    for idx, args in enumerate(calls):
+        slot = acquire_slot(stage)
+        if slot is None:
+            return calls[idx:]
+        task.delay(*args, slot=slot)
+    return []
+
+
+def cycle_key(cycle_id, field):
+    return f"crawler:cycle:{cycle_id}:{field}"
+
+
+def start_cycle(tasks):
+    """Start a crawl cycle of `tasks` pending tasks, return the cycle id.
+
+    Tasks of the cycle count the tasks they dispatch with `add_cycle_tasks`, before
+    dispatching them, and call `finish_cycle_task` once done. The cycle completes
+    when no task is pending. Cycles with lost tasks expire after CRAWLER_CYCLE_TTL.
+    A cycle covers the feed and fetch tasks only, the parsing and scoring of the
+    fetched entries is dispatched on its own and not counted.
+    """
+    cycle_id = uuid.uuid4().hex
+    ttl = settings.CRAWLER_CYCLE_TTL
+    try:
+        redis = get_redis()
+        redis.set(cycle_key(cycle_id, "started_at"), time.time(), ex=ttl)
+        redis.set(cycle_key(cycle_id, "tasks"), tasks, ex=ttl)
+        redis.set(cycle_key(cycle_id, "pending"), tasks, ex=ttl)
+    except Exception as e:
+        logger.warn(f"Crawl cycle not tracked: {e}")
+        return None
+    return cycle_id
+
+
+def add_cycle_tasks(cycle_id, tasks):
+    """Count `tasks` more pending tasks of the cycle, before they are dispatched."""
+    if cycle_id is None or not tasks:
+        return
+    try:
+        get_redis().incrby(cycle_key(cycle_id, "tasks"), tasks)
+        get_redis().incrby(cycle_key(cycle_id, "pending"), tasks)
+    except Exception as e:
+        logger.warn(f"Crawl cycle `{cycle_id}` not tracked: {e}")
+
+
+def finish_cycle_task(cycle_id):
+    """Count a finished task of the cycle, the last one reports the cycle duration."""
+    if cycle_id is None:
+        return
+    keys = [cycle_key(cycle_id, field) for field in ["started_at", "tasks", "pending"]]
+    try:
+        redis = get_redis()
+        if redis.decr(keys[-1]) > 0:
+            return
+        started_at, tasks, _ = redis.mget(keys)
+        redis.delete(*keys)
+        if started_at is None:
+            # the cycle expired, or was not tracked
+            return
+        finished_at = time.time()
+        cycle = {
+            "cycle": cycle_id,
+            "started_at": float(started_at),
+            "seconds": finished_at - float(started_at),
+            "tasks": int(tasks or 0),
+        }
+        redis.set(LAST_CYCLE_KEY, json.dumps(cycle))
+    except Exception as e:
+        logger.warn(f"Crawl cycle `{cycle_id}` not tracked: {e}")
+        return
+    metrics.observe(
+        "crawler_fetch_cycle_seconds", cycle["seconds"], buckets=CYCLE_BUCKETS
+    )
+    logger.info(
+        f"Fetch cycle `{cycle_id}` of {cycle['tasks']} tasks "
+        f"finished in {cycle['seconds']:.1f}s"
+    )
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import namedtuple
+
+import aiohttp
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+logger = get_task_logger(__name__)
+
+# outcome of a single GET, `error` is set when no response was received
+FetchResult = namedtuple(
+    "FetchResult",
+    ["link", "url", "status_code", "headers", "text", "error", "latency"],
+    defaults=[None],
+)
+# FetchResult error of links the HostScheduler deferred rather than requested
+DEFERRED = "deferred"
+
+
+async def fetch_one(session, link, timeout, headers=None, scheduler=None):
+    """GET a single link, returning a FetchResult instead of raising.
+
+    With a HostScheduler, the request waits for the host's token bucket and the
+    response status and latency are recorded against the host. Links the host
+    cannot serve in time are not requested, their error is DEFERRED.
+    """
+    if scheduler is not None and not await scheduler.acquire(link):
+        return FetchResult(link, None, None, None, None, DEFERRED)
+    started = time.monotonic()
+    result = await _fetch_one(session, link, timeout, headers)
+    if result.error is None:
+        result = result._replace(latency=time.monotonic() - started)
+    if scheduler is not None:
+        scheduler.record(link, result.status_code, result.headers, result.latency)
+    return result
+
+
+async def _fetch_one(session, link, timeout, headers=None):
+    try:
+        async with session.get(link, timeout=timeout, headers=headers) as resp:
+            content_type = resp.headers.get("Content-Type", "")
+            text = ""
+            if resp.status == 304:
+                # not modified since the conditional request validators, no body
+                pass
+            elif "text" in content_type:
+                text = await resp.text(errors="replace")
+            else:
+                logger.warn(f"Unsupported Content-Type `{content_type}` from `{link}`")
+            return FetchResult(
+                link, str(resp.url), resp.status, dict(resp.headers), text, None
+            )
+    except asyncio.TimeoutError:
+        # connection to server timed out or server did not send data in time
+        logger.warn(f"Request timeout for `{link}`")
+        return FetchResult(link, None, None, None, None, "timeout")
+    except aiohttp.ClientError as e:
+        # arbitrary aiohttp related exception
+        logger.warn(f"Could not GET `{link}`: `{e}`")
+        return FetchResult(link, None, None, None, None, str(e))
+
+
+async def fetch_all(
+    links,
+    concurrency=None,
+    per_host=None,
+    timeout=None,
+    request_headers=None,
+    scheduler=None,
+):
+    """Concurrently GET all links over one pool of reusable connections.
+
+    `concurrency` caps the number of open connections overall and `per_host`
+    caps the open connections to any single host. `request_headers` optionally
+    maps a link to extra headers sent with its request. An optional `scheduler`
+    (HostScheduler) rate limits each host, see `fetch_one`.
+    """
+    request_headers = request_headers or {}
+    connector = aiohttp.TCPConnector(
+        limit=concurrency or settings.CRAWLER_CONCURRENCY,
+        limit_per_host=per_host or settings.CRAWLER_CONCURRENCY_PER_HOST,
+    )
+    timeout = aiohttp.ClientTimeout(total=timeout or settings.CRAWLER_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await asyncio.gather(
+            *[
+                fetch_one(session, link, timeout, request_headers.get(link), scheduler)
+                for link in links
+            ]
+        )
+
+
+def fetch_links(links, **kwargs):
+    """Synchronous entrypoint for fetch_all, usable within celery tasks."""
+    links = list(links)
+    if not links:
+        return []
+    return asyncio.run(fetch_all(links, **kwargs))
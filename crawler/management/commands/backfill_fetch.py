@@ -0,0 +1,41 @@
+from django.core.management.base import CommandError
+from django.db import transaction
+from semscrape.backfill import BackfillCommand
+
+from crawler.models import RSSEntry
+from crawler.tasks import request_articles
+
+
+class Command(BackfillCommand):
+    help = "Fetch the HTML of RSSEntries in resumable chunks, new and failed ones."
+    chunk_size = 100
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--stages",
+            nargs="+",
+            default=[RSSEntry.Stage.NEW, RSSEntry.Stage.FAILED],
+            help="Fetch the entries in these pipeline stages.",
+        )
+
+    def get_queryset(self, options):
+        unknown = set(options["stages"]) - set(RSSEntry.Stage.values)
+        if unknown:
+            raise CommandError(f"Unknown stages {sorted(unknown)}")
+        return RSSEntry.objects.filter(stage__in=options["stages"]).unclaimed()
+
+    @classmethod
+    def process_chunk(cls, pks, options):
+        # entries claimed by the dispatcher or a fetch task since are skipped, the
+        # others are claimed so that those do not fetch them concurrently
+        with transaction.atomic():
+            claimed = list(
+                RSSEntry.objects.filter(pk__in=pks, stage__in=options["stages"])
+                .unclaimed()
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)
+            )
+            rss_entries = RSSEntry.objects.filter(pk__in=claimed)
+            rss_entries.advance(RSSEntry.Stage.NEW, claim=True)
+        return len(request_articles(rss_entries))
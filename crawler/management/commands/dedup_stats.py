@@ -0,0 +1,21 @@
+import json
+
+from crawler.dedup import dedup_stats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Report deduplicated RSSEntries and the parsing/inference work saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Output as JSON.")
+
+    def handle(self, *args, **options):
+        stats = dedup_stats()
+        if options["json"]:
+            self.stdout.write(json.dumps(stats))
+            return
+        for name, value in stats.items():
+            if isinstance(value, float):
+                value = f"{value:.1%}"
+            self.stdout.write(f"{name}: {value}")
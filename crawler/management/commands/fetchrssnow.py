@@ -1,9 +1,14 @@
 from crawler.tasks import dispatch_crawl_feeds
 from django.core.management.base import BaseCommand
+from semscrape import metrics
 
 
 class Command(BaseCommand):
     help = "Immediately dispatch RSSFeed crawlers."
 
     def handle(self, *args, **options):
-        dispatch_crawl_feeds()
+        try:
+            dispatch_crawl_feeds()
+        finally:
+            # recorded outside of a celery task, not flushed on task_postrun
+            metrics.flush()
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0004_rssentry_dl_html"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rssfeed",
+            name="etag",
+            field=models.CharField(blank=True, default="", max_length=1024),
+        ),
+        migrations.AddField(
+            model_name="rssfeed",
+            name="last_modified",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
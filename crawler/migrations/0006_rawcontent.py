@@ -0,0 +1,141 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:52
+
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# frozen copy of crawler.storage at the time of this migration, gzip blobs only
+def content_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text):
+    return gzip.compress(text.encode("utf-8"), compresslevel=6)
+
+
+def decompress(blob):
+    blob = bytes(blob)
+    if blob.startswith(ZSTD_MAGIC):
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    if not blob.startswith(GZIP_MAGIC):
+        raise ValueError("Unrecognized raw content blob")
+    return gzip.decompress(blob).decode("utf-8")
+
+
+class DatabaseContentStore:
+    def __init__(self, model):
+        self.model = model
+
+    def get(self, key):
+        return decompress(self.model.objects.get(pk=key).data)
+
+    def put_many(self, contents):
+        self.model.objects.bulk_create(
+            [
+                self.model(key=key, data=compress(text), size=len(text))
+                for (key, text) in contents.items()
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class FileContentStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return decompress(f.read())
+
+    def put_many(self, contents):
+        for key, text in contents.items():
+            path = self.path(key)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compress(text))
+            os.replace(tmp_path, path)
+
+
+def get_content_store(model):
+    if settings.RAW_CONTENT_STORE == "file":
+        return FileContentStore(settings.RAW_CONTENT_ROOT)
+    return DatabaseContentStore(model)
+
+
+def move_raw_html_to_store(apps, schema_editor):
+    RSSEntry = apps.get_model("crawler", "RSSEntry")
+    store = get_content_store(model=apps.get_model("crawler", "RawContent"))
+
+    entries = RSSEntry.objects.filter(raw_html__isnull=False).only("raw_html")
+    chunk = []
+    for rss_entry in entries.iterator(chunk_size=CHUNK_SIZE):
+        rss_entry.raw_html_key = content_key(rss_entry.raw_html)
+        chunk.append(rss_entry)
+        if len(chunk) >= CHUNK_SIZE:
+            store.put_many({e.raw_html_key: e.raw_html for e in chunk})
+            RSSEntry.objects.bulk_update(chunk, ["raw_html_key"])
+            chunk = []
+    store.put_many({e.raw_html_key: e.raw_html for e in chunk})
+    RSSEntry.objects.bulk_update(chunk, ["raw_html_key"])
+
+
+def restore_raw_html_from_store(apps, schema_editor):
+    RSSEntry = apps.get_model("crawler", "RSSEntry")
+    store = get_content_store(model=apps.get_model("crawler", "RawContent"))
+
+    entries = RSSEntry.objects.filter(raw_html_key__isnull=False).only("raw_html_key")
+    chunk = []
+    for rss_entry in entries.iterator(chunk_size=CHUNK_SIZE):
+        rss_entry.raw_html = store.get(rss_entry.raw_html_key)
+        chunk.append(rss_entry)
+        if len(chunk) >= CHUNK_SIZE:
+            RSSEntry.objects.bulk_update(chunk, ["raw_html"])
+            chunk = []
+    RSSEntry.objects.bulk_update(chunk, ["raw_html"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0005_rssfeed_validators"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RawContent",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("data", models.BinaryField()),
+                ("size", models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="raw_html_key",
+            field=models.CharField(default=None, max_length=64, null=True),
+        ),
+        migrations.RunPython(move_raw_html_to_store, restore_raw_html_from_store),
+        migrations.RemoveField(
+            model_name="rssentry",
+            name="raw_html",
+        ),
+    ]
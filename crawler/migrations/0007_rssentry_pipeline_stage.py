@@ -0,0 +1,90 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_stages(apps, schema_editor):
+    """Derive the pipeline stage of existing entries from their processed data"""
+    RSSEntry = apps.get_model("crawler", "RSSEntry")
+    fetched = RSSEntry.objects.filter(raw_html_key__isnull=False)
+    is_html = models.Q(**{"headers__Content-Type__icontains": "text/html"})
+
+    fetched.filter(is_html, article__isnull=True).update(stage="fetched")
+    fetched.exclude(is_html).update(stage="skipped")
+    RSSEntry.objects.filter(article__body__isnull=True, article__isnull=False).update(
+        stage="skipped"
+    )
+    RSSEntry.objects.filter(
+        article__sentiment__exact={}, article__body__isnull=False
+    ).update(stage="parsed")
+    RSSEntry.objects.filter(article__isnull=False).exclude(
+        article__sentiment__exact={}
+    ).update(stage="scored")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0006_rawcontent"),
+        ("analyzer", "0003_overall_sentiment_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rssentry",
+            name="attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="claimed_until",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="stage",
+            field=models.CharField(
+                choices=[
+                    ("new", "New"),
+                    ("fetched", "Fetched"),
+                    ("parsed", "Parsed"),
+                    ("scored", "Scored"),
+                    ("skipped", "Skipped"),
+                    ("failed", "Failed"),
+                ],
+                default="new",
+                max_length=8,
+            ),
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="stage_changed_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.RunPython(backfill_stages, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="rssentry",
+            index=models.Index(
+                condition=models.Q(stage="new"),
+                fields=["stage_changed_at"],
+                name="rssentry_pending_fetch",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rssentry",
+            index=models.Index(
+                condition=models.Q(stage="fetched"),
+                fields=["stage_changed_at"],
+                name="rssentry_pending_parse",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rssentry",
+            index=models.Index(
+                condition=models.Q(stage="parsed"),
+                fields=["stage_changed_at"],
+                name="rssentry_pending_score",
+            ),
+        ),
+    ]
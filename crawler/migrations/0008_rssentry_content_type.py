@@ -0,0 +1,62 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+# frozen copy of crawler.models at the time of this migration
+HTML_CONTENT_TYPES = ["text/html", "application/xhtml+xml"]
+
+
+def normalize_content_type(headers):
+    for name, value in headers.items():
+        if name.lower() == "content-type":
+            return value.split(";")[0].strip().lower()[:128]
+    return ""
+
+
+def backfill_content_type(apps, schema_editor):
+    RSSEntry = apps.get_model("crawler", "RSSEntry")
+
+    entries = RSSEntry.objects.exclude(headers={}).only("headers")
+    chunk = []
+    for rss_entry in entries.iterator(chunk_size=CHUNK_SIZE):
+        rss_entry.content_type = normalize_content_type(rss_entry.headers)
+        rss_entry.is_html = rss_entry.content_type in HTML_CONTENT_TYPES
+        chunk.append(rss_entry)
+        if len(chunk) >= CHUNK_SIZE:
+            RSSEntry.objects.bulk_update(chunk, ["content_type", "is_html"])
+            chunk = []
+    RSSEntry.objects.bulk_update(chunk, ["content_type", "is_html"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0007_rssentry_pipeline_stage"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="rssentry",
+            name="rssentry_pending_parse",
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="content_type",
+            field=models.CharField(db_index=True, default="", max_length=128),
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="is_html",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_content_type, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="rssentry",
+            index=models.Index(
+                condition=models.Q(("is_html", True), ("stage", "fetched")),
+                fields=["stage_changed_at"],
+                name="rssentry_pending_parse",
+            ),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:05
+
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+CHUNK_SIZE = 500
+# frozen copy of crawler.dedup at the time of this migration
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|cid|ncid|fbclid|gclid|xid)$", re.IGNORECASE)
+
+
+def canonicalize_url(url):
+    if not url:
+        return ""
+    parts = urlsplit(url)
+    query = [
+        (k, v) for (k, v) in parse_qsl(parts.query) if not TRACKING_PARAMS.match(k)
+    ]
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/") or "/",
+            urlencode(sorted(query)),
+            "",
+        )
+    )[:2048]
+
+
+def backfill_canonical_url(apps, schema_editor):
+    RSSEntry = apps.get_model("crawler", "RSSEntry")
+
+    entries = RSSEntry.objects.filter(resolved_url__isnull=False).only("resolved_url")
+    chunk = []
+    for rss_entry in entries.iterator(chunk_size=CHUNK_SIZE):
+        rss_entry.canonical_url = canonicalize_url(rss_entry.resolved_url)
+        chunk.append(rss_entry)
+        if len(chunk) >= CHUNK_SIZE:
+            RSSEntry.objects.bulk_update(chunk, ["canonical_url"])
+            chunk = []
+    RSSEntry.objects.bulk_update(chunk, ["canonical_url"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0008_rssentry_content_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rssentry",
+            name="canonical_entry",
+            field=models.ForeignKey(
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="crawler.rssentry",
+            ),
+        ),
+        migrations.AddField(
+            model_name="rssentry",
+            name="canonical_url",
+            field=models.CharField(db_index=True, default="", max_length=2048),
+        ),
+        migrations.RunPython(backfill_canonical_url, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0009_rssentry_canonical"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rssfeed",
+            name="entry_rate",
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="rssfeed",
+            name="next_poll_at",
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="rssfeed",
+            name="poll_interval",
+            field=models.FloatField(default=1800),
+        ),
+        migrations.AddField(
+            model_name="rssfeed",
+            name="polled_at",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
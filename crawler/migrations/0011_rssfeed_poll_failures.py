@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crawler", "0010_rssfeed_schedule"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rssfeed",
+            name="poll_failures",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,15 @@
+import random
 import uuid
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
 from django.contrib.postgres.indexes import GinIndex
+from django.utils import timezone
+
+from crawler.storage import EMPTY_CONTENT_KEY, content_key, get_content_store
 
 
 class RSSFeed(models.Model):
@@ -11,15 +20,190 @@ class RSSFeed(models.Model):
     title = models.CharField(max_length=30)
     url = models.URLField(max_length=2048)
 
+    # HTTP cache validators of the latest feed response, for conditional requests
+    etag = models.CharField(max_length=1024, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+
+    # adaptive polling schedule, see schedule_next_poll
+    poll_interval = models.FloatField(default=60 * 30)  # seconds
+    entry_rate = models.FloatField(null=True, default=None)  # new entries per second
+    polled_at = models.DateTimeField(null=True, default=None)
+    next_poll_at = models.DateTimeField(null=True, default=None, db_index=True)
+    poll_failures = models.IntegerField(default=0)  # consecutive failed polls
+
+    # fields written by schedule_next_poll and schedule_retry, for updates
+    SCHEDULE_FIELDS = [
+        "poll_interval",
+        "entry_rate",
+        "polled_at",
+        "next_poll_at",
+        "poll_failures",
+    ]
+
     def __str__(self):
         return f"{self.organization}: {self.title} ({self.url})"
 
+    def schedule_next_poll(self, new_entries, now=None):
+        """Update the entry rate from a poll's new entries and schedule the next poll.
+
+        The next poll is due once CRAWLER_FEED_TARGET_ENTRIES new entries are
+        expected at the exponentially weighted rate, within the interval bounds and
+        jittered so feeds polled together drift apart. Does not save.
+        """
+        now = now or timezone.now()
+        if self.polled_at is not None and now > self.polled_at:
+            # the first poll finds every entry new, it is not a rate
+            observed = new_entries / (now - self.polled_at).total_seconds()
+            if self.entry_rate is None:
+                self.entry_rate = observed
+            else:
+                alpha = settings.CRAWLER_FEED_RATE_ALPHA
+                self.entry_rate = alpha * observed + (1 - alpha) * self.entry_rate
+
+        if self.entry_rate is not None:
+            interval = settings.CRAWLER_FEED_MAX_INTERVAL
+            if self.entry_rate > 0:
+                interval = settings.CRAWLER_FEED_TARGET_ENTRIES / self.entry_rate
+            self.poll_interval = min(
+                max(interval, settings.CRAWLER_FEED_MIN_INTERVAL),
+                settings.CRAWLER_FEED_MAX_INTERVAL,
+            )
+        jitter = random.uniform(-1, 1) * settings.CRAWLER_FEED_JITTER
+        self.polled_at = now
+        self.poll_failures = 0
+        self.next_poll_at = now + timedelta(seconds=self.poll_interval * (1 + jitter))
+
+    def schedule_retry(self, now=None):
+        """Schedule the next poll after a failed one, leaving the rate as is.
+
+        The failed poll observed nothing, so it is not a poll of the rate: the next
+        poll's new entries are counted since the last successful one. Retries back
+        off exponentially from CRAWLER_FEED_MIN_INTERVAL with the consecutive
+        failures, up to CRAWLER_FEED_MAX_INTERVAL. Does not save.
+        """
+        now = now or timezone.now()
+        self.poll_failures += 1
+        interval = min(
+            settings.CRAWLER_FEED_MIN_INTERVAL * 2 ** (self.poll_failures - 1),
+            settings.CRAWLER_FEED_MAX_INTERVAL,
+        )
+        jitter = random.uniform(-1, 1) * settings.CRAWLER_FEED_JITTER
+        self.next_poll_at = now + timedelta(seconds=interval * (1 + jitter))
+
+
+# media types parsed into Articles
+HTML_CONTENT_TYPES = ["text/html", "application/xhtml+xml"]
+
+
+def normalize_content_type(headers):
+    """Return the lowercase media type of the Content-Type header, sans params."""
+    for name, value in headers.items():
+        if name.lower() == "content-type":
+            return value.split(";")[0].strip().lower()[:128]
+    return ""
+
+
+class RSSEntryQuerySet(models.QuerySet):
+    def unclaimed(self):
+        """Entries that are not claimed, or whose lease expired."""
+        now = timezone.now()
+        return self.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+
+    def pending(self, stage):
+        """Entries in `stage` that are not claimed, oldest first."""
+        return self.unclaimed().filter(stage=stage).order_by("stage_changed_at")
+
+    def claim(self, stage, limit, lease=None):
+        """Claim up to `limit` unclaimed entries pending in `stage` for processing.
+
+        Rows locked by a concurrent claim are skipped, claimed rows are leased for
+        `lease` seconds so they are not dispatched again unless processing fails.
+        Entries that exhausted PIPELINE_MAX_ATTEMPTS are marked failed.
+        Returns the claimed primary keys.
+        """
+        now = timezone.now()
+        lease = lease or settings.PIPELINE_CLAIM_LEASE
+        pending = self.pending(stage)
+
+        with transaction.atomic():
+            pending.filter(attempts__gte=settings.PIPELINE_MAX_ATTEMPTS).update(
+                stage=RSSEntry.Stage.FAILED, stage_changed_at=now, claimed_until=None
+            )
+            claimed = list(
+                pending.filter(attempts__lt=settings.PIPELINE_MAX_ATTEMPTS)
+                .select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)[:limit]
+            )
+            RSSEntry.objects.filter(pk__in=claimed).update(
+                claimed_until=now + timedelta(seconds=lease),
+                attempts=F("attempts") + 1,
+            )
+        return claimed
+
+    def claim_batches(self, stage, batch_size, limit=None):
+        """Yield claimed batches of primary keys until none are pending or `limit`."""
+        limit = limit or settings.PIPELINE_DISPATCH_LIMIT
+        claimed_count = 0
+        while claimed_count < limit:
+            claimed = self.claim(stage, min(batch_size, limit - claimed_count))
+            if not claimed:
+                break
+            claimed_count += len(claimed)
+            yield claimed
+
+    def release(self):
+        """Give back the caller's claims, without counting their attempts."""
+        return self.update(claimed_until=None, attempts=Greatest(F("attempts") - 1, 0))
+
+    def advance(self, stage, claim=False):
+        """Move the entries to `stage`, optionally claimed by the caller."""
+        now = timezone.now()
+        claimed_until = None
+        if claim:
+            claimed_until = now + timedelta(seconds=settings.PIPELINE_CLAIM_LEASE)
+        return self.update(
+            stage=stage,
+            stage_changed_at=now,
+            attempts=1 if claim else 0,
+            claimed_until=claimed_until,
+        )
+
 
 class RSSEntry(models.Model):
     """The entries, or articles, contained within an RSS feed."""
 
+    class Stage(models.TextChoices):
+        """Pipeline stage, the work that is pending on the entry"""
+
+        NEW = "new"  # needs the HTML fetched
+        FETCHED = "fetched"  # needs the HTML parsed into an Article
+        PARSED = "parsed"  # needs the Article sentiment scored
+        SCORED = "scored"  # done
+        SKIPPED = "skipped"  # nothing to process, ie. not HTML or no article body
+        FAILED = "failed"  # gave up after PIPELINE_MAX_ATTEMPTS
+
     class Meta:
-        indexes = [GinIndex(fields=["headers"])]
+        indexes = [
+            GinIndex(fields=["headers"]),
+            # partial indexes of the pending work for each dispatcher
+            models.Index(
+                fields=["stage_changed_at"],
+                name="rssentry_pending_fetch",
+                condition=Q(stage="new"),
+            ),
+            models.Index(
+                fields=["stage_changed_at"],
+                name="rssentry_pending_parse",
+                condition=Q(stage="fetched", is_html=True),
+            ),
+            models.Index(
+                fields=["stage_changed_at"],
+                name="rssentry_pending_score",
+                condition=Q(stage="parsed"),
+            ),
+        ]
+
+    objects = RSSEntryQuerySet.as_manager()
 
     feed = models.ForeignKey(RSSFeed, on_delete=models.CASCADE)
 
@@ -29,11 +213,105 @@ class RSSEntry(models.Model):
     pub_date = models.DateTimeField(null=True)
 
     # storage for raw html, request metadata
-    raw_html = models.TextField(null=True, default=None)  # Raw HTML text
+    raw_html_key = models.CharField(max_length=64, null=True, default=None)
     resolved_url = models.URLField(null=True, max_length=2048)  # ie. redirects
     status_code = models.IntegerField(null=True)  # HTTP status code
     requested_at = models.DateTimeField(null=True)  # Latest request datetime
     headers = models.JSONField(db_index=True, default=dict)  # HTTP response headers
+    # resolved URL sans tracking params, see crawler.dedup.canonicalize_url
+    canonical_url = models.CharField(max_length=2048, db_index=True, default="")
+    # earlier entry with the same content, duplicates share its Article
+    canonical_entry = models.ForeignKey(
+        "self",
+        null=True,
+        default=None,
+        on_delete=models.SET_NULL,
+        related_name="duplicates",
+    )
+    # normalized Content-Type media type of the response, see set_headers
+    content_type = models.CharField(max_length=128, db_index=True, default="")
+    is_html = models.BooleanField(default=False)
+
+    # pipeline state, see RSSEntryQuerySet.claim
+    stage = models.CharField(max_length=8, choices=Stage.choices, default=Stage.NEW)
+    stage_changed_at = models.DateTimeField(null=True, default=timezone.now)
+    attempts = models.IntegerField(default=0)  # claims of the current stage
+    claimed_until = models.DateTimeField(null=True, default=None)
+
+    # fields written by set_stage, for bulk updates
+    STAGE_FIELDS = ["stage", "stage_changed_at", "attempts", "claimed_until"]
 
     def __str__(self):
         return f"{self.link} (HTTP {self.status_code})"
+
+    def set_headers(self, headers):
+        """Set the response headers and the content type derived from them"""
+        self.headers = headers
+        self.content_type = normalize_content_type(headers)
+        self.is_html = self.content_type in HTML_CONTENT_TYPES
+
+    def set_stage(self, stage):
+        """Move the entry to `stage` and release any claim, does not save"""
+        self.stage = stage
+        self.stage_changed_at = timezone.now()
+        self.attempts = 0
+        self.claimed_until = None
+
+    @property
+    def raw_html(self):
+        """Raw HTML text, lazily loaded from the raw content store"""
+        if self.raw_html_key is None:
+            return None
+        cached_key, raw_html, _pending = self.__dict__.get("_raw_html", (None,) * 3)
+        if cached_key != self.raw_html_key:
+            raw_html = get_content_store().get(self.raw_html_key)
+            self.__dict__["_raw_html"] = (self.raw_html_key, raw_html, False)
+        return raw_html
+
+    @raw_html.setter
+    def raw_html(self, raw_html):
+        self.raw_html_key = None
+        if raw_html is not None:
+            self.raw_html_key = content_key(raw_html)
+            self.__dict__["_raw_html"] = (self.raw_html_key, raw_html, True)
+
+    @property
+    def has_raw_html(self):
+        """Return True if non-empty raw HTML has been downloaded"""
+        return self.raw_html_key not in (None, EMPTY_CONTENT_KEY)
+
+    @staticmethod
+    def store_raw_html(rss_entries):
+        """Write the raw HTML set on the RSSEntries to the raw content store.
+
+        Must be called before bulk updating `raw_html_key`, save() calls it.
+        """
+        contents = {}
+        for rss_entry in rss_entries:
+            key, raw_html, pending = rss_entry.__dict__.get("_raw_html", (None,) * 3)
+            if pending and key == rss_entry.raw_html_key:
+                contents[key] = raw_html
+        if contents:
+            get_content_store().put_many(contents)
+        for rss_entry in rss_entries:
+            if rss_entry.raw_html_key in contents:
+                rss_entry.__dict__["_raw_html"] = (
+                    rss_entry.raw_html_key,
+                    contents[rss_entry.raw_html_key],
+                    False,
+                )
+
+    def save(self, *args, **kwargs):
+        RSSEntry.store_raw_html([self])
+        super().save(*args, **kwargs)
+
+
+class RawContent(models.Model):
+    """Compressed raw content, keyed by the sha256 of the uncompressed text."""
+
+    key = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.IntegerField()  # uncompressed length
+
+    def __str__(self):
+        return f"{self.key} ({self.size} chars)"
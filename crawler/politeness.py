@@ -0,0 +1,251 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from semscrape.redis_client import get_redis
+
+logger = get_task_logger(__name__)
+
+# responses asking us to slow down, the request is retried after a backoff
+THROTTLED_STATUS_CODES = [429, 503]
+
+
+def host_of(link):
+    """Return the lowercase host[:port] of a link."""
+    return urlsplit(link).netloc.lower()
+
+
+def parse_retry_after(value, now=None):
+    """Return the seconds to wait from a Retry-After header, seconds or HTTP date."""
+    if not value:
+        return None
+    now = now or time.time()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - now, 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostState:
+    """Token bucket, backoff and latency of one remote host.
+
+    Tokens refill at `rate` per second up to `burst`, one is spent per request.
+    Throttled responses back the host off exponentially, or for Retry-After.
+    """
+
+    FIELDS = ["tokens", "updated_at", "backoff_until", "failures", "latency"]
+
+    def __init__(self, host, tokens=None, updated_at=None, **fields):
+        self.host = host
+        self.rate = settings.CRAWLER_HOST_RATE
+        self.burst = settings.CRAWLER_HOST_BURST
+        self.tokens = self.burst if tokens is None else tokens
+        self.updated_at = updated_at or time.time()
+        self.backoff_until = fields.get("backoff_until", 0.0)
+        self.failures = fields.get("failures", 0)
+        self.latency = fields.get("latency")  # exponentially weighted, seconds
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def refill(self, now):
+        if now <= self.updated_at:
+            # nothing accrues during a backoff
+            return
+        elapsed = now - self.updated_at
+        self.tokens = min(self.tokens + elapsed * self.rate, self.burst)
+        self.updated_at = now
+
+    def available_at(self, now, requests=1):
+        """Return when `requests` more requests may be sent to the host."""
+        self.refill(now)
+        deficit = requests - self.tokens
+        ready_at = now + max(deficit, 0.0) / self.rate
+        return max(ready_at, self.backoff_until)
+
+    def record(self, status_code, latency=None, retry_after=None, now=None):
+        """Update the host from a response, `status_code` is None on errors."""
+        now = now or time.time()
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                alpha = settings.CRAWLER_LATENCY_ALPHA
+                self.latency = alpha * latency + (1 - alpha) * self.latency
+
+        if status_code is None or status_code in THROTTLED_STATUS_CODES:
+            # requests in flight when the host backed off fail together, count once
+            if now >= self.backoff_until:
+                self.failures += 1
+            backoff = min(
+                settings.CRAWLER_BACKOFF_BASE * 2 ** (self.failures - 1),
+                settings.CRAWLER_BACKOFF_MAX,
+            )
+            if retry_after is not None:
+                backoff = min(max(backoff, retry_after), settings.CRAWLER_BACKOFF_MAX)
+            self.backoff_until = max(self.backoff_until, now + backoff)
+            # don't burst into the host again once the backoff is over
+            self.tokens = 0.0
+            self.updated_at = max(now, self.backoff_until)
+        else:
+            self.failures = 0
+
+
+class HostScheduler:
+    """Politeness scheduler for the links of a crawl batch.
+
+    Host states are shared between workers through redis, each change is an
+    atomic read-modify-write of the host's stored state. `plan` orders the links
+    so throttled and slow hosts don't hold up fast ones, reserves the tokens of
+    the links to fetch and defers the links a host could not serve within
+    CRAWLER_HOST_MAX_WAIT.
+    """
+
+    def __init__(self, states=None):
+        self.states = states or {}
+        self.ready_at = {}  # {link: when its reserved token is available}
+        self.deferred = {}  # {link: retry_at} of links deferred while fetching
+        self.responses = defaultdict(list)  # recorded per host, stored by save
+
+    @staticmethod
+    def redis_key(host):
+        return f"crawler:host:{host}"
+
+    @classmethod
+    def load(cls, hosts):
+        """Return a scheduler with the stored states of the hosts."""
+        hosts = list(set(hosts))
+        states = {host: HostState(host) for host in hosts}
+        if not hosts:
+            return cls(states)
+        try:
+            values = get_redis().mget([cls.redis_key(host) for host in hosts])
+        except Exception as e:
+            logger.warn(f"Host states unavailable: {e}")
+            values = [None] * len(hosts)
+        for host, value in zip(hosts, values):
+            if value is not None:
+                states[host] = HostState(host, **json.loads(value))
+        return cls(states)
+
+    def update(self, host, apply):
+        """Atomically apply `apply(state)` to the stored host state, return its result.
+
+        The state is read and written back in a WATCH/MULTI transaction, retried
+        when another worker changes it in between. Without redis, only the local
+        state is changed.
+        """
+        key = self.redis_key(host)
+
+        def transact(pipe):
+            value = pipe.get(key)
+            if value is not None:
+                state = HostState(host, **json.loads(value))
+            else:
+                state = HostState(host, **self.state(host).to_dict())
+            result = apply(state)
+            pipe.multi()
+            pipe.setex(
+                key, settings.CRAWLER_HOST_STATE_TTL, json.dumps(state.to_dict())
+            )
+            return result, state
+
+        try:
+            result, self.states[host] = get_redis().transaction(
+                transact, key, value_from_callable=True
+            )
+        except Exception as e:
+            logger.warn(f"Host states unavailable: {e}")
+            result = apply(self.state(host))
+        return result
+
+    def save(self):
+        """Add the responses recorded by this batch to the stored host states."""
+        for host, responses in self.responses.items():
+
+            def replay(state, responses=responses):
+                for status_code, latency, retry_after, now in responses:
+                    state.record(status_code, latency, retry_after, now)
+
+            self.update(host, replay)
+        self.responses.clear()
+
+    def state(self, host):
+        if host not in self.states:
+            self.states[host] = HostState(host)
+        return self.states[host]
+
+    def plan(self, links, now=None):
+        """Split the links into fetch order and {link: retry_at} deferrals.
+
+        The tokens of the links to fetch are reserved in the shared host states.
+        Hosts are interleaved round-robin, fastest hosts first, so a single host
+        never occupies the front of the queue.
+        """
+        now = now or time.time()
+        horizon = now + settings.CRAWLER_HOST_MAX_WAIT
+        by_host = OrderedDict()
+        for link in links:
+            by_host.setdefault(host_of(link), []).append(link)
+
+        def reserve(state, host_links):
+            # when each link can be sent, the tokens of those within the horizon
+            # are spent so that other workers' batches are planned after them
+            ready_at = [
+                state.available_at(now, idx) for idx in range(1, len(host_links) + 1)
+            ]
+            servable = sum(1 for ready in ready_at if ready <= horizon)
+            state.tokens -= servable
+            return ready_at, servable
+
+        deferred = {}
+        queues = []
+        for host, host_links in by_host.items():
+            ready_at, servable = self.update(
+                host, lambda state, host_links=host_links: reserve(state, host_links)
+            )
+            self.ready_at.update(zip(host_links[:servable], ready_at[:servable]))
+            deferred.update(zip(host_links[servable:], ready_at[servable:]))
+            if servable:
+                latency = self.state(host).latency or 0.0
+                queues.append((latency, host, host_links[:servable]))
+
+        queues.sort(key=lambda queue: queue[0])
+        ordered = []
+        for idx in range(max([len(q[2]) for q in queues], default=0)):
+            ordered.extend(q[2][idx] for q in queues if idx < len(q[2]))
+        return ordered, deferred
+
+    async def acquire(self, link):
+        """Wait for the link's reserved token, return False if it is deferred.
+
+        Links whose host backed off beyond CRAWLER_HOST_MAX_WAIT are not waited
+        on, they are added to `deferred` with the time to retry them.
+        """
+        state = self.state(host_of(link))
+        now = time.time()
+        ready = max(self.ready_at.get(link, now), state.backoff_until)
+        if ready - now > settings.CRAWLER_HOST_MAX_WAIT:
+            self.deferred[link] = ready
+            return False
+        if ready > now:
+            await asyncio.sleep(ready - now)
+        return True
+
+    def record(self, link, status_code, headers=None, latency=None):
+        """Record a response, or an error when `status_code` is None."""
+        headers = {k.lower(): v for (k, v) in (headers or {}).items()}
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        now = time.time()
+        host = host_of(link)
+        self.state(host).record(status_code, latency, retry_after, now)
+        self.responses[host].append((status_code, latency, retry_after, now))
@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # optional, only required for the zstd codec
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def content_key(text):
+    """Return the content address (sha256 hex digest) of the text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# content address of the empty string, ie. requests with non-textual responses
+EMPTY_CONTENT_KEY = content_key("")
+
+
+def compress(text, codec=None):
+    """Compress the text into a blob using the configured codec."""
+    codec = codec or settings.RAW_CONTENT_CODEC
+    data = text.encode("utf-8")
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImproperlyConfigured("RAW_CONTENT_CODEC zstd requires zstandard")
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    raise ImproperlyConfigured(f"Unknown RAW_CONTENT_CODEC `{codec}`")
+
+
+def decompress(blob):
+    """Decompress a blob to text, the codec is detected from the magic number."""
+    blob = bytes(blob)
+    if blob.startswith(GZIP_MAGIC):
+        data = gzip.decompress(blob)
+    elif blob.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImproperlyConfigured("Reading zstd raw content requires zstandard")
+        data = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raise ValueError("Unrecognized raw content blob")
+    return data.decode("utf-8")
+
+
+class DatabaseContentStore:
+    """Compressed raw content blobs in the RawContent side table."""
+
+    def __init__(self, model=None):
+        if model is None:
+            from crawler.models import RawContent as model
+        self.model = model
+
+    def get(self, key):
+        return decompress(self.model.objects.get(pk=key).data)
+
+    def put_many(self, contents):
+        """Store a {key: text} dictionary of contents."""
+        self.model.objects.bulk_create(
+            [
+                self.model(key=key, data=compress(text), size=len(text))
+                for (key, text) in contents.items()
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class FileContentStore:
+    """Compressed raw content blobs as content addressed files on local disk."""
+
+    def __init__(self, root=None):
+        self.root = root or settings.RAW_CONTENT_ROOT
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def get(self, key):
+        with open(self.path(key), "rb") as f:
+            return decompress(f.read())
+
+    def put_many(self, contents):
+        """Store a {key: text} dictionary of contents."""
+        for key, text in contents.items():
+            path = self.path(key)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compress(text))
+            os.replace(tmp_path, path)
+
+
+def get_content_store(model=None):
+    """Return the raw content store configured by RAW_CONTENT_STORE."""
+    if settings.RAW_CONTENT_STORE == "database":
+        return DatabaseContentStore(model=model)
+    if settings.RAW_CONTENT_STORE == "file":
+        return FileContentStore()
+    raise ImproperlyConfigured(
+        f"Unknown RAW_CONTENT_STORE `{settings.RAW_CONTENT_STORE}`"
+    )
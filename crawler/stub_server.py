@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from aiohttp import web
+
+
+class StubServer:
+    """In-process HTTP server standing in for remote hosts in tests/benchmarks.
+
+    Routes map a path to a dictionary with an optional `body`, `status`,
+    `headers` and `delay` (seconds to wait before responding). Requests with an
+    `If-None-Match` equal to the route's `ETag` header get a 304 Not Modified.
+    """
+
+    def __init__(self, routes=None, host="127.0.0.1", port=0):
+        self.routes = routes or {}
+        self.host = host
+        self.port = port
+        self.requests = []
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def url(self, path):
+        return f"http://{self.host}:{self.port}{path}"
+
+    async def _handle(self, request):
+        self.requests.append(request.path)
+        route = self.routes.get(request.path)
+        if route is None:
+            return web.Response(status=404, text="Not Found")
+        if route.get("delay"):
+            await asyncio.sleep(route["delay"])
+        headers = {"Content-Type": "text/html;charset=UTF-8"}
+        headers.update(route.get("headers", {}))
+        etag = headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            status=route.get("status", 200),
+            headers=headers,
+            body=route.get("body", "").encode("utf-8"),
+        )
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_route("GET", "/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,61 @@
+import os
+import random
+import re
+from xml.sax.saxutils import escape
+
+import feedparser
+from analyzer.extraction import extract_article
+from django.conf import settings
+
+TEST_DATA_DIR = os.path.join(settings.BASE_DIR, "test_data")
+ARTICLE_RE = re.compile(r"<article\b.*?</article>", re.DOTALL)
+# text between tags, and the words in it that may be swapped
+TEXT_RE = re.compile(r">([^<]+)<")
+WORD_RE = re.compile(r"(?<![&#\w])[A-Za-z]{3,}\b")
+
+
+def synthetic_pages(count, seed=0, mutation=0.3):
+    """Return `count` article pages derived from test_data/sample_money.html.
+
+    A `mutation` fraction of the article's words are swapped for other words of
+    the article, seeded per page, so pages are distinct to the dedup and MinHash
+    stages while their length and markup stay those of a real article.
+    """
+    with open(os.path.join(TEST_DATA_DIR, "sample_money.html")) as f:
+        html = f.read()
+    vocabulary = sorted(set(WORD_RE.findall(extract_article(html)["body"])))
+
+    pages = []
+    for idx in range(count):
+        rng = random.Random(f"{seed}:{idx}")
+
+        def mutate_word(match):
+            return rng.choice(vocabulary) if rng.random() < mutation else match[0]
+
+        def mutate_text(match):
+            return f">{WORD_RE.sub(mutate_word, match[1])}<"
+
+        pages.append(ARTICLE_RE.sub(lambda a: TEXT_RE.sub(mutate_text, a[0]), html))
+    return pages
+
+
+def synthetic_feed(title, links, seed=0):
+    """Return RSS XML with an item per link, titled after test_data/rss_feed.xml."""
+    template = feedparser.parse(os.path.join(TEST_DATA_DIR, "rss_feed.xml"))
+    rng = random.Random(seed)
+    items = []
+    for idx, link in enumerate(links):
+        entry = rng.choice(template["entries"])
+        items.append(
+            "<item>"
+            f"<title>{escape(entry['title'])} ({idx})</title>"
+            f"<link>{escape(link)}</link>"
+            f"<description>{escape(entry['summary'])}</description>"
+            f"<pubDate>{entry['published']}</pubDate>"
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<rss version="2.0"><channel><title>{escape(title)}</title>'
+        f"{''.join(items)}</channel></rss>"
+    )
@@ -1,18 +1,50 @@
-from datetime import datetime
-from time import mktime
+from datetime import datetime, timedelta
+from time import mktime, time
 
 import feedparser
 import requests
-from analyzer.tasks import parse_html_entry
+from analyzer.tasks import parse_html_entry, process_fetched_entries
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from django.utils.timezone import make_aware
+from semscrape import metrics
 
+from crawler.dedup import canonicalize_url, mark_duplicates
+from crawler.fanout import (
+    acquire_slot,
+    add_cycle_tasks,
+    dispatch_in_flight,
+    finish_cycle_task,
+    plan_chunks,
+    release_slot,
+    start_cycle,
+)
+from crawler.fetcher import DEFERRED, fetch_links
 from crawler.models import RSSEntry, RSSFeed
+from crawler.politeness import THROTTLED_STATUS_CODES, HostScheduler, host_of
 
 logger = get_task_logger(__name__)
 
+# RSSEntry fields sourced from the RSS feed, rather than the article request
+ENTRY_FEED_FIELDS = ["feed", "title", "description", "pub_date"]
+# RSSEntry fields sourced from the article request response
+ENTRY_REQUEST_FIELDS = [
+    "raw_html_key",
+    "resolved_url",
+    "status_code",
+    "requested_at",
+    "headers",
+    "content_type",
+    "is_html",
+    "canonical_url",
+    "canonical_entry",
+]
+
 
 def request_article(rss_entry, session=requests.Session(), timeout=8.0):
     """Perform the GET request and persist the HTML and meta in the database."""
@@ -40,32 +72,135 @@ def request_article(rss_entry, session=requests.Session(), timeout=8.0):
         logger.warn(f"Unsupported Content-Type `{content_type}` from `{rss_entry}`")
         raw_html = ""
 
-    rss_entry, _ = RSSEntry.objects.update_or_create(
-        pk=rss_entry.pk,
-        defaults={
-            "raw_html": raw_html,
-            "resolved_url": resp.url,
-            "status_code": resp.status_code,
-            "requested_at": make_aware(datetime.now()),
-            "headers": dict(resp.headers),
-        },
-    )
+    rss_entry.raw_html = raw_html
+    rss_entry.resolved_url = resp.url
+    rss_entry.status_code = resp.status_code
+    rss_entry.requested_at = make_aware(datetime.now())
+    rss_entry.set_headers(dict(resp.headers))
+    rss_entry.canonical_url = canonicalize_url(resp.url)
+    rss_entry.set_stage(fetched_stage(rss_entry))
+    mark_duplicates([rss_entry])
+    rss_entry.save(update_fields=ENTRY_REQUEST_FIELDS + RSSEntry.STAGE_FIELDS)
     return rss_entry
 
 
-@shared_task
-def retrieve_feed_entries(rss_feed_id):
-    """Given an RSSFeed, iterate through all RSSEntries and download the HTML."""
-    try:
-        rss_feed = RSSFeed.objects.get(pk=rss_feed_id)
-        data = feedparser.parse(rss_feed.url)
-    except Exception as e:
-        logger.warn(f"Failed to parse feed `{rss_feed}`: `{e}`")
-        data = {}
+def fetched_stage(rss_entry):
+    """Return the pipeline stage of a downloaded RSSEntry"""
+    if rss_entry.has_raw_html and rss_entry.is_html:
+        return RSSEntry.Stage.FETCHED
+    return RSSEntry.Stage.SKIPPED
 
-    session = requests.Session()
 
-    # Parse all of the RSS entries and create model instances
+def conditional_headers(headers):
+    """Return the conditional request headers for previous response headers."""
+    headers = {k.lower(): v for (k, v) in headers.items()}
+    request_headers = {}
+    if headers.get("etag"):
+        request_headers["If-None-Match"] = headers["etag"]
+    if headers.get("last-modified"):
+        request_headers["If-Modified-Since"] = headers["last-modified"]
+    return request_headers
+
+
+def request_articles(rss_entries, **kwargs):
+    """Concurrently GET all of the RSSEntries and persist the HTML and meta in bulk.
+
+    Entries with previous response validators are requested conditionally. Hosts
+    are rate limited by a HostScheduler, entries of throttled hosts are deferred.
+    Returns the RSSEntries that were modified, see `fetch_links` for kwargs.
+    """
+    rss_entries = {rss_entry.pk: rss_entry for rss_entry in rss_entries}
+    request_headers = {
+        link: conditional_headers(rss_entry.headers)
+        for (link, rss_entry) in rss_entries.items()
+    }
+    requested_at = make_aware(datetime.now())
+    scheduler = HostScheduler.load(host_of(link) for link in rss_entries.keys())
+    links, deferred = scheduler.plan(rss_entries.keys())
+
+    fetched_entries = []
+    failed = {}
+    for result in fetch_links(
+        links, request_headers=request_headers, scheduler=scheduler, **kwargs
+    ):
+        if result.error == DEFERRED:
+            # the host backed off during the batch, not requested
+            deferred[result.link] = scheduler.deferred[result.link]
+            continue
+        record_fetch_metrics(result)
+        if result.error is not None:
+            # request response not instantiated, retry once the host's backoff is over
+            backoff_until = scheduler.state(host_of(result.link)).backoff_until
+            failed[result.link] = max(backoff_until, time())
+            continue
+        if result.status_code in THROTTLED_STATUS_CODES:
+            # retry once the host's backoff is over
+            deferred[result.link] = scheduler.state(host_of(result.link)).backoff_until
+            continue
+        rss_entry = rss_entries[result.link]
+        if result.status_code != 304:
+            # when not modified, what we have stored is up to date
+            rss_entry.raw_html = result.text
+            rss_entry.resolved_url = result.url
+            rss_entry.status_code = result.status_code
+            rss_entry.requested_at = requested_at
+            rss_entry.set_headers(result.headers)
+            rss_entry.canonical_url = canonicalize_url(result.url)
+        rss_entry.set_stage(fetched_stage(rss_entry))
+        fetched_entries.append(rss_entry)
+    # duplicates of already fetched entries skip parsing and inference
+    mark_duplicates(fetched_entries)
+
+    with metrics.timer("pipeline_db_write_seconds", stage="fetch"):
+        RSSEntry.store_raw_html(fetched_entries)
+        RSSEntry.objects.bulk_update(
+            fetched_entries,
+            ENTRY_REQUEST_FIELDS + RSSEntry.STAGE_FIELDS,
+            batch_size=settings.CRAWLER_BATCH_SIZE,
+        )
+    scheduler.save()
+    defer_entries([rss_entries[link] for link in deferred], deferred)
+    defer_entries([rss_entries[link] for link in failed], failed, failed=True)
+    return fetched_entries
+
+
+def record_fetch_metrics(result):
+    """Count the response status and bytes, and observe the latency, per host."""
+    host = host_of(result.link)
+    status = result.status_code or ("timeout" if result.error == "timeout" else "error")
+    metrics.incr("crawler_fetch_responses_total", host=host, status=status)
+    if result.text:
+        body_bytes = len(result.text.encode("utf-8"))
+        metrics.incr("crawler_fetch_bytes_total", body_bytes, host=host)
+    if result.latency is not None:
+        metrics.observe("crawler_fetch_latency_seconds", result.latency, host=host)
+
+
+def defer_entries(rss_entries, retry_at, failed=False):
+    """Hold the claim on RSSEntries until their {link: retry_at} timestamp.
+
+    Deferring is not a failed attempt, so the attempt of the claim is given back,
+    unless the request `failed`.
+    """
+    if not rss_entries:
+        return
+    for rss_entry in rss_entries:
+        rss_entry.claimed_until = datetime.fromtimestamp(
+            retry_at[rss_entry.link], tz=timezone.utc
+        )
+    RSSEntry.objects.bulk_update(
+        rss_entries, ["claimed_until"], batch_size=settings.CRAWLER_BATCH_SIZE
+    )
+    if failed:
+        return
+    RSSEntry.objects.filter(pk__in=[e.pk for e in rss_entries]).update(
+        attempts=Greatest(F("attempts") - 1, 0)
+    )
+
+
+def parse_feed_entries(rss_feed, data):
+    """Convert the parsed RSS data into RSSEntry field dictionaries, keyed by link."""
+    entries = {}
     for entry in data.get("entries", []):
         if any(req_key not in entry for req_key in ["link", "title"]):
             logger.warn(f"Entry missing 'link' or 'title' `{entry}` from `{rss_feed}`")
@@ -81,44 +216,210 @@ def retrieve_feed_entries(rss_feed_id):
         if not description and "summary" in entry:
             description = entry["summary"]
 
-        rss_entry, _created = RSSEntry.objects.update_or_create(
-            link=entry["link"],
-            defaults={
-                "feed": rss_feed,
-                "title": entry["title"],
-                "description": description,
-                "pub_date": pub_date,
-            },
+        entries[entry["link"]] = {
+            "feed_id": rss_feed.pk,
+            "title": entry["title"],
+            "description": description,
+            "pub_date": pub_date,
+        }
+    return entries
+
+
+def upsert_feed_entries(entries, batch_size=None):
+    """Bulk create or update RSSEntries from `parse_feed_entries` output.
+
+    Existing links are diffed in one query, new rows are inserted and changed rows
+    are updated in batches, rather than a round-trip per entry. Returns the
+    RSSEntries and, of those, the ones inserted by this call.
+    """
+    batch_size = batch_size or settings.CRAWLER_BATCH_SIZE
+    existing = RSSEntry.objects.filter(link__in=entries.keys())
+    existing = {rss_entry.link: rss_entry for rss_entry in existing}
+
+    created_entries = []
+    changed_entries = []
+    for link, fields in entries.items():
+        rss_entry = existing.get(link)
+        if rss_entry is None:
+            created_entries.append(RSSEntry(link=link, **fields))
+        elif any(getattr(rss_entry, k) != v for (k, v) in fields.items()):
+            for k, v in fields.items():
+                setattr(rss_entry, k, v)
+            changed_entries.append(rss_entry)
+
+    RSSEntry.objects.bulk_update(
+        changed_entries, ENTRY_FEED_FIELDS, batch_size=batch_size
+    )
+    # ignore_conflicts handles links concurrently created by another feed's task
+    RSSEntry.objects.bulk_create(
+        created_entries, batch_size=batch_size, ignore_conflicts=True
+    )
+    rss_entries = list(existing.values()) + created_entries
+    if created_entries:
+        # the rows dropped as conflicts belong to the other feed, not created here
+        inserted = set(
+            RSSEntry.objects.filter(
+                link__in=[rss_entry.link for rss_entry in created_entries],
+                feed__in={rss_entry.feed_id for rss_entry in created_entries},
+            ).values_list("link", flat=True)
         )
-        if not rss_entry.raw_html:
-            rss_entry = request_article(rss_entry, session=session)
+        created_entries = [e for e in created_entries if e.link in inserted]
+    return rss_entries, created_entries
+
 
-        if not hasattr(rss_entry, "article"):
-            if "html" in rss_entry.headers.get("Content-Type"):
-                parse_html_entry.delay(rss_entry.pk)
+@shared_task
+def retrieve_feed_entries(rss_feed_id, cycle_id=None):
+    """Given an RSSFeed, iterate through all RSSEntries and download the HTML."""
+    try:
+        crawl_feed(rss_feed_id, cycle_id)
+    finally:
+        finish_cycle_task(cycle_id)
+
+
+def crawl_feed(rss_feed_id, cycle_id=None):
+    """Upsert the RSSFeed's entries and fan out the download of the new ones."""
+    try:
+        rss_feed = RSSFeed.objects.get(pk=rss_feed_id)
+        data = feedparser.parse(
+            rss_feed.url,
+            etag=rss_feed.etag or None,
+            modified=rss_feed.last_modified or None,
+        )
+    except Exception as e:
+        logger.warn(f"Failed to parse feed `{rss_feed_id}`: `{e}`")
+        return
+
+    if not data.get("entries") and (data.get("bozo") or "status" not in data):
+        # the feed could not be retrieved, or is not a feed, keep its validators
+        # and entry rate and poll it again, backing off while it keeps failing
+        logger.warn(
+            f"Failed to retrieve feed `{rss_feed_id}`: `{data.get('bozo_exception')}`"
+        )
+        rss_feed.schedule_retry()
+        rss_feed.save(update_fields=["next_poll_at", "poll_failures"])
+        return
+
+    if data.get("status") == 304:
+        # feed not modified since the last request, nothing to do
+        rss_feed.schedule_next_poll(0)
+        rss_feed.save(update_fields=RSSFeed.SCHEDULE_FIELDS)
+        return
+
+    # Parse all of the RSS entries and create model instances
+    rss_entries, created_entries = upsert_feed_entries(
+        parse_feed_entries(rss_feed, data)
+    )
+    rss_feed.etag = data.get("etag", "")
+    rss_feed.last_modified = data.get("modified", "")
+    rss_feed.schedule_next_poll(len(created_entries))
+    rss_feed.save(update_fields=["etag", "last_modified"] + RSSFeed.SCHEDULE_FIELDS)
+    feed_entries = RSSEntry.objects.filter(pk__in=[e.pk for e in rss_entries])
+
+    # Download all of the missing HTML concurrently
+    claimed = set(feed_entries.claim(RSSEntry.Stage.NEW, len(rss_entries)))
+    fetched_entries = fan_out_fetches(
+        [rss_entry for rss_entry in rss_entries if rss_entry.pk in claimed], cycle_id
+    )
+
+    # Parse the entries fetched here, fetch_entries tasks parse their own
+    parse_fetched_entries(fetched_entries)
+
+
+def fan_out_fetches(rss_entries, cycle_id=None):
+    """Download claimed RSSEntries in fetch_entries tasks, sized by host latency.
+
+    Chunks beyond the fetch stage's in-flight cap are downloaded by the calling
+    task, so a large feed spreads over the free workers and never waits on them.
+    Returns the RSSEntries fetched by the calling task.
+    """
+    rss_entries = {rss_entry.pk: rss_entry for rss_entry in rss_entries}
+    scheduler = HostScheduler.load(host_of(link) for link in rss_entries.keys())
+    inline = []
+    for chunk in plan_chunks(rss_entries.keys(), scheduler):
+        slot = acquire_slot("fetch")
+        if slot is None:
+            inline.extend(rss_entries[link] for link in chunk)
+            continue
+        add_cycle_tasks(cycle_id, 1)
+        fetch_entries.delay(chunk, cycle_id, slot)
+    if not inline:
+        return []
+    return request_articles(inline)
 
 
 @shared_task
-def dispatch_crawl_entries():
-    """Iterate through valid RSSEntries that don't have html and retry query"""
-    missed_entries = RSSEntry.objects.filter(
-        Q(raw_html__isnull=True)  # raw_html is null AND
-        & (
-            # Content-Type header is null OR
-            Q(**{"headers__Content-Type__isnull": True})
-            |
-            # Content-Type header is textual
-            Q(**{"headers__Content-Type__icontains": "text/html"})
+def fetch_entries(rss_entry_ids, cycle_id=None, slot=None):
+    """Download a fanned out chunk of claimed RSSEntries and parse the fetched."""
+    try:
+        fetched_entries = request_articles(
+            RSSEntry.objects.filter(pk__in=rss_entry_ids)
         )
+        parse_fetched_entries(fetched_entries)
+    finally:
+        release_slot("fetch", slot)
+        finish_cycle_task(cycle_id)
+
+
+def parse_fetched_entries(rss_entries):
+    """Claim the fetched RSSEntries and parse them, in process when PIPELINE_FUSED.
+
+    Fused, the RSSEntry instances are parsed and scored from their in-memory HTML,
+    otherwise a parse_html_entry task is dispatched per entry, within the parse
+    stage's PIPELINE_MAX_IN_FLIGHT.
+    """
+    rss_entries = {rss_entry.pk: rss_entry for rss_entry in rss_entries}
+    if not rss_entries:
+        return
+    claimed = RSSEntry.objects.filter(pk__in=rss_entries.keys()).claim(
+        RSSEntry.Stage.FETCHED, len(rss_entries)
     )
+    if settings.PIPELINE_FUSED:
+        process_fetched_entries([rss_entries[pk] for pk in claimed])
+        return
+    left = dispatch_in_flight("parse", parse_html_entry, [(pk,) for pk in claimed])
+    # the parse stage is full, the rest is left to dispatch_parse_html_entries
+    RSSEntry.objects.filter(pk__in=[pk for (pk,) in left]).release()
 
-    session = requests.Session()
-    for rss_entry in missed_entries.iterator():
-        request_article(rss_entry, session=session)
+
+@shared_task
+def dispatch_crawl_entries():
+    """Claim RSSEntries that don't have html yet and download them"""
+    for claimed in RSSEntry.objects.claim_batches(
+        RSSEntry.Stage.NEW, settings.CRAWLER_BATCH_SIZE
+    ):
+        fetched_entries = request_articles(RSSEntry.objects.filter(pk__in=claimed))
+        if settings.PIPELINE_FUSED:
+            parse_fetched_entries(fetched_entries)
+
+
+def crawl_feeds(rss_feed_ids):
+    """Dispatch a task per RSSFeed, as one crawl cycle."""
+    if not rss_feed_ids:
+        return
+    # the cycle completes once every feed and fetch task it fanned out to is done
+    cycle_id = start_cycle(len(rss_feed_ids))
+    for rss_feed_id in rss_feed_ids:
+        retrieve_feed_entries.delay(rss_feed_id, cycle_id)
 
 
 @shared_task
 def dispatch_crawl_feeds():
     """Iterate through all of the RSSFeeds and dispatch a task for each one."""
-    for rss_feed in RSSFeed.objects.all().iterator():
-        retrieve_feed_entries.delay(rss_feed.pk)
+    crawl_feeds(list(RSSFeed.objects.values_list("pk", flat=True)))
+
+
+@shared_task
+def dispatch_due_feeds():
+    """Dispatch a task for each RSSFeed due to be polled, see schedule_next_poll."""
+    now = timezone.now()
+    with transaction.atomic():
+        rss_feeds = list(
+            RSSFeed.objects.filter(
+                Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=now)
+            ).select_for_update(skip_locked=True)
+        )
+        # not due again while the task is queued, the task schedules the next poll
+        for rss_feed in rss_feeds:
+            rss_feed.next_poll_at = now + timedelta(seconds=rss_feed.poll_interval)
+        RSSFeed.objects.bulk_update(rss_feeds, ["next_poll_at"])
+    crawl_feeds([rss_feed.pk for rss_feed in rss_feeds])
@@ -0,0 +1,120 @@
+import os
+from unittest.mock import patch
+
+from analyzer.models import Article
+from analyzer.tasks import parse_html_entry
+from django.test import SimpleTestCase, TestCase
+from semscrape import metrics
+
+import crawler.models as models
+import crawler.tasks as tasks
+from crawler.dedup import body_hash, canonicalize_url, dedup_stats
+from crawler.stub_server import StubServer
+
+
+class CanonicalizeTestCase(SimpleTestCase):
+    def test_canonicalize_url(self):
+        """Tracking params, fragments and trailing slashes are not part of the URL"""
+        self.assertEqual(
+            canonicalize_url(
+                "HTTPS://Money.CNN.com/2018/story/?utm_source=rss&b=2#top"
+            ),
+            "https://money.cnn.com/2018/story?b=2",
+        )
+        self.assertEqual(canonicalize_url(None), "")
+
+    def test_body_hash(self):
+        """Body hashes ignore whitespace and case differences"""
+        self.assertEqual(body_hash("A  good\nday."), body_hash("a good day. "))
+        self.assertNotEqual(body_hash("A good day."), body_hash("A bad day."))
+
+
+@patch("crawler.politeness.get_redis")
+class DeduplicationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        crawler_dir = os.path.dirname(os.path.realpath(__file__))
+        sample_money_fp = os.path.join(
+            crawler_dir, "..", "test_data", "sample_money.html"
+        )
+        with open(sample_money_fp) as f:
+            cls.sample_money = f.read()
+
+        cls.rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Stub Server", url="stub.xml"
+        )
+
+    def request(self, server, paths):
+        rss_entries = [
+            models.RSSEntry.objects.create(
+                feed=self.rss_feed, link=server.url(path), title=path
+            )
+            for path in paths
+        ]
+        tasks.request_articles(rss_entries)
+        return [models.RSSEntry.objects.get(pk=e.pk) for e in rss_entries]
+
+    def test_fetch_duplicates(self, _patched_redis):
+        """Links resolving to the same URL or HTML share the first entry"""
+        metrics._pending.clear()
+        routes = {
+            "/story": {"body": self.sample_money},
+            "/copy": {"body": self.sample_money},
+            "/other": {"body": f"{self.sample_money}<!-- other -->"},
+        }
+        with StubServer(routes) as server:
+            first, *duplicates = self.request(
+                server, ["/story?utm_source=top", "/story?utm_source=all", "/copy"]
+            )
+            (other,) = self.request(server, ["/other"])
+
+        self.assertEqual(first.stage, models.RSSEntry.Stage.FETCHED)
+        self.assertIsNone(first.canonical_entry)
+        for duplicate in duplicates:
+            self.assertEqual(duplicate.stage, models.RSSEntry.Stage.SKIPPED)
+            self.assertEqual(duplicate.canonical_entry, first)
+        self.assertEqual(other.stage, models.RSSEntry.Stage.FETCHED)
+        self.assertIsNone(other.canonical_entry)
+
+        # the other page has the same article body, caught at parse time
+        with patch("analyzer.tasks.compute_sentiment.delay"):
+            parse_html_entry(first.pk)
+            parse_html_entry(other.pk)
+        other.refresh_from_db()
+        self.assertEqual(other.stage, models.RSSEntry.Stage.SKIPPED)
+        self.assertEqual(other.canonical_entry, first)
+        self.assertEqual(Article.objects.count(), 1)
+
+        stats = dedup_stats()
+        self.assertEqual(
+            (
+                stats["duplicate_entries"],
+                stats["duplicate_url"],
+                stats["duplicate_html"],
+                stats["duplicate_body"],
+            ),
+            (3, 1, 1, 1),
+        )
+        self.assertEqual(stats["parses_saved"], 2)
+        self.assertEqual(stats["inferences_saved"], 3)
+        self.assertEqual(
+            {k: v for (k, v) in metrics._pending.items() if "duplicate" in k},
+            {
+                f'pipeline_duplicate_entries_total{{duplicate_of="{kind}"}}': 1
+                for kind in ["url", "html", "body"]
+            },
+        )
+
+    def test_error_pages_not_canonical(self, _patched_redis):
+        """Error pages do not stand in for a later good fetch of the same URL"""
+        routes = {"/story": {"body": self.sample_money, "status": 500}}
+        with StubServer(routes) as server:
+            (error,) = self.request(server, ["/story?utm_source=top"])
+            server.routes["/story"]["status"] = 200
+            (good,) = self.request(server, ["/story?utm_source=all"])
+            (duplicate,) = self.request(server, ["/story"])
+
+        self.assertIsNone(good.canonical_entry)
+        self.assertEqual(good.stage, models.RSSEntry.Stage.FETCHED)
+        self.assertEqual(duplicate.canonical_entry, good)
+        self.assertNotEqual(error.status_code, 200)
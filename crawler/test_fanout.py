@@ -0,0 +1,123 @@
+import json
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+import crawler.fanout as fanout
+import crawler.models as models
+import crawler.tasks as tasks
+from crawler.fake_redis import FakeRedis
+from crawler.politeness import HostScheduler, HostState
+
+
+@override_settings(
+    CRAWLER_CHUNK_SECONDS=20.0,
+    CRAWLER_CONCURRENCY_PER_HOST=8,
+    CRAWLER_HOST_RATE=4.0,
+    CRAWLER_DEFAULT_LATENCY=1.0,
+    PIPELINE_MAX_IN_FLIGHT={"fetch": 2},
+)
+class FanOutTestCase(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch("crawler.fanout.get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_plan_chunks(self):
+        """Chunks hold about the same seconds of work, whatever the host latency"""
+        scheduler = HostScheduler(
+            {
+                "slow.com": HostState("slow.com", latency=16.0),
+                "fast.com": HostState("fast.com", latency=0.1),
+            }
+        )
+        # 2s per slow link (16s over 8 connections), 0.25s per fast link (4/s)
+        slow = [f"http://slow.com/{idx}" for idx in range(25)]
+        chunks = fanout.plan_chunks(slow, scheduler)
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        fast = [f"http://fast.com/{idx}" for idx in range(100)]
+        chunks = fanout.plan_chunks(fast, scheduler, max_size=64)
+        self.assertEqual([len(chunk) for chunk in chunks], [64, 36])
+        # unknown hosts take the default latency, bounded by the host rate
+        new = [f"http://new.com/{idx}" for idx in range(100)]
+        self.assertEqual(len(fanout.plan_chunks(new, scheduler)[0]), 80)
+
+    def test_in_flight_slots(self):
+        """The stage's slots are capped, released and expired slots are reclaimed"""
+        first = fanout.acquire_slot("fetch")
+        second = fanout.acquire_slot("fetch")
+        self.assertIsNotNone(second)
+        self.assertIsNone(fanout.acquire_slot("fetch"))
+
+        fanout.release_slot("fetch", first)
+        self.assertIsNotNone(fanout.acquire_slot("fetch"))
+
+        # the lease of a lost task expires
+        self.redis.values[fanout.slots_key("fetch")][second] = 0
+        self.assertIsNotNone(fanout.acquire_slot("fetch"))
+        self.assertIsNone(fanout.acquire_slot("fetch"))
+
+    def test_crawl_cycle(self):
+        """The cycle completes once every task, including fanned out ones, is done"""
+        cycle_id = fanout.start_cycle(2)
+        fanout.add_cycle_tasks(cycle_id, 1)
+        fanout.finish_cycle_task(cycle_id)
+        fanout.finish_cycle_task(cycle_id)
+        self.assertIsNone(self.redis.get(fanout.LAST_CYCLE_KEY))
+
+        fanout.finish_cycle_task(cycle_id)
+        cycle = json.loads(self.redis.get(fanout.LAST_CYCLE_KEY))
+        self.assertEqual(cycle["cycle"], cycle_id)
+        self.assertEqual(cycle["tasks"], 3)
+        self.assertGreaterEqual(cycle["seconds"], 0)
+        self.assertIsNone(self.redis.get(fanout.cycle_key(cycle_id, "pending")))
+
+
+@override_settings(
+    CRAWLER_CHUNK_SECONDS=1.0,
+    CRAWLER_DEFAULT_LATENCY=1.0,
+    CRAWLER_CONCURRENCY_PER_HOST=1,
+    PIPELINE_MAX_IN_FLIGHT={"fetch": 2},
+)
+class FanOutFetchesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        cls.rss_entries = [
+            models.RSSEntry.objects.create(
+                feed=rss_feed, link=f"http://example.com/{idx}", title=f"{idx}"
+            )
+            for idx in range(5)
+        ]
+
+    @patch("crawler.tasks.request_articles")
+    @patch("crawler.politeness.get_redis", return_value=FakeRedis())
+    def test_fan_out_fetches(self, _patched_redis, patched_request):
+        """Chunks are dispatched up to the in-flight cap, the rest fetched inline"""
+        redis = FakeRedis()
+        with patch("crawler.fanout.get_redis", return_value=redis), patch.object(
+            tasks.fetch_entries, "delay"
+        ) as patched_delay:
+            cycle_id = fanout.start_cycle(1)
+            fetched_entries = tasks.fan_out_fetches(self.rss_entries, cycle_id)
+
+        # a link per chunk, two in flight, the other three fetched by the caller
+        dispatched = [call.args[0] for call in patched_delay.call_args_list]
+        self.assertEqual(
+            dispatched, [["http://example.com/0"], ["http://example.com/1"]]
+        )
+        (inline,) = patched_request.call_args.args
+        self.assertEqual([e.pk for e in inline], [e.pk for e in self.rss_entries[2:]])
+        self.assertIs(fetched_entries, patched_request.return_value)
+        pending = redis.get(fanout.cycle_key(cycle_id, "pending"))
+        self.assertEqual(int(pending), 3)
+
+        # fetch tasks give back their slot and count towards the cycle
+        slot = patched_delay.call_args.args[2]
+        with patch("crawler.fanout.get_redis", return_value=redis):
+            tasks.fetch_entries(dispatched[-1], cycle_id, slot)
+        self.assertEqual(redis.zcard(fanout.slots_key("fetch")), 1)
+        self.assertEqual(int(redis.get(fanout.cycle_key(cycle_id, "pending"))), 2)
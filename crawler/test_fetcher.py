@@ -0,0 +1,96 @@
+import os
+import time
+
+from django.test import SimpleTestCase, TestCase
+
+import crawler.models as models
+import crawler.tasks as tasks
+from crawler.fetcher import fetch_links
+from crawler.stub_server import StubServer
+
+
+class FetcherTestCase(SimpleTestCase):
+    def test_fetch_links_concurrently(self):
+        """Slow responses overlap, crawl time is not the sum of latencies"""
+        routes = {
+            f"/slow/{idx}": {"body": f"<p>{idx}</p>", "delay": 0.5} for idx in range(8)
+        }
+        with StubServer(routes) as server:
+            links = [server.url(path) for path in routes]
+            start = time.monotonic()
+            results = fetch_links(links, concurrency=8, per_host=8)
+            elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual([result.link for result in results], links)
+        for idx, result in enumerate(results):
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(result.text, f"<p>{idx}</p>")
+            self.assertIsNone(result.error)
+
+    def test_fetch_links_errors(self):
+        """Timeouts and non-textual responses do not raise"""
+        routes = {
+            "/timeout": {"delay": 2.0},
+            "/image": {"body": "GIF89a", "headers": {"Content-Type": "image/gif"}},
+        }
+        with StubServer(routes) as server:
+            timeout, image, missing = fetch_links(
+                [server.url("/timeout"), server.url("/image"), server.url("/404")],
+                timeout=0.5,
+            )
+
+        self.assertEqual(timeout.error, "timeout")
+        self.assertEqual((image.status_code, image.text), (200, ""))
+        self.assertEqual(missing.status_code, 404)
+
+    def test_fetch_links_conditional(self):
+        """Conditional requests receive an empty 304 when unchanged"""
+        routes = {"/etag": {"body": "<p>v1</p>", "headers": {"ETag": '"v1"'}}}
+        with StubServer(routes) as server:
+            link = server.url("/etag")
+            (result,) = fetch_links(
+                [link], request_headers={link: {"If-None-Match": '"v1"'}}
+            )
+
+        self.assertEqual((result.status_code, result.text), (304, ""))
+
+
+class RequestArticlesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        crawler_dir = os.path.dirname(os.path.realpath(__file__))
+        sample_money_fp = os.path.join(
+            crawler_dir, "..", "test_data", "sample_money.html"
+        )
+        with open(sample_money_fp) as f:
+            cls.sample_money = f.read()
+
+        cls.rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Stub Server", url="stub.xml"
+        )
+
+    def test_request_articles(self):
+        """Fetched HTML and response meta are persisted for every entry"""
+        # distinct HTML per link, identical pages are deduplicated
+        routes = {
+            f"/money/{idx}": {"body": f"{self.sample_money}<!-- {idx} -->"}
+            for idx in range(3)
+        }
+        with StubServer(routes) as server:
+            rss_entries = [
+                models.RSSEntry.objects.create(
+                    feed=self.rss_feed, link=server.url(path), title=path
+                )
+                for path in routes
+            ]
+            fetched = tasks.request_articles(rss_entries)
+
+        self.assertEqual(len(fetched), 3)
+        for rss_entry in models.RSSEntry.objects.filter(feed=self.rss_feed):
+            self.assertEqual(rss_entry.raw_html, routes[rss_entry.title]["body"])
+            self.assertEqual(rss_entry.status_code, 200)
+            self.assertIn("text/html", rss_entry.headers["Content-Type"])
+            self.assertEqual(rss_entry.content_type, "text/html")
+            self.assertTrue(rss_entry.is_html)
+            self.assertEqual(rss_entry.stage, models.RSSEntry.Stage.FETCHED)
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+import crawler.models as models
+import crawler.tasks as tasks
+from crawler.fake_redis import FakeRedis
+from crawler.politeness import HostScheduler, HostState, host_of, parse_retry_after
+from crawler.stub_server import StubServer
+
+
+@override_settings(
+    CRAWLER_HOST_RATE=1.0,
+    CRAWLER_HOST_BURST=2,
+    CRAWLER_HOST_MAX_WAIT=3.0,
+    CRAWLER_BACKOFF_BASE=2.0,
+)
+class HostSchedulerTestCase(SimpleTestCase):
+    @patch("crawler.politeness.get_redis", return_value=FakeRedis())
+    def test_token_bucket(self, _patched_redis):
+        """Planned links spend tokens, which refill at the host rate up to the burst"""
+        links = [f"http://example.com/{idx}" for idx in range(3)]
+        scheduler = HostScheduler(
+            {"example.com": HostState("example.com", updated_at=100.0)}
+        )
+        ordered, _ = scheduler.plan(links, now=100.0)
+        self.assertEqual(ordered, links)
+        # the burst is sent at once, then a request per second
+        self.assertEqual(
+            [scheduler.ready_at[link] for link in links], [100.0, 100.0, 101.0]
+        )
+
+        # the next batch is planned after the tokens reserved by the first
+        other = HostScheduler()
+        other.plan(["http://example.com/3"], now=101.0)
+        self.assertEqual(other.ready_at["http://example.com/3"], 102.0)
+        state = other.state("example.com")
+        state.refill(200.0)
+        self.assertEqual(state.tokens, 2)
+
+    def test_backoff(self):
+        """Throttled responses back off exponentially or for the Retry-After"""
+        state = HostState("example.com", updated_at=100.0)
+        state.record(429, now=100.0)
+        self.assertEqual(state.backoff_until, 102.0)
+        state.record(503, now=102.0)
+        self.assertEqual(state.backoff_until, 106.0)
+        state.record(429, retry_after=30.0, now=106.0)
+        self.assertEqual(state.backoff_until, 136.0)
+        self.assertEqual(state.available_at(120.0), 136.0)
+
+        # no burst once the backoff is over
+        self.assertAlmostEqual(state.available_at(136.0, 2), 138.0)
+        state.record(200, latency=0.5, now=137.0)
+        self.assertEqual((state.failures, state.latency), (0, 0.5))
+
+        # requests in flight when the host backed off count as one failure
+        for _ in range(8):
+            state.record(None, now=140.0)
+        self.assertEqual((state.failures, state.backoff_until), (1, 142.0))
+
+    def test_parse_retry_after(self):
+        """Retry-After is either delay seconds or an HTTP date"""
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(
+            parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412480.0),
+            30.0,
+        )
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+    @patch("crawler.politeness.get_redis", return_value=FakeRedis())
+    def test_plan(self, _patched_redis):
+        """Fast hosts go first, hosts are interleaved, throttled hosts deferred"""
+        scheduler = HostScheduler(
+            {
+                "slow.com": HostState("slow.com", updated_at=100.0, latency=2.0),
+                "fast.com": HostState("fast.com", updated_at=100.0, latency=0.1),
+                "busy.com": HostState(
+                    "busy.com", updated_at=100.0, backoff_until=200.0
+                ),
+            }
+        )
+        links = (
+            [f"http://slow.com/{idx}" for idx in range(2)]
+            + [f"http://fast.com/{idx}" for idx in range(7)]
+            + ["http://busy.com/0"]
+        )
+        ordered, deferred = scheduler.plan(links, now=100.0)
+
+        # fast.com serves its burst of 2, then 1 per second within the 3s wait
+        self.assertEqual(
+            ordered,
+            [
+                "http://fast.com/0",
+                "http://slow.com/0",
+                "http://fast.com/1",
+                "http://slow.com/1",
+                "http://fast.com/2",
+                "http://fast.com/3",
+                "http://fast.com/4",
+            ],
+        )
+        self.assertEqual(
+            deferred,
+            {
+                "http://fast.com/5": 104.0,
+                "http://fast.com/6": 105.0,
+                "http://busy.com/0": 200.0,
+            },
+        )
+
+    def test_shared_token_bucket(self):
+        """Workers planning batches of the same host share its tokens"""
+        redis = FakeRedis()
+        links = [f"http://example.com/{idx}" for idx in range(2)]
+        with patch("crawler.politeness.get_redis", return_value=redis):
+            first = HostScheduler.load(["example.com"])
+            second = HostScheduler.load(["example.com"])
+            first.plan(links, now=100.0)
+            ordered, deferred = second.plan(links, now=100.0)
+
+        # the burst of 2 was spent by the first worker, 1 token per second after
+        self.assertEqual(list(first.ready_at.values()), [100.0, 100.0])
+        self.assertEqual(second.ready_at, dict(zip(links, [101.0, 102.0])))
+        stored = json.loads(redis.get(HostScheduler.redis_key("example.com")))
+        self.assertEqual(stored["tokens"], -2)
+
+    def test_acquire_deferred(self):
+        """Links of a host that backed off beyond the max wait are not waited on"""
+        scheduler = HostScheduler({"example.com": HostState("example.com")})
+        link = "http://example.com/0"
+        self.assertTrue(asyncio.run(scheduler.acquire(link)))
+
+        scheduler.state("example.com").backoff_until = time.time() + 60
+        started = time.monotonic()
+        self.assertFalse(asyncio.run(scheduler.acquire(link)))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertGreater(scheduler.deferred[link], time.time() + 50)
+
+
+class RequestArticlesPolitenessTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Stub Server", url="stub.xml"
+        )
+
+    def test_throttled_entries_deferred(self):
+        """Throttled entries keep their claim until the host's backoff is over"""
+        routes = {
+            "/ok": {"body": "<p>ok</p>"},
+            "/throttled": {"status": 429, "headers": {"Retry-After": "120"}},
+        }
+        fake_redis = FakeRedis()
+        with StubServer(routes) as server, patch(
+            "crawler.politeness.get_redis", return_value=fake_redis
+        ):
+            for path in routes:
+                models.RSSEntry.objects.create(
+                    feed=self.rss_feed, link=server.url(path), title=path
+                )
+            claimed = models.RSSEntry.objects.claim(models.RSSEntry.Stage.NEW, 2)
+            fetched = tasks.request_articles(
+                models.RSSEntry.objects.filter(pk__in=claimed)
+            )
+
+        self.assertEqual([e.link for e in fetched], [server.url("/ok")])
+        throttled = models.RSSEntry.objects.get(link=server.url("/throttled"))
+        self.assertEqual(throttled.stage, models.RSSEntry.Stage.NEW)
+        self.assertEqual(throttled.attempts, 0)
+        self.assertGreater(
+            (throttled.claimed_until - timezone.now()).total_seconds(), 100
+        )
+
+        # the backoff is shared with other workers through redis
+        stored = json.loads(
+            fake_redis.values[HostScheduler.redis_key(host_of(server.url("/")))]
+        )
+        self.assertEqual(stored["failures"], 1)
+
+    def test_failed_entries_deferred(self):
+        """Entries whose request failed are retried after the backoff, not the lease"""
+        rss_entry = models.RSSEntry.objects.create(
+            feed=self.rss_feed, link="http://127.0.0.1:1/refused", title="refused"
+        )
+        with patch("crawler.politeness.get_redis", return_value=FakeRedis()):
+            claimed = models.RSSEntry.objects.claim(models.RSSEntry.Stage.NEW, 1)
+            self.assertEqual(claimed, [rss_entry.pk])
+            fetched = tasks.request_articles([rss_entry])
+
+        self.assertEqual(fetched, [])
+        rss_entry.refresh_from_db()
+        self.assertEqual(rss_entry.stage, models.RSSEntry.Stage.NEW)
+        # the failed attempt counts towards PIPELINE_MAX_ATTEMPTS
+        self.assertEqual(rss_entry.attempts, 1)
+        retry_in = (rss_entry.claimed_until - timezone.now()).total_seconds()
+        self.assertLess(retry_in, settings.CRAWLER_BACKOFF_BASE + 1)
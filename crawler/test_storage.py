@@ -0,0 +1,65 @@
+import tempfile
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+import crawler.models as models
+from crawler.storage import (
+    EMPTY_CONTENT_KEY,
+    compress,
+    content_key,
+    decompress,
+    get_content_store,
+)
+
+
+class ContentStoreTestCase(SimpleTestCase):
+    def test_compress_roundtrip(self):
+        """Compressed blobs decompress to the original text and are smaller"""
+        text = "<p>Stocks rallied on Wall Street.</p>" * 100
+        blob = compress(text, codec="gzip")
+        self.assertLess(len(blob), len(text) / 10)
+        self.assertEqual(decompress(blob), text)
+
+    def test_file_store(self):
+        """Content addressed files are written once and read back"""
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(RAW_CONTENT_STORE="file", RAW_CONTENT_ROOT=root):
+                store = get_content_store()
+                store.put_many({content_key("<html/>"): "<html/>"})
+                store.put_many({content_key("<html/>"): "<html/>"})
+                self.assertEqual(store.get(content_key("<html/>")), "<html/>")
+
+
+class RSSEntryRawHTMLTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Raw Content", url="stub.xml"
+        )
+
+    def test_raw_html_out_of_row(self):
+        """Raw HTML is stored compressed in the side table and loaded lazily"""
+        models.RSSEntry.objects.create(
+            feed=self.rss_feed, link="http://example.com/a", raw_html="<p>a</p>"
+        )
+        models.RSSEntry.objects.create(
+            feed=self.rss_feed, link="http://example.com/b", raw_html="<p>a</p>"
+        )
+        # identical content is only stored once
+        self.assertEqual(models.RawContent.objects.count(), 1)
+
+        rss_entry = models.RSSEntry.objects.get(pk="http://example.com/a")
+        self.assertEqual(rss_entry.raw_html_key, content_key("<p>a</p>"))
+        with self.assertNumQueries(1):
+            self.assertEqual(rss_entry.raw_html, "<p>a</p>")
+            self.assertEqual(rss_entry.raw_html, "<p>a</p>")
+
+    def test_has_raw_html(self):
+        """Empty responses are stored but do not count as downloaded HTML"""
+        rss_entry = models.RSSEntry(feed=self.rss_feed, link="http://example.com/c")
+        self.assertFalse(rss_entry.has_raw_html)
+        rss_entry.raw_html = ""
+        self.assertEqual(rss_entry.raw_html_key, EMPTY_CONTENT_KEY)
+        self.assertFalse(rss_entry.has_raw_html)
+        rss_entry.raw_html = "<html/>"
+        self.assertTrue(rss_entry.has_raw_html)
@@ -1,10 +1,20 @@
 import os
+from io import StringIO
 from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+from datetime import timedelta
+
+import feedparser
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 import crawler.models as models
 import crawler.tasks as tasks
+from crawler.fake_redis import FakeRedis
+from crawler.stub_server import StubServer
 
 
 class CrawlerTasksTestCase(TestCase):
@@ -60,13 +70,13 @@ class CrawlerTasksTestCase(TestCase):
         rss_entry = models.RSSEntry.objects.get(pk=self.entry_stub.pk)
         self.assertEquals(rss_entry.raw_html, self.sample_money)
 
-    @patch("crawler.tasks.request_article")
+    @patch("crawler.tasks.request_articles")
     def test_retrieve_feed_entries(self, _patched_request):
         """Verify behavior and robustness of parsing RSS XML"""
         tasks.retrieve_feed_entries(self.stub_rss_feed.pk)
 
-        # have all RSS entries been saved?
-        all_rss_entries = models.RSSEntry.objects.all()
+        # have all RSS entries been saved? in the order they were created
+        all_rss_entries = models.RSSEntry.objects.order_by("stage_changed_at")
         all_entry_ids = [rss.pk for rss in all_rss_entries]
         self.assertSequenceEqual(
             all_entry_ids,
@@ -98,13 +108,348 @@ class CrawlerTasksTestCase(TestCase):
         tasks.retrieve_feed_entries(self.bad_key_rss.pk)
         tasks.retrieve_feed_entries(self.illform_rss.pk)
 
+    @patch("crawler.tasks.parse_fetched_entries")
+    @patch("crawler.tasks.request_articles", side_effect=list)
+    def test_retrieve_feed_entries_parses_fetched(self, patched_request, patched_parse):
+        """Only the entries the feed task fetched itself are parsed by it"""
+        # fetched, and parsed, by a concurrent fetch task
+        models.RSSEntry.objects.filter(pk=self.entry_stub.pk).update(
+            stage=models.RSSEntry.Stage.FETCHED
+        )
+        tasks.retrieve_feed_entries(self.stub_rss_feed.pk)
+
+        (fetched_entries,) = patched_request.call_args.args
+        (parsed_entries,) = patched_parse.call_args.args
+        self.assertEqual(parsed_entries, fetched_entries)
+        self.assertNotIn(self.entry_stub.pk, [e.pk for e in parsed_entries])
+
+    def test_upsert_feed_entries_round_trips(self):
+        """Feed ingestion issues a constant number of queries, not one per entry"""
+        data = feedparser.parse(self.stub_rss_feed.url)
+        entries = tasks.parse_feed_entries(self.stub_rss_feed, data)
+        self.assertEqual(len(entries), 20)
+
+        # per entry update_or_create took 120 queries (SELECT, INSERT, SAVEPOINTs)
+        with CaptureQueriesContext(connection) as created_queries:
+            _, created_entries = tasks.upsert_feed_entries(entries)
+        self.assertEqual(len(created_entries), 19)
+        # one SELECT to diff links, one INSERT for the 19 new entries, one UPDATE
+        # for the existing stub entry now attached to the feed, one SELECT of the
+        # inserted links
+        self.assertEqual(len(created_queries), 4)
+
+        # unchanged feed, per entry update_or_create took 80 queries
+        with CaptureQueriesContext(connection) as unchanged_queries:
+            rss_entries, created_entries = tasks.upsert_feed_entries(entries)
+        self.assertEqual(len(unchanged_queries), 1)
+        self.assertCountEqual([e.pk for e in rss_entries], entries.keys())
+        self.assertEqual(created_entries, [])
+
+    def test_upsert_feed_entries_conflicts(self):
+        """Links created concurrently by another feed's task are not counted new"""
+        entries = tasks.parse_feed_entries(
+            self.stub_rss_feed, feedparser.parse(self.stub_rss_feed.url)
+        )
+        bulk_create = models.RSSEntry.objects.bulk_create
+        conflict = list(entries)[-1]
+
+        def concurrent_bulk_create(*args, **kwargs):
+            models.RSSEntry.objects.create(link=conflict, feed=self.bad_key_rss)
+            return bulk_create(*args, **kwargs)
+
+        with patch.object(
+            models.RSSEntry.objects, "bulk_create", concurrent_bulk_create
+        ):
+            rss_entries, created_entries = tasks.upsert_feed_entries(entries)
+        self.assertEqual(len(rss_entries), 20)
+        self.assertEqual(len(created_entries), 18)
+        self.assertNotIn(conflict, [e.link for e in created_entries])
+
+    @patch("crawler.tasks.request_articles")
+    def test_retrieve_feed_entries_not_modified(self, _patched_request):
+        """Unchanged feeds are requested conditionally and skip all processing"""
+        with open(self.stub_rss_feed.url) as f:
+            routes = {"/rss": {"body": f.read(), "headers": {"ETag": '"v1"'}}}
+
+        with StubServer(routes) as server:
+            rss_feed = models.RSSFeed.objects.create(
+                organization="Test Stub", title="Stub Server", url=server.url("/rss")
+            )
+            tasks.retrieve_feed_entries(rss_feed.pk)
+            rss_feed.refresh_from_db()
+            self.assertEqual(rss_feed.etag, '"v1"')
+            self.assertEqual(models.RSSEntry.objects.filter(feed=rss_feed).count(), 20)
+
+            with patch("crawler.tasks.upsert_feed_entries") as patched_upsert:
+                tasks.retrieve_feed_entries(rss_feed.pk)
+            patched_upsert.assert_not_called()
+            self.assertEqual(len(server.requests), 2)
+
+    def test_conditional_headers(self):
+        """Stored response validators become conditional request headers"""
+        self.assertEqual(
+            tasks.conditional_headers(
+                {
+                    "Etag": '"abc"',
+                    "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT",
+                    "Content-Type": "text/html",
+                }
+            ),
+            {
+                "If-None-Match": '"abc"',
+                "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT",
+            },
+        )
+        self.assertEqual(tasks.conditional_headers({}), {})
+
     def test_dispatch_crawl_feeds(self):
         """Ensure all feed entries are called."""
-        with patch.object(tasks.retrieve_feed_entries, "delay") as m:
+        redis = FakeRedis()
+        with patch.object(tasks.retrieve_feed_entries, "delay") as m, patch(
+            "crawler.fanout.get_redis", return_value=redis
+        ):
             tasks.dispatch_crawl_feeds()
 
-        # have all RSS Feeds been called?
+        # have all RSS Feeds been called? as tasks of the same crawl cycle
         all_rss_feeds = models.RSSFeed.objects.all()
         self.assertEquals(len(all_rss_feeds), m.call_count)
+        cycle_id = m.call_args.args[1]
+        self.assertIsNotNone(cycle_id)
         for rss_feed in all_rss_feeds:
-            m.assert_any_call(rss_feed.pk)
+            m.assert_any_call(rss_feed.pk, cycle_id)
+
+
+@override_settings(
+    CRAWLER_FEED_MIN_INTERVAL=60 * 5,
+    CRAWLER_FEED_MAX_INTERVAL=60 * 60 * 24,
+    CRAWLER_FEED_TARGET_ENTRIES=2.0,
+    CRAWLER_FEED_RATE_ALPHA=0.5,
+    CRAWLER_FEED_JITTER=0.0,
+)
+class FeedScheduleTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # the feeds of the data migration are not due
+        models.RSSFeed.objects.update(next_poll_at=now + timedelta(hours=1))
+        cls.rss_feeds = [
+            models.RSSFeed.objects.create(
+                organization="Test Stub", title=f"Feed {idx}", url=f"{idx}.xml"
+            )
+            for idx in range(3)
+        ]
+        cls.rss_feeds[1].next_poll_at = now - timedelta(seconds=1)
+        cls.rss_feeds[2].next_poll_at = now + timedelta(hours=1)
+        for rss_feed in cls.rss_feeds:
+            rss_feed.save()
+
+    def test_schedule_next_poll(self):
+        """Feeds are polled as often as new entries are observed, within bounds"""
+        rss_feed = models.RSSFeed.objects.get(pk=self.rss_feeds[0].pk)
+        now = timezone.now()
+        # the first poll sees all entries as new, it only sets the baseline
+        rss_feed.schedule_next_poll(20, now)
+        self.assertIsNone(rss_feed.entry_rate)
+        self.assertEqual(rss_feed.next_poll_at, now + timedelta(minutes=30))
+
+        # 4 new entries an hour, 2 are expected within 30 minutes
+        now += timedelta(hours=1)
+        rss_feed.schedule_next_poll(4, now)
+        self.assertEqual(rss_feed.poll_interval, 60 * 30)
+        self.assertEqual(rss_feed.next_poll_at, now + timedelta(minutes=30))
+
+        # the rate halves with each poll without new entries
+        now += timedelta(minutes=30)
+        rss_feed.schedule_next_poll(0, now)
+        self.assertAlmostEqual(rss_feed.poll_interval, 60 * 60)
+        for _ in range(20):
+            now += timedelta(seconds=rss_feed.poll_interval)
+            rss_feed.schedule_next_poll(0, now)
+        self.assertEqual(rss_feed.poll_interval, 60 * 60 * 24)
+
+        # a burst of entries brings it down to the minimum
+        now += timedelta(minutes=10)
+        rss_feed.schedule_next_poll(50, now)
+        self.assertEqual(rss_feed.poll_interval, 60 * 5)
+
+    @override_settings(CRAWLER_FEED_JITTER=0.1)
+    def test_schedule_jitter(self):
+        """The next polls of feeds polled together are spread out"""
+        rss_feed = models.RSSFeed.objects.get(pk=self.rss_feeds[0].pk)
+        now = timezone.now()
+        next_polls = set()
+        for _ in range(10):
+            rss_feed.schedule_next_poll(0, now)
+            delay = (rss_feed.next_poll_at - now).total_seconds()
+            self.assertTrue(60 * 27 <= delay <= 60 * 33)
+            next_polls.add(delay)
+        self.assertGreater(len(next_polls), 1)
+
+    def test_dispatch_due_feeds(self):
+        """Only feeds that are due are dispatched, and not again until their task"""
+        with patch.object(tasks.retrieve_feed_entries, "delay") as m, patch(
+            "crawler.fanout.get_redis", return_value=FakeRedis()
+        ):
+            tasks.dispatch_due_feeds()
+            dispatched = [call.args[0] for call in m.call_args_list]
+            self.assertCountEqual(dispatched, [f.pk for f in self.rss_feeds[:2]])
+
+            m.reset_mock()
+            tasks.dispatch_due_feeds()
+            m.assert_not_called()
+
+    def test_retrieve_feed_entries_schedules(self):
+        """Polling a feed schedules its next poll from the entries it added"""
+        rss_feed = self.rss_feeds[0]
+        data = {"status": 200, "entries": []}
+        with patch("crawler.tasks.feedparser.parse", return_value=data):
+            tasks.retrieve_feed_entries(rss_feed.pk)
+        rss_feed.refresh_from_db()
+        self.assertIsNotNone(rss_feed.polled_at)
+        self.assertGreater(rss_feed.next_poll_at, rss_feed.polled_at)
+
+    @override_settings(CRAWLER_FEED_MIN_INTERVAL=300, CRAWLER_FEED_JITTER=0.0)
+    def test_retrieve_feed_entries_failed(self):
+        """A failed poll keeps the validators and rate, retries back off"""
+        polled_at = timezone.now() - timedelta(hours=1)
+        models.RSSFeed.objects.filter(pk=self.rss_feeds[0].pk).update(
+            etag="etag", entry_rate=0.001, polled_at=polled_at, poll_interval=3600
+        )
+        # a network error, and a response that is not a feed
+        for data, retry_delay in [
+            ({"bozo": 1, "bozo_exception": OSError("refused"), "entries": []}, 300),
+            ({"bozo": 1, "status": 500, "entries": []}, 600),
+        ]:
+            with patch("crawler.tasks.feedparser.parse", return_value=data):
+                tasks.retrieve_feed_entries(self.rss_feeds[0].pk)
+            rss_feed = models.RSSFeed.objects.get(pk=self.rss_feeds[0].pk)
+            self.assertEqual(rss_feed.etag, "etag")
+            self.assertEqual(rss_feed.entry_rate, 0.001)
+            self.assertEqual(rss_feed.polled_at, polled_at)
+            self.assertEqual(rss_feed.poll_interval, 3600)
+            delay = (rss_feed.next_poll_at - timezone.now()).total_seconds()
+            self.assertTrue(retry_delay - 10 < delay <= retry_delay)
+
+        # a dead feed is retried at most daily, a successful poll resets the backoff
+        for _ in range(10):
+            rss_feed.schedule_retry()
+        delay = (rss_feed.next_poll_at - timezone.now()).total_seconds()
+        self.assertAlmostEqual(delay, 60 * 60 * 24, delta=10)
+        rss_feed.schedule_next_poll(0)
+        self.assertEqual(rss_feed.poll_failures, 0)
+
+
+class RSSEntryClaimTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rss_feed = models.RSSFeed.objects.create(
+            organization="Test Stub", title="Validation Feed", url="stub.xml"
+        )
+        cls.rss_entries = [
+            models.RSSEntry.objects.create(
+                feed=rss_feed, link=f"http://example.com/{idx}", title=f"{idx}"
+            )
+            for idx in range(3)
+        ]
+
+    def test_claim(self):
+        """Claimed entries are not handed out again until their lease expires"""
+        pending = models.RSSEntry.objects
+        claimed = pending.claim(models.RSSEntry.Stage.NEW, 2)
+        self.assertEqual(len(claimed), 2)
+        remaining = pending.claim(models.RSSEntry.Stage.NEW, 2)
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(set(claimed) & set(remaining), set())
+        self.assertEqual(pending.claim(models.RSSEntry.Stage.NEW, 2), [])
+
+        # an expired lease, ie. the worker died, can be claimed again
+        pending.filter(pk=claimed[0]).update(
+            claimed_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(pending.claim(models.RSSEntry.Stage.NEW, 2), [claimed[0]])
+        self.assertEqual(pending.get(pk=claimed[0]).attempts, 2)
+
+    @override_settings(PIPELINE_MAX_ATTEMPTS=1)
+    def test_claim_exhausted_attempts(self):
+        """Entries that exhausted their attempts are marked failed"""
+        pending = models.RSSEntry.objects
+        self.assertEqual(len(pending.claim(models.RSSEntry.Stage.NEW, 3)), 3)
+        pending.update(claimed_until=None)
+        self.assertEqual(pending.claim(models.RSSEntry.Stage.NEW, 3), [])
+        self.assertEqual(pending.filter(stage=models.RSSEntry.Stage.FAILED).count(), 3)
+
+    @patch("crawler.management.commands.backfill_fetch.request_articles")
+    def test_backfill_fetch(self, patched_request):
+        """Failed entries are fetched again, claimed from the dispatcher"""
+        failed = self.rss_entries[0]
+        models.RSSEntry.objects.filter(pk=failed.pk).update(
+            stage=models.RSSEntry.Stage.FAILED, attempts=5
+        )
+        # entries leased by a fetch task are left to it
+        leased = self.rss_entries[1]
+        claimed_until = timezone.now() + timedelta(seconds=60)
+        models.RSSEntry.objects.filter(pk=leased.pk).update(
+            attempts=2, claimed_until=claimed_until
+        )
+        patched_request.side_effect = list
+        with patch("semscrape.backfill.get_redis", return_value=FakeRedis()):
+            call_command("backfill_fetch", stdout=StringIO())
+
+        (rss_entries,) = patched_request.call_args.args
+        self.assertCountEqual(
+            [e.pk for e in rss_entries], [failed.pk, self.rss_entries[2].pk]
+        )
+        failed = models.RSSEntry.objects.get(pk=failed.pk)
+        self.assertEqual(failed.stage, models.RSSEntry.Stage.NEW)
+        self.assertEqual(failed.attempts, 1)
+        leased = models.RSSEntry.objects.get(pk=leased.pk)
+        self.assertEqual(leased.attempts, 2)
+        self.assertEqual(leased.claimed_until, claimed_until)
+        self.assertEqual(models.RSSEntry.objects.claim(failed.stage, 3), [])
+
+    def test_claim_batches(self):
+        """Dispatch batches cover every pending entry exactly once"""
+        batches = list(
+            models.RSSEntry.objects.claim_batches(models.RSSEntry.Stage.NEW, 2)
+        )
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertCountEqual(
+            [pk for batch in batches for pk in batch],
+            [rss_entry.pk for rss_entry in self.rss_entries],
+        )
+
+        models.RSSEntry.objects.filter(pk=self.rss_entries[0].pk).advance(
+            models.RSSEntry.Stage.FETCHED
+        )
+        self.assertEqual(
+            models.RSSEntry.objects.claim(models.RSSEntry.Stage.FETCHED, 2),
+            [self.rss_entries[0].pk],
+        )
+
+    def test_pending_uses_partial_index(self):
+        """The dispatcher queries are served by the pending stage partial indexes"""
+        pending_parse = models.RSSEntry.objects.filter(is_html=True).pending(
+            models.RSSEntry.Stage.FETCHED
+        )
+        with connection.cursor() as cursor:
+            # the tables are tiny in tests, so steer the planner away from seq scans
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                plan = pending_parse[:100].explain()
+            finally:
+                cursor.execute("SET enable_seqscan = on")
+        self.assertIn("rssentry_pending_parse", plan)
+
+    def test_normalize_content_type(self):
+        """Content-Type headers are reduced to their lowercase media type"""
+        rss_entry = models.RSSEntry()
+        rss_entry.set_headers({"content-type": "Text/HTML; charset=UTF-8"})
+        self.assertEqual(
+            (rss_entry.content_type, rss_entry.is_html), ("text/html", True)
+        )
+        rss_entry.set_headers({"Content-Type": "image/gif"})
+        self.assertEqual(
+            (rss_entry.content_type, rss_entry.is_html), ("image/gif", False)
+        )
+        rss_entry.set_headers({})
+        self.assertEqual(rss_entry.content_type, "")
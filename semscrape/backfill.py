@@ -0,0 +1,165 @@
+import multiprocessing
+import time
+from collections import deque
+
+import django
+from django.core.management.base import BaseCommand
+
+from semscrape import metrics
+from semscrape.redis_client import get_redis
+
+# BaseCommand options that are not the command's own, and not picklable
+BASE_OPTIONS = {"stdout", "stderr"}
+
+
+def setup_worker():
+    """Pool initializer, worker processes are spawned without Django set up."""
+    django.setup()
+
+
+class BackfillCommand(BaseCommand):
+    """Base of the chunked, resumable commands that re-run a pipeline stage.
+
+    Rows of `get_queryset` are processed in chunks of primary keys by
+    `process_chunk`, paginated by key rather than offset. The last key of every
+    finished chunk is checkpointed in redis, so an interrupted backfill resumes
+    where it stopped, with the same options. Subclasses define `get_queryset` and
+    `process_chunk`.
+    """
+
+    chunk_size = 500
+
+    def get_queryset(self, options):
+        raise NotImplementedError
+
+    @classmethod
+    def process_chunk(cls, pks, options):
+        """Process the rows of the primary keys, return the count processed."""
+        raise NotImplementedError
+
+    @classmethod
+    def run_chunk(cls, pks, options):
+        processed = cls.process_chunk(pks, options)
+        metrics.flush()
+        return processed
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=self.chunk_size)
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Process chunks in a pool of this many processes.",
+        )
+        parser.add_argument(
+            "--rate", type=float, default=0, help="Limit to this many rows per second."
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Start from the first row rather than the last checkpoint.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Count the rows to process."
+        )
+        # options added by the subclass after these select the rows to process
+        self.runner_options = {action.dest for action in parser._actions}
+
+    def get_checkpoint_key(self, options):
+        """The checkpoint of the command, distinct for each of its own options."""
+        parts = [self.__module__.rsplit(".", 1)[-1]]
+        for name, value in sorted(options.items()):
+            if name in self.runner_options or name in BASE_OPTIONS:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ",".join(sorted(map(str, value)))
+            parts.append(f"{name}={value}")
+        return f"backfill:{':'.join(parts)}:checkpoint"
+
+    def get_checkpoint(self):
+        checkpoint = get_redis().get(self.checkpoint_key)
+        return checkpoint.decode() if checkpoint is not None else None
+
+    def set_checkpoint(self, pk):
+        get_redis().set(self.checkpoint_key, str(pk))
+
+    def chunks(self, queryset, after, chunk_size):
+        """Yield the primary keys of the queryset after `after`, chunk by chunk."""
+        queryset = queryset.order_by("pk").values_list("pk", flat=True)
+        while True:
+            page = queryset.filter(pk__gt=after) if after is not None else queryset
+            pks = list(page[:chunk_size])
+            if not pks:
+                return
+            yield pks
+            after = pks[-1]
+
+    def handle(self, *args, **options):
+        self.checkpoint_key = self.get_checkpoint_key(options)
+        if options["restart"]:
+            get_redis().delete(self.checkpoint_key)
+        after = self.get_checkpoint()
+        queryset = self.get_queryset(options)
+        if after is not None:
+            self.stdout.write(f"Resuming after checkpoint `{after}`")
+
+        remaining = queryset.filter(pk__gt=after) if after is not None else queryset
+        total = remaining.count()
+        if options["dry_run"]:
+            self.stdout.write(f"{total} rows to process")
+            return
+
+        chunk_options = {k: v for (k, v) in options.items() if k not in BASE_OPTIONS}
+        chunks = self.chunks(queryset, after, options["chunk_size"])
+        if options["processes"] <= 1:
+            results = (
+                (pks, self.run_chunk(pks, chunk_options))
+                for pks in self.throttle(chunks, options["rate"])
+            )
+            self.checkpoint(results, total)
+            return
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(options["processes"], initializer=setup_worker) as pool:
+            self.checkpoint(
+                self.map_chunks(pool, chunks, chunk_options, options), total
+            )
+
+    def map_chunks(self, pool, chunks, chunk_options, options):
+        """Yield (pks, result) in chunk order, with a bounded number in flight."""
+        in_flight = deque()
+        for pks in self.throttle(chunks, options["rate"]):
+            result = pool.apply_async(self.run_chunk, (pks, chunk_options))
+            in_flight.append((pks, result))
+            if len(in_flight) >= 2 * options["processes"]:
+                pks, result = in_flight.popleft()
+                yield pks, result.get()
+        while in_flight:
+            pks, result = in_flight.popleft()
+            yield pks, result.get()
+
+    def throttle(self, chunks, rate):
+        """Yield the chunks no faster than `rate` rows per second, if set."""
+        started = time.monotonic()
+        dispatched = 0
+        for pks in chunks:
+            if rate:
+                time.sleep(max(0.0, started + dispatched / rate - time.monotonic()))
+            dispatched += len(pks)
+            yield pks
+
+    def checkpoint(self, results, total):
+        """Checkpoint each finished chunk, in order, and report the progress."""
+        started = time.monotonic()
+        done = 0
+        processed = 0
+        for pks, result in results:
+            self.set_checkpoint(pks[-1])
+            done += len(pks)
+            processed += result or 0
+            rate = done / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f"{done}/{total} rows, {processed} processed, {rate:.1f} rows/s"
+            )
+        get_redis().delete(self.checkpoint_key)
+        self.stdout.write(f"Backfilled {done} rows, {processed} processed")
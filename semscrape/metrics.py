@@ -0,0 +1,162 @@
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from celery.signals import task_postrun
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.http import HttpResponse
+
+from semscrape.redis_client import get_redis
+
+logger = get_task_logger(__name__)
+
+# redis hash of every counter and histogram series, summed over all processes
+METRICS_KEY = "metrics:series"
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+# the series of a histogram in exposition order
+HISTOGRAM_SUFFIXES = ["_bucket", "_sum", "_count"]
+# the `le` label of a bucket, observe() sets it last
+LE_LABEL = re.compile(r'(^|,)le="([^"]*)"$')
+
+# series recorded by this process that are not flushed to redis yet
+_pending = defaultdict(float)
+
+
+def series(name, labels):
+    """Return the Prometheus series name of the metric and labels."""
+    if not labels:
+        return name
+    escaped = {
+        k: str(v).replace("\\", "\\\\").replace('"', '\\"') for (k, v) in labels.items()
+    }
+    return name + "{" + ",".join(f'{k}="{v}"' for (k, v) in escaped.items()) + "}"
+
+
+def incr(name, value=1, **labels):
+    """Add to a counter, buffered until `flush`."""
+    if settings.METRICS_ENABLED:
+        _pending[series(name, labels)] += value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record a value in a cumulative histogram, buffered until `flush`."""
+    if not settings.METRICS_ENABLED:
+        return
+    for bound in buckets:
+        if value <= bound:
+            _pending[series(f"{name}_bucket", {**labels, "le": bound})] += 1
+    _pending[series(f"{name}_bucket", {**labels, "le": "+Inf"})] += 1
+    _pending[series(f"{name}_sum", labels)] += value
+    _pending[series(f"{name}_count", labels)] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the seconds spent in the block in the `name` histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def flush():
+    """Add the buffered series to the totals in redis, in one round trip."""
+    if not _pending:
+        return
+    pending = dict(_pending)
+    _pending.clear()
+    pipe = get_redis().pipeline(transaction=False)
+    for key, value in pending.items():
+        pipe.hincrbyfloat(METRICS_KEY, key, value)
+    try:
+        pipe.execute()
+    except Exception as e:
+        logger.warn(f"Metrics unavailable, dropped {len(pending)} series: {e}")
+
+
+@task_postrun.connect
+def flush_on_task_postrun(**kwargs):
+    """Flush the metrics recorded by a celery task once it is done."""
+    flush()
+
+
+def queue_gauges():
+    """Return the {series: value} depth of each pending stage and celery queue."""
+    from analyzer.indexing import DIRTY_ARTICLES_KEY
+    from crawler.models import RSSEntry
+
+    # the same conditions as the partial indexes of the stage dispatchers
+    pending = {
+        RSSEntry.Stage.NEW: RSSEntry.objects.filter(stage=RSSEntry.Stage.NEW),
+        RSSEntry.Stage.FETCHED: RSSEntry.objects.filter(
+            stage=RSSEntry.Stage.FETCHED, is_html=True
+        ),
+        RSSEntry.Stage.PARSED: RSSEntry.objects.filter(stage=RSSEntry.Stage.PARSED),
+    }
+    gauges = {
+        series("pipeline_pending_entries", {"stage": stage}): rss_entries.count()
+        for (stage, rss_entries) in pending.items()
+    }
+
+    # celery's redis transport keeps each queue in a list of the queue's name
+    queues = {"celery"} | {r["queue"] for r in settings.CELERY_TASK_ROUTES.values()}
+    for queue in sorted(queues):
+        length = get_redis().llen(queue)
+        gauges[series("celery_queue_length", {"queue": queue})] = length
+    gauges["search_index_dirty_articles"] = get_redis().scard(DIRTY_ARTICLES_KEY)
+    return gauges
+
+
+def family(key):
+    """Return the metric family name and type of a series."""
+    name = key.split("{", 1)[0]
+    for suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)], "histogram"
+    return name, "counter"
+
+
+def sort_key(key):
+    """Order series by family and labels, then buckets by bound, _sum and _count."""
+    name, _ = family(key)
+    suffix = key.split("{", 1)[0][len(name) :]
+    labels = key[len(name) + len(suffix) :].strip("{}")
+    bound = 0.0
+    le = LE_LABEL.search(labels) if suffix == "_bucket" else None
+    if le:
+        labels = labels[: le.start()]
+        bound = float(le.group(2))  # +Inf last
+    position = HISTOGRAM_SUFFIXES.index(suffix) if suffix else 0
+    return name, labels, position, bound
+
+
+def render():
+    """Return the metrics in the Prometheus text exposition format."""
+    lines = []
+    samples = [
+        (key.decode(), float(value))
+        for (key, value) in get_redis().hgetall(METRICS_KEY).items()
+    ]
+    current = None
+    for key, value in sorted(samples, key=lambda s: sort_key(s[0])):
+        if family(key) != current:
+            current = family(key)
+            lines.append(f"# TYPE {current[0]} {current[1]}")
+        lines.append(f"{key} {value}")
+
+    current = None
+    for key, value in queue_gauges().items():
+        if key.split("{", 1)[0] != current:
+            current = key.split("{", 1)[0]
+            lines.append(f"# TYPE {current} gauge")
+        lines.append(f"{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint of the pipeline counters, timings and queues."""
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4")
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
+
 import os
 from pathlib import Path
 
@@ -140,15 +141,26 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 # Celery configuration options
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
-CELERY_BROKER_URL = f"redis://{REDIS_HOST}:6379"
+REDIS_URL = f"redis://{REDIS_HOST}:6379"
+CELERY_BROKER_URL = REDIS_URL
+# scratch redis database of benchmark_pipeline runs, flushed after each run
+BENCHMARK_REDIS_DB = int(os.environ.get("BENCHMARK_REDIS_DB", "15"))
 CELERY_TASK_IGNORE_RESULT = True
 CELERY_TIMEZONE = "UTC"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# CPU-bound transformer inference has its own queue and worker pool, so I/O-bound
+# crawling isn't queued behind it, see docker-compose.yml for the workers
+CELERY_TASK_ROUTES = {
+    "analyzer.tasks.compute_sentiment": {"queue": "inference"},
+    "analyzer.tasks.compute_sentiments": {"queue": "inference"},
+    "analyzer.tasks.parse_html_entry": {"queue": "crawl"},
+    "crawler.tasks.*": {"queue": "crawl"},
+}
 CELERY_BEAT_SCHEDULE = {
     "dispatch_rss_feed_crawlers": {
-        "task": "crawler.tasks.dispatch_crawl_feeds",
-        "schedule": 60.0 * 30,
+        "task": "crawler.tasks.dispatch_due_feeds",
+        "schedule": 60.0,
         "args": (),
     },
     "dispatch_rss_entry_crawlers": {
@@ -166,11 +178,118 @@ CELERY_BEAT_SCHEDULE = {
         "schedule": 60.0 * 2,
         "args": (),
     },
+    "flush_search_index": {
+        "task": "analyzer.tasks.flush_search_index",
+        "schedule": 10.0,
+        "args": (),
+    },
 }
 
+# Pipeline work claiming, seconds a claim is held and the attempts per stage
+PIPELINE_CLAIM_LEASE = 60 * 15
+PIPELINE_MAX_ATTEMPTS = 3
+PIPELINE_DISPATCH_LIMIT = 5000
+# tasks of a stage queued or running at once. Fetch chunks beyond the cap are run by
+# the dispatching task, parse and sentiment work is left to the stage dispatchers
+PIPELINE_MAX_IN_FLIGHT = {"fetch": 64, "parse": 256, "sentiment": 32}
+# parse and score fetched entries in the crawl task, from the in-memory HTML, rather
+# than through parse_html_entry and compute_sentiment tasks that read rows back.
+# Inference then runs on the crawl workers, which need the models preloaded and
+# fewer processes, see docker-compose.fused.yml.
+PIPELINE_FUSED = os.environ.get("PIPELINE_FUSED", "False").upper() in ["T", "TRUE"]
+
+# Crawler concurrency, open connections overall and per host for each batch
+CRAWLER_CONCURRENCY = 32
+CRAWLER_CONCURRENCY_PER_HOST = 8
+CRAWLER_TIMEOUT = 8.0
+CRAWLER_BATCH_SIZE = 256
+# feed tasks fan their entries out to fetch tasks of about this many seconds each,
+# sized by the latency observed per host (or the default, for new hosts)
+CRAWLER_CHUNK_SECONDS = 20.0
+CRAWLER_DEFAULT_LATENCY = 1.0
+# seconds a crawl cycle waits on its tasks to complete before it is dropped
+CRAWLER_CYCLE_TTL = 60 * 60 * 6
+# Adaptive feed polling, a feed is due once CRAWLER_FEED_TARGET_ENTRIES new entries
+# are expected at its observed rate, polled within the interval bounds in seconds
+CRAWLER_FEED_MIN_INTERVAL = 60 * 5
+CRAWLER_FEED_MAX_INTERVAL = 60 * 60 * 24
+CRAWLER_FEED_TARGET_ENTRIES = 2.0
+CRAWLER_FEED_RATE_ALPHA = 0.3  # weight of the latest poll in the feed entry rate
+CRAWLER_FEED_JITTER = 0.1  # fraction of the interval the next poll is moved by
+
+# Crawler politeness per host, token bucket requests per second and burst size
+CRAWLER_HOST_RATE = 4.0
+CRAWLER_HOST_BURST = 16
+# seconds a batch waits on a host's tokens, links beyond are deferred
+CRAWLER_HOST_MAX_WAIT = 30.0
+# exponential backoff in seconds after throttled (429/503) or failed requests
+CRAWLER_BACKOFF_BASE = 2.0
+CRAWLER_BACKOFF_MAX = 60 * 10
+CRAWLER_LATENCY_ALPHA = 0.2  # weight of the latest latency in the host average
+CRAWLER_HOST_STATE_TTL = 60 * 60 * 24
+
+# Compressed raw HTML storage, "database" (RawContent table) or "file"
+RAW_CONTENT_STORE = os.environ.get("RAW_CONTENT_STORE", "database")
+RAW_CONTENT_CODEC = "gzip"  # or "zstd", requires zstandard
+RAW_CONTENT_ROOT = os.path.join(BASE_DIR, "raw_content")
+
+# Article extraction from raw HTML, "bs4" (html.parser) or "lxml" (single pass)
+HTML_EXTRACTION_BACKEND = "bs4"
+
+# Sentiment analysis models, loaded once per celery worker process
+SENTENCE_TOKENIZER = "tokenizers/punkt/english.pickle"
+SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+# load the models when a worker process starts, disable for non-inference workers
+SENTIMENT_PRELOAD = os.environ.get("SENTIMENT_PRELOAD", "True").upper() not in [
+    "F",
+    "FALSE",
+]
+# intra-op threads of each inference process, 0 leaves the torch/onnx default
+SENTIMENT_THREADS = int(os.environ.get("SENTIMENT_THREADS", "0"))
+# "torch" (fp32), "quantized" (dynamic int8 torch) or "onnx" (ONNX Runtime)
+SENTIMENT_BACKEND = os.environ.get("SENTIMENT_BACKEND", "torch")
+# exported on the first load of the onnx backend, requires onnxruntime, each
+# model (and its int8 graph) is exported next to it as sentiment-<hash>[-int8].onnx
+SENTIMENT_ONNX_PATH = os.path.join(BASE_DIR, "models", "sentiment.onnx")
+SENTIMENT_ONNX_QUANTIZE = False
+# sentences per padded transformer batch, articles batched together per task
+SENTIMENT_BATCH_SIZE = 32
+SENTIMENT_ARTICLES_PER_TASK = 16
+# padded tokens per batch, batches of long sentences hold fewer sentences
+SENTIMENT_BATCH_TOKENS = 32 * 64
+# sentence preprocessing, longer sentences are split (the model limit is 512)
+SENTENCE_MAX_TOKENS = 128
+SENTENCE_MIN_WORDS = 1
+SENTENCE_MIN_ALPHA_RATIO = 0.5  # of the non-space characters, drops tables etc.
+# "approximate" (regex) or "model" (the sentiment model's tokenizer)
+SENTENCE_TOKEN_COUNTER = "approximate"
+# sentence -> sentiment cache, bump the version to invalidate cached outputs
+SENTIMENT_CACHE_ENABLED = True
+SENTIMENT_CACHE_VERSION = 1
+SENTIMENT_CACHE_LOCAL_SIZE = 50000
+SENTIMENT_CACHE_TTL = 60 * 60 * 24 * 30
+
+# Near-duplicate articles, MinHash signatures of body word shingles and LSH bands
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 32
+MINHASH_SHINGLE_SIZE = 5
+# estimated Jaccard similarity of near-duplicates, candidates compared per article
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NEAR_DUPLICATE_CANDIDATES = 50
+
 # Django Elasticsearch Settings
 ELASTIC_HOST = os.environ.get("ELASTIC_HOST", "localhost")
 ELASTICSEARCH_DSL = {"default": {"hosts": f"{ELASTIC_HOST}:9200"}}
+# Articles are queued on save and bulk indexed by analyzer.tasks.flush_search_index
+ELASTICSEARCH_DSL_AUTOSYNC = False
+SEARCH_INDEX_BATCH_SIZE = 500
+SEARCH_INDEX_FLUSH_SECONDS = 8.0
+
+# Pipeline metrics, buffered per task and summed in redis, scraped from /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").upper() not in [
+    "F",
+    "FALSE",
+]
 
 # Django CORS headers
 CORS_ALLOWED_ORIGINS = [
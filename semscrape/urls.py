@@ -18,11 +18,12 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path, re_path
-from semscrape import root_redir
+from semscrape import metrics, root_redir
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("search/", include(analyzer_urls)),
+    path("metrics", metrics.metrics_view),
 ]
 
 # TODO: Not production ready. Force static files for DEBUG=False.